@@ -49,6 +49,7 @@ from GarbageCollect import RepeatingTimer
 import SensorDb
 from Sensor import Sensor
 import Config
+import DebugFlags
 import Log
 import AccountsManagement
 import AccountsChangePassword
@@ -56,12 +57,20 @@ import GenerateZipFileForDownload
 from Defines import STATUS
 from Defines import ADMIN
 from Defines import OK
+from Defines import NOK
+from Defines import ERROR_MESSAGE
 import SessionLock
 import argparse
 import ResourceDataStreaming
 import DataStreamSharedState
+import StreamingFanout
+import StreamRecorder
+import IngestSpool
+import SensorControl
+import IngestRegistry
 import CaptureDb
 import RecomputeOccupancies
+import Metrics
 import logging
 import pwd
 import os
@@ -84,6 +93,8 @@ app = Flask(__name__, static_url_path="")
 app.static_folder = sbHome + "/flask/static"
 app.template_folder = sbHome + "/flask/templates"
 sockets = Sockets(app)
+Metrics.setService("admin")
+Metrics.instrumentApp(app)
 random.seed()
 
 
@@ -553,11 +564,16 @@ def testArmSensor(sensorId, sessionId):
         persistent = request.args.get("persistent")
         if persistent is None:
             persistent = "false"
-        DataStreamSharedState.sendCommandToSensor(sensorId, json.dumps(
+        result = SensorControl.sendCommandToSensor(sensorId, json.dumps(
             {"sensorId": sensorId,
              "command": "arm",
              "persistent": persistent}))
-        return jsonify({STATUS: OK})
+        if result["status"] not in (SensorControl.DELIVERED,
+                                    SensorControl.QUEUED):
+            return jsonify({STATUS: NOK,
+                            ERROR_MESSAGE: "Command " + result["status"],
+                            "command": result})
+        return jsonify({STATUS: OK, "command": result})
     except:
         print "Unexpected error:", sys.exc_info()[0]
         print sys.exc_info()
@@ -822,7 +838,7 @@ def addInboundPeer(sessionId):
                 abort(403)
             requestStr = request.data
             peerConfig = json.loads(requestStr)
-            util.debugPrint("peerConfig " + json.dumps(peerConfig, indent=4))
+            util.debugPrint(lambda: "peerConfig " + json.dumps(peerConfig, indent=4))
             Config.addInboundPeer(peerConfig)
             peers = Config.getInboundPeers()
             retval = {"inboundPeers": peers}
@@ -865,8 +881,8 @@ def setSystemConfig(sessionId):
                 util.debugPrint("did not verify sys config")
                 return jsonify({"status": "NOK", "ErrorMessage": message})
 
-            util.debugPrint("setSystemConfig " + json.dumps(systemConfig,
-                                                            indent=4, ))
+            util.debugPrint(lambda: "setSystemConfig " +
+                            json.dumps(systemConfig, indent=4))
             if Config.setSystemConfig(systemConfig):
                 return jsonify({"status": "OK"})
             else:
@@ -1169,7 +1185,7 @@ def deleteCaptureEvents(sensorId, startDate, sessionId):
             command = json.dumps({"sensorId": sensorId,
                                   "timestamp": sdate,
                                   "command": "garbage_collect"})
-            DataStreamSharedState.sendCommandToSensor(sensorId, command)
+            SensorControl.sendCommandToSensor(sensorId, command)
             return jsonify({STATUS: "OK"})
     except:
         print "Unexpected error:", sys.exc_info()[0]
@@ -1221,6 +1237,290 @@ def getSessions(sessionId):
     return getSessionsWorker(sessionId)
 
 
+@app.route("/admin/getStreamingStatistics/<sessionId>", methods=["POST"])
+def getStreamingStatistics(sessionId):
+    """
+    Get the live spectrum fan out statistics: frames published and dropped
+    by each streaming sensor band and, for each web server worker with
+    viewers, the frames received, lost and dropped and the delivery latency.
+    For sensors that stream compressed spectrums, the compression ratio and
+    decode cost.
+    """
+    @testcase
+    def getStreamingStatisticsWorker(sessionId):
+        try:
+            if not authentication.checkSessionId(sessionId,
+                                                 ADMIN,
+                                                 updateSessionTimer=False):
+                return make_response("Session not found", 403)
+            memCache = DataStreamSharedState.MemCache()
+            retval = StreamingFanout.getStatistics(memCache)
+            retval["compression"] = []
+            for sensorId in SensorDb.getAllSensorIds():
+                stats = memCache.getCompressionStatistics(sensorId)
+                if stats is not None:
+                    stats = dict(stats)
+                    stats["sensorId"] = sensorId
+                    retval["compression"].append(stats)
+            retval[STATUS] = OK
+            return jsonify(retval)
+        except:
+            print "Unexpected error:", sys.exc_info()[0]
+            print sys.exc_info()
+            traceback.print_exc()
+            util.logStackTrace(sys.exc_info())
+            raise
+
+    return getStreamingStatisticsWorker(sessionId)
+
+
+def _streamRecordingStatus(sensorId, memCache):
+    retval = {}
+    retval["settings"] = memCache.getStreamRecording(sensorId)
+    retval["recordings"] = StreamRecorder.listRecordings(sensorId)
+    retval["recordingDir"] = StreamRecorder.getRecordingDir(sensorId)
+    retval[STATUS] = OK
+    return retval
+
+
+@app.route("/admin/setStreamRecording/<sensorId>/<sessionId>",
+           methods=["POST"])
+def setStreamRecording(sensorId, sessionId):
+    """
+    Turn recording of the raw stream of a sensor on or off. Takes effect
+    when the sensor next connects (see services/common/StreamRecorder.py).
+
+    URL Path:
+        sensorId: the sensor ID.
+        sessionId: the session Id of the login in session.
+
+    Request Body:
+        {"enabled": true, "fileSizeMB": 64, "maxFiles": 16}. fileSizeMB and
+        maxFiles (the retention limit) are optional.
+
+    Returns the settings and the recordings of the sensor, or 400 if
+    fileSizeMB is not between MIN_FILE_SIZE_MB and MAX_FILE_SIZE_MB or
+    maxFiles is less than 1 (see StreamRecorder).
+
+    """
+    @testcase
+    def setStreamRecordingWorker(sensorId, sessionId):
+        try:
+            if not authentication.checkSessionId(sessionId, ADMIN):
+                return make_response("Session not found", 403)
+            requestJson = json.loads(request.data)
+            memCache = DataStreamSharedState.MemCache()
+            if requestJson.get("enabled", False):
+                try:
+                    settings = {
+                        "fileSizeMB": float(requestJson.get(
+                            "fileSizeMB",
+                            StreamRecorder.RECORDING_FILE_SIZE_MB)),
+                        "maxFiles": int(requestJson.get(
+                            "maxFiles", StreamRecorder.RECORDING_MAX_FILES))
+                    }
+                except (TypeError, ValueError):
+                    return make_response("Invalid recording settings", 400)
+                if not StreamRecorder.MIN_FILE_SIZE_MB <= \
+                        settings["fileSizeMB"] <= \
+                        StreamRecorder.MAX_FILE_SIZE_MB:
+                    return make_response("fileSizeMB out of range", 400)
+                if settings["maxFiles"] < 1:
+                    return make_response("maxFiles must be at least 1", 400)
+                memCache.setStreamRecording(sensorId, settings)
+            else:
+                memCache.setStreamRecording(sensorId, None)
+            return jsonify(_streamRecordingStatus(sensorId, memCache))
+        except:
+            print "Unexpected error:", sys.exc_info()[0]
+            print sys.exc_info()
+            traceback.print_exc()
+            util.logStackTrace(sys.exc_info())
+            raise
+
+    return setStreamRecordingWorker(sensorId, sessionId)
+
+
+@app.route("/admin/getStreamRecordings/<sensorId>/<sessionId>",
+           methods=["POST"])
+def getStreamRecordings(sensorId, sessionId):
+    """
+    Get the raw stream recording settings and the recorded files of a
+    sensor (name, size, first and last time stamp).
+    """
+    @testcase
+    def getStreamRecordingsWorker(sensorId, sessionId):
+        try:
+            if not authentication.checkSessionId(sessionId,
+                                                 ADMIN,
+                                                 updateSessionTimer=False):
+                return make_response("Session not found", 403)
+            return jsonify(_streamRecordingStatus(
+                sensorId, DataStreamSharedState.MemCache()))
+        except:
+            print "Unexpected error:", sys.exc_info()[0]
+            print sys.exc_info()
+            traceback.print_exc()
+            util.logStackTrace(sys.exc_info())
+            raise
+
+    return getStreamRecordingsWorker(sensorId, sessionId)
+
+
+@app.route("/admin/getIngestSpool/<sessionId>", methods=["POST"])
+def getIngestSpool(sessionId):
+    """
+    Get the backlog of the local ingest spool (messages received but not
+    yet in the database) for each sensor, and the statistics of the spool
+    drainer (state, messages replayed and rejected, bytes dropped because
+    the spool was full, last database error, replay lag).
+    See services/common/IngestSpool.py.
+    """
+    @testcase
+    def getIngestSpoolWorker(sessionId):
+        try:
+            if not authentication.checkSessionId(sessionId,
+                                                 ADMIN,
+                                                 updateSessionTimer=False):
+                return make_response("Session not found", 403)
+            retval = {STATUS: OK}
+            retval["spools"] = [IngestSpool.getSpoolStatus(sensorId)
+                                for sensorId in
+                                IngestSpool.listSpooledSensors()]
+            retval["drainer"] = \
+                DataStreamSharedState.MemCache().getSpoolStatistics()
+            return jsonify(retval)
+        except:
+            print "Unexpected error:", sys.exc_info()[0]
+            print sys.exc_info()
+            traceback.print_exc()
+            util.logStackTrace(sys.exc_info())
+            raise
+
+    return getIngestSpoolWorker(sessionId)
+
+
+@app.route("/admin/getSensorCommands/<sensorId>/<sessionId>",
+           methods=["POST"])
+def getSensorCommands(sensorId, sessionId):
+    """
+    Get the recent commands sent to a sensor with their outcome (queued,
+    sent, delivered, failed, timeout or rejected) and whether the sensor
+    is connected to the control channel of the node that owns it.
+    See services/common/SensorControl.py.
+    """
+    @testcase
+    def getSensorCommandsWorker(sensorId, sessionId):
+        try:
+            if not authentication.checkSessionId(sessionId,
+                                                 ADMIN,
+                                                 updateSessionTimer=False):
+                return make_response("Session not found", 403)
+            retval = {STATUS: OK}
+            retval["commands"] = SensorControl.getCommandHistory(sensorId)
+            retval["control"] = SensorControl.getControlStatus(
+                SensorControl.getSensorNode(sensorId)).get(sensorId)
+            return jsonify(retval)
+        except:
+            print "Unexpected error:", sys.exc_info()[0]
+            print sys.exc_info()
+            traceback.print_exc()
+            util.logStackTrace(sys.exc_info())
+            raise
+
+    return getSensorCommandsWorker(sensorId, sessionId)
+
+
+@app.route("/admin/getIngestNodes/<sessionId>", methods=["POST"])
+def getIngestNodes(sessionId):
+    """
+    Get the registered ingest nodes (whether they are live, their ports
+    and number of sensors) and the node that owns each streaming sensor.
+    See services/common/IngestRegistry.py.
+    """
+    @testcase
+    def getIngestNodesWorker(sessionId):
+        try:
+            if not authentication.checkSessionId(sessionId,
+                                                 ADMIN,
+                                                 updateSessionTimer=False):
+                return make_response("Session not found", 403)
+            retval = {STATUS: OK}
+            nodes = IngestRegistry.getNodes()
+            for node in nodes:
+                node.pop("controlKey", None)
+            retval["nodes"] = nodes
+            retval["owners"] = IngestRegistry.getOwners()
+            return jsonify(retval)
+        except:
+            print "Unexpected error:", sys.exc_info()[0]
+            print sys.exc_info()
+            traceback.print_exc()
+            util.logStackTrace(sys.exc_info())
+            raise
+
+    return getIngestNodesWorker(sessionId)
+
+
+@app.route("/admin/getConfigCacheStatistics/<sessionId>", methods=["POST"])
+def getConfigCacheStatistics(sessionId):
+    """
+    Get the lookups, version checks and fetches (from the database or
+    memcache) of the process-local copies of the configuration and of the
+    debug flags, summed over all processes.
+    See services/common/VersionedCache.py.
+    """
+    @testcase
+    def getConfigCacheStatisticsWorker(sessionId):
+        try:
+            if not authentication.checkSessionId(sessionId,
+                                                 ADMIN,
+                                                 updateSessionTimer=False):
+                return make_response("Session not found", 403)
+            retval = {STATUS: OK}
+            retval["config"] = Config.getCacheStatistics()
+            retval["debugFlags"] = DebugFlags.getCacheStatistics()
+            return jsonify(retval)
+        except:
+            print "Unexpected error:", sys.exc_info()[0]
+            print sys.exc_info()
+            traceback.print_exc()
+            util.logStackTrace(sys.exc_info())
+            raise
+
+    return getConfigCacheStatisticsWorker(sessionId)
+
+
+@app.route("/admin/getMetrics/<sessionId>", methods=["POST"])
+def getMetrics(sessionId):
+    """
+    Get the counters, gauges and histograms of all the services of this
+    host (streaming, occupancy, spectrumbrowser, admin, federation,
+    spectrumdb, monitoring), keyed by service then by metric name. Each
+    service also exposes its own as text on a local port.
+    See services/common/Metrics.py.
+    """
+    @testcase
+    def getMetricsWorker(sessionId):
+        try:
+            if not authentication.checkSessionId(sessionId,
+                                                 ADMIN,
+                                                 updateSessionTimer=False):
+                return make_response("Session not found", 403)
+            retval = {STATUS: OK}
+            retval["services"] = dict((service, Metrics.collect(service))
+                                      for service in Metrics.getServices())
+            return jsonify(retval)
+        except:
+            print "Unexpected error:", sys.exc_info()[0]
+            print sys.exc_info()
+            traceback.print_exc()
+            util.logStackTrace(sys.exc_info())
+            raise
+
+    return getMetricsWorker(sessionId)
+
+
 @app.route("/admin/freezeRequest/<sessionId>", methods=["POST"])
 def freezeRequest(sessionId):
     @testcase
@@ -1444,6 +1744,7 @@ if __name__ == '__main__':
             Log.loadGwtSymbolMap()
             app.debug = True
             util.debugPrint("Admin service -- starting")
+            Metrics.startMetricsServer()
             if Config.isConfigured():
                 authentication.removeAdminSessions()
                 server = pywsgi.WSGIServer(('0.0.0.0', 8001),
@@ -1460,6 +1761,7 @@ if __name__ == '__main__':
             Log.loadGwtSymbolMap()
             app.debug = True
             util.debugPrint("Admin service -- starting")
+            Metrics.startMetricsServer()
             if Config.isConfigured():
                 authentication.removeAdminSessions()
                 server = pywsgi.WSGIServer(('0.0.0.0', 8001),
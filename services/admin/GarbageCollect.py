@@ -171,6 +171,7 @@ def runGarbageCollector(sensorId):
                         break
 
             DbCollections.dropDailyOccupancyCache(sensorId)
+            DbCollections.dropDayIndex(sensorId)
 
         return {"status": "OK", "sensors": SensorDb.getAllSensors()}
     finally:
@@ -60,7 +60,7 @@ def recomputeOccupanciesWorker(sensorId):
         for locationMessage in locationMessages:
             lid = locationMessage["_id"]
             LocationMessage.clean(locationMessage)
-            util.debugPrint("Location Message " + json.dumps(locationMessage, indent=4))
+            util.debugPrint(lambda: "Location Message " + json.dumps(locationMessage, indent=4))
             DbCollections.getLocationMessages().update(
                 {"_id": lid}, {"$set": locationMessage},
                 upsert=False)
@@ -29,9 +29,13 @@ import traceback
 import json
 import MemCacheKeys
 import memcache
+import Metrics
 from pymongo import MongoClient
 from Bootstrap import getDbHost
 
+VIEWERS = Metrics.gauge("sysmonitor_websockets",
+                        "Websockets streaming resource usage to admins.")
+
 
 def getResourceData(ws):
     """
@@ -41,6 +45,7 @@ def getResourceData(ws):
     Token is of the form <sessionID> => len(parts)==1
 
     """
+    connected = False
     try:
         util.debugPrint("ResourceDataStreaming:getResourceData")
         token = ws.receive()
@@ -55,6 +60,8 @@ def getResourceData(ws):
                 "ResourceDataStreamng:failed to authenticate: user != " +
                 sessionId)
             return
+        connected = True
+        VIEWERS.inc()
 
         memCache = memcache.Client(['127.0.0.1:11211'], debug=0)
         keys = MemCacheKeys.RESOURCEKEYS
@@ -75,8 +82,8 @@ def getResourceData(ws):
             if dbResources is not None and dbResources["Disk"] is not None:
                 resourceData["Disk"] = float(dbResources["Disk"])
 
-            util.debugPrint("resource Data = " + str(json.dumps(resourceData,
-                                                                indent=4)))
+            util.debugPrint(lambda: "resource Data = " +
+                            json.dumps(resourceData, indent=4))
 
             ws.send(json.dumps(resourceData))
             sleepTime = secondsPerFrame
@@ -86,3 +93,6 @@ def getResourceData(ws):
         util.debugPrint("Error writing to resource websocket")
         util.logStackTrace(traceback)
         ws.close()
+    finally:
+        if connected:
+            VIEWERS.dec()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+#This software was developed by employees of the National Institute of
+#Standards and Technology (NIST), and others.
+#This software has been contributed to the public domain.
+#Pursuant to title 15 Untied States Code Section 105, works of NIST
+#employees are not subject to copyright protection in the United States
+#and are considered to be in the public domain.
+#As a result, a formal license is not needed to use this software.
+#
+#This software is provided "AS IS."
+#NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+#OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+#AND DATA ACCURACY.  NIST does not warrant or make any representations
+#regarding the use of the software or the results thereof, including but
+#not limited to the correctness, accuracy, reliability or usefulness of
+#this software.
+'''
+Binary framing for streamed occupancy and power responses.
+
+A stream is the 4 byte magic "MSOD", a little endian 32 bit header length,
+a JSON header and then fixed size records until the end of the stream.
+Each record is a float32 time offset (seconds from the header timeBase)
+followed by one row of rowLength values of the header dtype.
+'''
+
+import struct
+import json
+import numpy as np
+
+MAGIC = "MSOD"
+VERSION = 1
+
+# Number of records to buffer before handing a chunk to the web server.
+RECORDS_PER_CHUNK = 1024
+
+
+def recordDtype(dtype, rowLength):
+    return np.dtype([("t", "<f4"), ("v", np.dtype(dtype).newbyteorder("<"),
+                                    (rowLength, ))])
+
+
+def packHeader(header):
+    header["version"] = VERSION
+    headerStr = json.dumps(header)
+    return MAGIC + struct.pack("<I", len(headerStr)) + headerStr
+
+
+def packRecords(timeOffsets, rows, dtype):
+    """
+    Pack parallel sequences of time offsets and rows into record bytes.
+    """
+    rows = np.asarray(rows)
+    records = np.empty(len(timeOffsets), dtype=recordDtype(dtype,
+                                                            rows.shape[1]))
+    records["t"] = timeOffsets
+    records["v"] = rows
+    return records.tostring()
+
+
+def _readFully(stream, count):
+    buf = ""
+    while len(buf) < count:
+        data = stream.read(count - len(buf))
+        if not data:
+            break
+        buf = buf + data
+    return buf
+
+
+def readHeader(stream):
+    """
+    Read the magic and header from a file like object.
+    Returns the header dictionary.
+    """
+    magic = _readFully(stream, len(MAGIC))
+    if magic != MAGIC:
+        raise ValueError("Not an MSOD binary stream")
+    (headerLength, ) = struct.unpack("<I", _readFully(stream, 4))
+    return json.loads(_readFully(stream, headerLength))
+
+
+def iterRecords(stream, header, recordsPerRead=RECORDS_PER_CHUNK):
+    """
+    Generate (timeOffsets, rows) array pairs from a file like object
+    positioned after the header.
+    """
+    rtype = recordDtype(str(header["dtype"]), header["shape"][1])
+    while True:
+        data = _readFully(stream, rtype.itemsize * recordsPerRead)
+        if len(data) % rtype.itemsize != 0:
+            raise ValueError("Truncated MSOD binary stream")
+        if len(data) == 0:
+            return
+        records = np.frombuffer(data, dtype=rtype)
+        yield records["t"], records["v"]
+        if len(data) < rtype.itemsize * recordsPerRead:
+            return
+
+
+def readBinaryStream(stream):
+    """
+    Read a complete stream. Returns (header, timeOffsets, rows) where
+    timeOffsets is a 1-d array and rows is a 2-d array.
+    """
+    header = readHeader(stream)
+    times = []
+    rows = []
+    for (t, v) in iterRecords(stream, header):
+        times.append(t)
+        rows.append(v)
+    rowLength = header["shape"][1]
+    if len(times) == 0:
+        return header, np.zeros(0, dtype=np.float32), np.zeros(
+            (0, rowLength), dtype=str(header["dtype"]))
+    return header, np.concatenate(times), np.concatenate(rows)
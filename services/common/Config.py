@@ -25,6 +25,7 @@ import sys
 import json
 import memcache
 import util
+import VersionedCache
 from DbCollections import getPeerConfigDb
 from DbCollections import getSysConfigDb
 from DbCollections import getScrConfigDb
@@ -60,12 +61,43 @@ from Defines import MIN_STREAMING_INTER_ARRIVAL_TIME_SECONDS
 from Defines import WARNING_TEXT
 from Defines import ADMIN_CONTACT_NAME
 from Defines import ADMIN_CONTACT_NUMBER
+from Defines import SESSION_RENEW_INTERVAL_SECONDS
 
 mc = memcache.Client(['127.0.0.1:11211'], debug=0)
 global configuration
 configuration = None
 
 
+def fetchSnapshot():
+    return {"sysconfig": getSysConfigDb().find_one({}),
+            "scrconfig": getScrConfigDb().find_one({})}
+
+
+# The system and screen configurations, read by the getters below. Call
+# configChanged after changing them in the database.
+_snapshot = VersionedCache.VersionedCache("config", fetchSnapshot, mc)
+
+
+def getSysConfigSnapshot():
+    """
+    The system configuration (None if not configured) of this process.
+    Do not modify.
+    """
+    return _snapshot.get()["sysconfig"]
+
+
+def getScrConfigSnapshot():
+    return _snapshot.get()["scrconfig"]
+
+
+def configChanged():
+    _snapshot.invalidate()
+
+
+def getCacheStatistics():
+    return _snapshot.getStatistics()
+
+
 def initCache():
     if "_configInitialized" not in globals():
         global _configInitialized
@@ -100,42 +132,42 @@ def writeScrConfig(config):
 
 
 def getApiKey():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return UNKNOWN
     return configuration[API_KEY]
 
 
 def getSmtpServer():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return UNKNOWN
     return configuration[SMTP_SERVER]
 
 
 def getSmtpPort():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return 0
     return configuration[SMTP_PORT]
 
 
 def getSmtpEmail():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None or SMTP_EMAIL_ADDRESS not in configuration:
         return UNKNOWN
     return configuration[SMTP_EMAIL_ADDRESS]
 
 
 def getAdminContactName():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None or ADMIN_CONTACT_NAME not in configuration:
         return UNKNOWN
     return configuration[ADMIN_CONTACT_NAME]
 
 
 def getAdminContactNumber():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None or ADMIN_CONTACT_NUMBER not in configuration:
         return UNKNOWN
     return configuration[ADMIN_CONTACT_NUMBER]
@@ -161,6 +193,7 @@ def getDefaultConfig():
                      ACCOUNT_USER_ACKNOW_HOURS:2,
                      USER_SESSION_TIMEOUT_MINUTES:30,
                      ADMIN_SESSION_TIMEOUT_MINUTES:15,
+                     SESSION_RENEW_INTERVAL_SECONDS:60,
                      ACCOUNT_REQUEST_TIMEOUT_HOURS:48,
                      MIN_STREAMING_INTER_ARRIVAL_TIME_SECONDS:0.5,
                      CERT:"dummy.crt",
@@ -177,17 +210,19 @@ def getDefaultScreenConfig():
 
 
 def getScreenConfig():
-    cfg = getScrConfigDb().find_one({})
+    cfg = getScrConfigSnapshot()
     if cfg is None:
         return getDefaultScreenConfig()
+    cfg = dict(cfg)
     del cfg["_id"]
     return cfg
 
 
 def getUserScreenConfig():
-    cfg = getScrConfigDb().find_one({})
+    cfg = getScrConfigSnapshot()
     if cfg is None:
         return getDefaultScreenConfig()
+    cfg = dict(cfg)
     del cfg["_id"]
     warningTextPath = None
     if WARNING_TEXT in cfg:
@@ -202,7 +237,7 @@ def getUserScreenConfig():
 
 
 def isScrConfigured():
-    cfg = getScrConfigDb().find_one()
+    cfg = getScrConfigSnapshot()
     return cfg is not None
 
 
@@ -217,7 +252,7 @@ def setScreenConfig(configuration):
 
 
 def getMinStreamingInterArrivalTimeSeconds():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return -1
     else:
@@ -229,56 +264,56 @@ def getMinStreamingInterArrivalTimeSeconds():
 
 
 def getMongoDir():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return None
     return configuration[MONGO_DIR]
 
 
 def isAuthenticationRequired():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return False
     return configuration[IS_AUTHENTICATION_REQUIRED]
 
 
 def getUseLDAP():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return False
     return configuration[USE_LDAP]
 
 
 def getNumFailedLoginAttempts():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return -1
     return configuration[ACCOUNT_NUM_FAILED_LOGIN_ATTEMPTS]
 
 
 def getTimeUntilMustChangePasswordDays():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return -1
     return configuration[CHANGE_PASSWORD_INTERVAL_DAYS]
 
 
 def getAccountRequestTimeoutHours():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return -1
     return configuration[ACCOUNT_REQUEST_TIMEOUT_HOURS]
 
 
 def getAccountUserAcknowHours():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return -1
     return configuration[ACCOUNT_USER_ACKNOW_HOURS]
 
 
 def getSoftStateRefreshInterval():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return 30
     else:
@@ -310,14 +345,14 @@ def getESAgents():
 
 
 def getHostName():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return UNKNOWN
     return configuration[HOST_NAME]
 
 
 def getPublicPort():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return 8000
     else:
@@ -325,7 +360,7 @@ def getPublicPort():
 
 
 def getUserSessionTimeoutMinutes():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return 30
     else:
@@ -333,29 +368,42 @@ def getUserSessionTimeoutMinutes():
 
 
 def getAdminSessionTimeoutMinutes():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return 15
     else:
         return configuration[ADMIN_SESSION_TIMEOUT_MINUTES]
 
 
+def getSessionRenewIntervalSeconds():
+    """
+    Minimum seconds between two extensions of the expiry time of a
+    session by the requests that use it.
+    """
+    configuration = getSysConfigSnapshot()
+    if configuration is None or \
+            SESSION_RENEW_INTERVAL_SECONDS not in configuration:
+        return 60
+    else:
+        return configuration[SESSION_RENEW_INTERVAL_SECONDS]
+
+
 def getServerKey():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return UNKNOWN
     return configuration[MY_SERVER_KEY]
 
 
 def getServerId():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return UNKNOWN
     return configuration[MY_SERVER_ID]
 
 
 def isSecure():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return UNKNOWN
     if PROTOCOL in configuration:
@@ -369,6 +417,7 @@ def reloadConfig():
     if getSysConfigDb() is not None:
         configuration = getSysConfigDb().find_one({})
         writeConfig(configuration)
+    configChanged()
 
 
 def reloadScrConfig():
@@ -376,6 +425,7 @@ def reloadScrConfig():
     if getScrConfigDb() is not None:
         configuration = getScrConfigDb().find_one({})
         writeScrConfig(configuration)
+    configChanged()
 
 
 def printSysConfig():
@@ -414,7 +464,7 @@ def verifySystemConfig(sysconfig):
 
 
 def getAccessProtocol():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return UNKNOWN
     return configuration[PROTOCOL]
@@ -568,9 +618,10 @@ def printConfig():
 
 
 def getSystemConfig():
-    cfg = getSysConfigDb().find_one()
+    cfg = getSysConfigSnapshot()
     if cfg is None:
         return cfg
+    cfg = dict(cfg)
     # "PEERS":"Peers.gburg.txt",\
     # "PEER_KEYS":"PeerKeys.gburg.txt"
     if "PEERS" in cfg:
@@ -582,7 +633,7 @@ def getSystemConfig():
 
 
 def isConfigured():
-    cfg = getSysConfigDb().find_one()
+    cfg = getSysConfigSnapshot()
     return cfg is not None
 
 
@@ -593,17 +644,18 @@ def delete_config():
         getPeerConfigDb().peerkeys.remove(peerkey)
     for c in getSysConfigDb().find():
         getSysConfigDb().remove(c)
+    configChanged()
 
 
 def getCertFile():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return UNKNOWN
     return configuration[CERT]
 
 
 def getKeyFile():
-    configuration = getSysConfigDb().find_one({})
+    configuration = getSysConfigSnapshot()
     if configuration is None:
         return UNKNOWN
     dirname = os.path.dirname(os.path.realpath(getCertFile()))
@@ -624,7 +676,7 @@ def getGeneratedDataPath():
 
 
 def isMailServerConfigured():
-    cfg = getSysConfigDb().find_one()
+    cfg = getSysConfigSnapshot()
     if SMTP_SERVER in cfg and cfg[SMTP_SERVER] is not None and cfg[SMTP_SERVER] != UNKNOWN \
        and SMTP_PORT in cfg and cfg[SMTP_PORT] != 0 and \
        SMTP_EMAIL_ADDRESS in cfg and cfg[SMTP_EMAIL_ADDRESS] is not None and cfg[SMTP_EMAIL_ADDRESS] != UNKNOWN:
@@ -20,11 +20,19 @@
 Created on Jun 4, 2015
 
 @author: local
+
+State shared by the processes of a node in memcache. Counters are updated
+with the atomic incr/decr of memcache and structured values with
+check-and-set (casUpdate), never with a get followed by a set. Counts of
+registered stream viewers and occupancy alert subscribers are leases
+(acquireLease, renewLease, releaseLease) that expire unless renewed within
+LEASE_TIME, so the registrations of a process that crashed disappear by
+themselves.
 '''
 import util
 import memcache
 import os
-import socket
+import time
 
 STREAMING_SENSOR_DATA = "streaming_sensordata_"
 STREAMING_DATA_COUNTER = "streaming_dataCounter"
@@ -36,8 +44,40 @@ STREAMING_LAST_DATA_MESSAGE = "streaming_lastDataMessage_"
 STREAMING_TIMESTAMP_PREFIX = "streaming_lastDataSeen_"
 STREAMING_SUBSCRIBER_COUNT = "streaming_subscriberCount"
 STREAMING_SERVER_PID = "streaming_serverPid_"
-SENSOR_ARM_PUBSUB_PORT = "sensor_arm_PubSubPort_"
-STREAMING_COMMAND_DISPATCHER_PID = "streaming_CommandDispatcherPid_"
+STREAMING_FANOUT_STATS = "streaming_fanoutStats_"
+STREAMING_PUBLISHER_STATS = "streaming_publisherStats_"
+STREAMING_REQUESTED_SPECTRUMS_PER_FRAME = "streaming_spectrumsPerFrame_"
+STREAMING_VIEWER_STATS = "streaming_viewerStats_"
+STREAMING_RECORDING = "streaming_recording_"
+INGEST_SPOOL_STATS = "ingest_spoolStats"
+STREAMING_COMPRESSION_STATS = "streaming_compressionStats_"
+
+# Statistics not refreshed within this many seconds expire.
+STATISTICS_EXPIRY = 60
+
+# Leases not renewed within this many seconds expire.
+LEASE_TIME = 60
+
+# Attempts of a check-and-set update before giving up.
+CAS_RETRIES = 20
+
+# First port handed out by getPubSubPort.
+PUBSUB_BASE_PORT = 20000
+
+
+def getClient():
+    """
+    The memcache client of this process, shared by all its MemCache
+    instances (a new one after a fork, so that processes do not share
+    connections).
+    """
+    global _client
+    global _clientPid
+    if "_client" not in globals() or _clientPid != os.getpid():
+        _client = memcache.Client(['127.0.0.1:11211'], debug=0,
+                                  cache_cas=True)
+        _clientPid = os.getpid()
+    return _client
 
 
 class MemCache:
@@ -47,7 +87,7 @@ class MemCache:
     """
 
     def __init__(self):
-        self.mc = memcache.Client(['127.0.0.1:11211'], debug=0)
+        self.mc = getClient()
         self.lastDataMessage = {}
         self.lastdataseen = {}
         self.sensordata = {}
@@ -55,37 +95,76 @@ class MemCache:
         self.dataProducedCounter = {}
         self.dataConsumedCounter = {}
         self.key = os.getpid()
-        self.acquire()
-        try:
-            if self.mc.get(STREAMING_DATA_COUNTER) is None:
-                self.mc.set(STREAMING_DATA_COUNTER, self.dataCounter)
-            if self.mc.get(OCCUPANCY_PORT_COUNTER) is None:
-                self.mc.set(OCCUPANCY_PORT_COUNTER, 0)
-        finally:
-            self.release()
-
-    def acquire(self):
-        return
-
-#counter = 0
-#while True:
-#    self.mc.add("dataStreamingLock", self.key)
-#    val = self.mc.get("dataStreamingLock")
-#    if val == self.key:
-#        break
-#    else:
-#        counter = counter + 1
-#        assert counter < 30, "dataStreamingLock counter exceeded."
-#        time.sleep(0.1)
-
-    def clearLock(self):
-        return
-
-    def isAquired(self):
-        return self.mc.get("dataStreamingLock") is not None
-
-    def release(self):
-        return
+        # add only stores if the key is not there yet.
+        self.mc.add(STREAMING_DATA_COUNTER, self.dataCounter)
+        self.mc.add(OCCUPANCY_PORT_COUNTER, 0)
+
+    def increment(self, key, delta=1):
+        """
+        Atomically add delta to the counter at key (created if missing).
+        Returns the new value.
+        """
+        value = self.mc.incr(key, delta)
+        if value is None:
+            if self.mc.add(key, delta):
+                return delta
+            value = self.mc.incr(key, delta)
+        return value
+
+    def decrement(self, key, delta=1):
+        """
+        Atomically subtract delta from the counter at key; memcache does
+        not go below 0. Returns the new value (None if missing).
+        """
+        return self.mc.decr(key, delta)
+
+    def casUpdate(self, key, update, expiry=0):
+        """
+        Replace the value at key by update(value) (value is None if
+        missing) with check-and-set, retrying when another process
+        changed it in between. Returns the stored value, or None if
+        CAS_RETRIES attempts failed.
+        """
+        for attempt in range(0, CAS_RETRIES):
+            value = self.mc.gets(key)
+            newValue = update(value)
+            if value is None:
+                stored = self.mc.add(key, newValue, time=expiry)
+            else:
+                stored = self.mc.cas(key, newValue, time=expiry)
+            if stored:
+                return newValue
+        util.errorPrint("DataStreamSharedState: cas failed for " + key)
+        return None
+
+    def acquireLease(self, key, leaseId):
+        """
+        Register leaseId under key for LEASE_TIME seconds.
+        """
+        def update(leases):
+            now = time.time()
+            leases = dict((k, v) for (k, v) in (leases or {}).items()
+                          if v > now)
+            leases[leaseId] = now + LEASE_TIME
+            return leases
+        return self.casUpdate(key, update, LEASE_TIME) is not None
+
+    def renewLease(self, key, leaseId):
+        return self.acquireLease(key, leaseId)
+
+    def releaseLease(self, key, leaseId):
+        def update(leases):
+            now = time.time()
+            return dict((k, v) for (k, v) in (leases or {}).items()
+                        if v > now and k != leaseId)
+        self.casUpdate(key, update, LEASE_TIME)
+
+    def countLeases(self, key):
+        leases = self.mc.get(key)
+        if leases is None:
+            return 0
+        now = time.time()
+        return len([v for v in leases.values() if v > now])
 
     def getPID(self):
         if self.key is None:
@@ -171,189 +250,152 @@ class MemCache:
             self.lastdataseen[sensorId + ":" + bandName] = lastdataseen
         return self.lastdataseen
 
-    def getPubSubPort(self, sensorId):
-        self.acquire()
-        try:
-            key = str(OCCUPANCY_PUBSUB_PORT + sensorId).encode("UTF-8")
-            port = self.mc.get(key)
-            if port is not None:
-                return int(port)
-            else:
-                globalPortCounter = int(self.mc.get(OCCUPANCY_PORT_COUNTER))
-                port = 20000 + globalPortCounter
-                globalPortCounter = globalPortCounter + 1
-                self.mc.set(OCCUPANCY_PORT_COUNTER, globalPortCounter)
-                self.mc.set(key, port)
-                return port
-        finally:
-            self.release()
-
-    # The port to arm a sensor.
-    def getSensorArmPort(self, sensorId):
-        self.acquire()
-        try:
-            key = str(SENSOR_ARM_PUBSUB_PORT + sensorId).encode("UTF-8")
-            port = self.mc.get(key)
-            if port is not None:
-                return int(port)
-            else:
-                globalPortCounter = int(self.mc.get(OCCUPANCY_PORT_COUNTER))
-                port = 20000 + globalPortCounter
-                globalPortCounter = globalPortCounter + 1
-                self.mc.set(OCCUPANCY_PORT_COUNTER, globalPortCounter)
-                self.mc.set(key, str(port))
-                return port
-        finally:
-            self.release()
-
-    def releaseSensorArmPort(self, sensorId):
-        self.acquire()
-        try:
-            key = str(SENSOR_ARM_PUBSUB_PORT + sensorId).encode("UTF-8")
-            self.mc.delete(key)
-        finally:
-            self.release()
+    def setFanoutStatistics(self, sensorId, bandName, pid, stats):
+        key = str(STREAMING_FANOUT_STATS + sensorId + ":" + bandName + ":" +
+                  str(pid)).encode("UTF-8")
+        self.mc.set(key, stats, time=STATISTICS_EXPIRY)
 
-    def setStreamingServerPid(self, sensorId):
-        self.acquire()
-        try:
-            pid = os.getpid()
-            key = str(STREAMING_SERVER_PID + sensorId).encode("UTF-8")
-            self.mc.delete(key)
-            self.mc.set(key, str(pid))
-        finally:
-            self.release()
+    def getFanoutStatistics(self, sensorId, bandName, pid):
+        key = str(STREAMING_FANOUT_STATS + sensorId + ":" + bandName + ":" +
+                  str(pid)).encode("UTF-8")
+        return self.mc.get(key)
 
-    def setStreamingCommandDispatcherPid(self, sensorId):
-        self.acquire()
-        try:
-            pid = os.getpid()
-            key = str(STREAMING_COMMAND_DISPATCHER_PID + sensorId).encode("UTF-8")
-            self.mc.delete(key)
-            self.mc.set(key, str(pid))
-        finally:
-            self.release()
+    def setPublisherStatistics(self, sensorId, bandName, stats):
+        key = str(STREAMING_PUBLISHER_STATS + sensorId + ":" +
+                  bandName).encode("UTF-8")
+        self.mc.set(key, stats, time=STATISTICS_EXPIRY)
 
-    def removeStreamingServerPid(self, sensorId):
-        self.acquire()
-        try:
-            key = str(STREAMING_SERVER_PID + sensorId).encode("UTF-8")
-            self.mc.set(key, None)
+    def getPublisherStatistics(self, sensorId, bandName):
+        key = str(STREAMING_PUBLISHER_STATS + sensorId + ":" +
+                  bandName).encode("UTF-8")
+        return self.mc.get(key)
+
+    def setRequestedSpectrumsPerFrame(self, sensorId, bandName, pid,
+                                      spectrumsPerFrame):
+        key = str(STREAMING_REQUESTED_SPECTRUMS_PER_FRAME + sensorId + ":" +
+                  bandName + ":" + str(pid)).encode("UTF-8")
+        if spectrumsPerFrame is None:
             self.mc.delete(key)
-        finally:
-            self.release()
+        else:
+            self.mc.set(key, spectrumsPerFrame)
 
-    def removeStreamingCommandDispatcherPid(self, sensorId):
-        self.acquire()
-        try:
-            key = str(STREAMING_COMMAND_DISPATCHER_PID + sensorId).encode("UTF-8")
-            self.mc.set(key, None)
+    def getRequestedSpectrumsPerFrame(self, sensorId, bandName, pid):
+        key = str(STREAMING_REQUESTED_SPECTRUMS_PER_FRAME + sensorId + ":" +
+                  bandName + ":" + str(pid)).encode("UTF-8")
+        return self.mc.get(key)
+
+    def setViewerStatistics(self, sessionId, stats):
+        key = str(STREAMING_VIEWER_STATS + sessionId).encode("UTF-8")
+        if stats is None:
             self.mc.delete(key)
-        finally:
-            self.release()
+        else:
+            self.mc.set(key, stats, time=STATISTICS_EXPIRY)
+
+    def getViewerStatistics(self, sessionId):
+        key = str(STREAMING_VIEWER_STATS + sessionId).encode("UTF-8")
+        return self.mc.get(key)
+
+    def setStreamRecording(self, sensorId, settings):
+        """
+        Recording settings of a sensor (see StreamRecorder), None to stop
+        recording.
+        """
+        key = str(STREAMING_RECORDING + sensorId).encode("UTF-8")
+        if settings is None:
+            self.mc.delete(key)
+        else:
+            self.mc.set(key, settings)
 
-    def getStreamingServerPid(self, sensorId):
+    def getStreamRecording(self, sensorId):
+        key = str(STREAMING_RECORDING + sensorId).encode("UTF-8")
+        return self.mc.get(key)
+
+    def setCompressionStatistics(self, sensorId, stats):
+        key = str(STREAMING_COMPRESSION_STATS + sensorId).encode("UTF-8")
+        self.mc.set(key, stats, time=STATISTICS_EXPIRY)
+
+    def getCompressionStatistics(self, sensorId):
+        key = str(STREAMING_COMPRESSION_STATS + sensorId).encode("UTF-8")
+        return self.mc.get(key)
+
+    def setSpoolStatistics(self, stats):
+        """
+        Statistics of the ingest spool drainer (see IngestSpool).
+        """
+        self.mc.set(INGEST_SPOOL_STATS, stats, time=STATISTICS_EXPIRY)
+
+    def getSpoolStatistics(self):
+        return self.mc.get(INGEST_SPOOL_STATS)
+
+    def getPubSubPort(self, sensorId):
+        key = str(OCCUPANCY_PUBSUB_PORT + sensorId).encode("UTF-8")
+        port = self.mc.get(key)
+        if port is not None:
+            return int(port)
+        port = PUBSUB_BASE_PORT + self.increment(OCCUPANCY_PORT_COUNTER) - 1
+        if not self.mc.add(key, port):
+            # Another process allocated one for this sensor first.
+            port = self.mc.get(key)
+        return int(port)
+
+    def setStreamingServerPid(self, sensorId):
         key = str(STREAMING_SERVER_PID + sensorId).encode("UTF-8")
-        pid = self.mc.get(key)
-        if pid is None:
-            return -1
-        else:
-            return int(pid)
+        self.mc.set(key, str(os.getpid()))
 
-    def getStreamingCommandDispatcherPid(self, sensorId):
-        key = str(STREAMING_COMMAND_DISPATCHER_PID + sensorId).encode("UTF-8")
+    def removeStreamingServerPid(self, sensorId):
+        key = str(STREAMING_SERVER_PID + sensorId).encode("UTF-8")
+        self.mc.delete(key)
+
+    def getStreamingServerPid(self, sensorId):
+        key = str(STREAMING_SERVER_PID + sensorId).encode("UTF-8")
         pid = self.mc.get(key)
         if pid is None:
             return -1
         else:
             return int(pid)
 
-    def incrementSubscriptionCount(self, sensorId):
-        self.acquire()
-        try:
-            key = str(OCCUPANCY_SUBSCRIPTION_COUNT + sensorId).encode("UTF-8")
-            subscriptionCount = self.mc.get(key)
-            if subscriptionCount is None:
-                self.mc.set(key, 1)
-            else:
-                subscriptionCount = subscriptionCount + 1
-                self.mc.set(key, subscriptionCount)
-        finally:
-            self.release()
+    def addSubscription(self, sensorId, subscriptionId):
+        """
+        Register an occupancy alert subscriber of a sensor. The registration
+        must be renewed (renewSubscription) within LEASE_TIME.
+        """
+        key = str(OCCUPANCY_SUBSCRIPTION_COUNT + sensorId).encode("UTF-8")
+        self.acquireLease(key, subscriptionId)
 
-    def incrementStreamingListenerCount(self, sensorId):
-        self.acquire()
-        try:
-            key = str(STREAMING_SUBSCRIBER_COUNT + sensorId).encode("UTF-8")
-            subscriptionCount = self.mc.get(key)
-            if subscriptionCount is None:
-                self.mc.set(key, 1)
-            else:
-                subscriptionCount = subscriptionCount + 1
-                self.mc.set(key, subscriptionCount)
-        finally:
-            self.release()
+    def renewSubscription(self, sensorId, subscriptionId):
+        key = str(OCCUPANCY_SUBSCRIPTION_COUNT + sensorId).encode("UTF-8")
+        self.renewLease(key, subscriptionId)
 
-    def decrementStreamingListenerCount(self, sensorId):
-        self.acquire()
-        try:
-            key = str(STREAMING_SUBSCRIBER_COUNT + sensorId).encode("UTF-8")
-            subscriptionCount = self.mc.get(key)
-            if subscriptionCount is None:
-                return
-            else:
-                subscriptionCount = subscriptionCount - 1
-                self.mc.set(key, subscriptionCount)
-                if subscriptionCount < 0:
-                    util.errorPrint(
-                        "DataStreaming: negative subscription count! " +
-                        sensorId)
-        finally:
-            self.release()
-
-    def decrementSubscriptionCount(self, sensorId):
-        self.acquire()
-        try:
-            key = str(OCCUPANCY_SUBSCRIPTION_COUNT + sensorId).encode("UTF-8")
-            subscriptionCount = self.mc.get(key)
-            if subscriptionCount is None:
-                return
-            else:
-                subscriptionCount = subscriptionCount - 1
-                self.mc.set(key, subscriptionCount)
-                if subscriptionCount < 0:
-                    util.errorPrint(
-                        "DataStreaming: negative subscription count! " +
-                        sensorId)
-        finally:
-            self.release()
+    def removeSubscription(self, sensorId, subscriptionId):
+        key = str(OCCUPANCY_SUBSCRIPTION_COUNT + sensorId).encode("UTF-8")
+        self.releaseLease(key, subscriptionId)
 
     def getSubscriptionCount(self, sensorId):
         try:
             key = str(OCCUPANCY_SUBSCRIPTION_COUNT + sensorId).encode("UTF-8")
-            subscriptionCount = self.mc.get(key)
-            if subscriptionCount is None:
-                return 0
-            else:
-                return int(subscriptionCount)
+            return self.countLeases(key)
         except:
             return 0
 
+    def addStreamingListener(self, sensorId, listenerId):
+        """
+        Register a viewer of the stream of a sensor. The registration must
+        be renewed (renewStreamingListener) within LEASE_TIME.
+        """
+        key = str(STREAMING_SUBSCRIBER_COUNT + sensorId).encode("UTF-8")
+        self.acquireLease(key, listenerId)
+
+    def renewStreamingListener(self, sensorId, listenerId):
+        key = str(STREAMING_SUBSCRIBER_COUNT + sensorId).encode("UTF-8")
+        self.renewLease(key, listenerId)
+
+    def removeStreamingListener(self, sensorId, listenerId):
+        key = str(STREAMING_SUBSCRIBER_COUNT + sensorId).encode("UTF-8")
+        self.releaseLease(key, listenerId)
+
     def getStreamingListenerCount(self, sensorId):
         try:
             key = str(STREAMING_SUBSCRIBER_COUNT + sensorId).encode("UTF-8")
-            subscriptionCount = self.mc.get(key)
-            if subscriptionCount is None:
-                return 0
-            else:
-                return subscriptionCount
+            return self.countLeases(key)
         except:
             return 0
-
-
-def sendCommandToSensor(sensorId, command):
-    memCache = MemCache()
-    port = memCache.getSensorArmPort(sensorId)
-    soc = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    soc.sendto(command, ("localhost", port))
-    soc.close()
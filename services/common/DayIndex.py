@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+#
+#This software was developed by employees of the National Institute of
+#Standards and Technology (NIST), and others.
+#This software has been contributed to the public domain.
+#Pursuant to title 15 Untied States Code Section 105, works of NIST
+#employees are not subject to copyright protection in the United States
+#and are considered to be in the public domain.
+#As a result, a formal license is not needed to use this software.
+#
+#This software is provided "AS IS."
+#NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+#OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+#AND DATA ACCURACY.  NIST does not warrant or make any representations
+#regarding the use of the software or the results thereof, including but
+#not limited to the correctness, accuracy, reliability or usefulness of
+#this software.
+'''
+Per sensor index of the local days that contain data.
+
+There is one entry per (location message, frequency band, local day)
+holding the day boundary, the number of acquisitions and the first and
+last acquisition times of that day. It is updated as data messages are
+inserted so that day navigation and acquisition counts are a single small
+lookup instead of queries over the data messages.
+
+The index is created empty with the sensor. It is dropped by the garbage
+collector and rebuilt from the data messages the first time it is read
+(also how the sensors that predate it get theirs). A rebuild is written
+to a collection of its own and renamed into place, ending with the
+BUILT marker, so it never mixes with the increments of the inserts. An
+index without the marker (recreated by an insert after a drop) is
+rebuilt when read. While the index is missing, inserts leave it alone:
+the rebuild counts their data messages.
+'''
+
+import DbCollections
+import timezone
+import pymongo
+import util
+import os
+from bson.objectid import ObjectId
+from Defines import FREQ_RANGE
+from Defines import LOCATION_MESSAGE_ID
+from Defines import TIME_ZONE_KEY
+from Defines import TIME
+from Defines import COUNT
+
+DAY_BOUNDARY = "dayBoundaryTimeStamp"
+FIRST_TIME = "tFirst"
+LAST_TIME = "tLast"
+
+# _id of the document marking a complete index.
+BUILT = "built"
+
+
+def _getIndex(sensorId):
+    index = DbCollections.getDayIndex(sensorId)
+    if index.find_one({"_id": BUILT}) is None:
+        rebuild(sensorId)
+    return index
+
+
+def create(sensorId):
+    """
+    Create the index of a new sensor.
+    """
+    rebuild(sensorId)
+
+
+def rebuild(sensorId):
+    """
+    Rebuild the day index of a sensor from its data messages.
+    """
+    util.debugPrint("DayIndex.rebuild " + sensorId)
+    timeZones = {}
+    days = {}
+    cur = DbCollections.getDataMessages(sensorId).find(
+        {}, {TIME: 1, FREQ_RANGE: 1, LOCATION_MESSAGE_ID: 1})
+    for msg in cur:
+        locationMessageId = msg[LOCATION_MESSAGE_ID]
+        if locationMessageId not in timeZones:
+            locationMessage = DbCollections.getLocationMessages().find_one(
+                {"_id": ObjectId(locationMessageId)})
+            if locationMessage is None:
+                continue
+            timeZones[locationMessageId] = locationMessage[TIME_ZONE_KEY]
+        t = msg[TIME]
+        dayBoundary = timezone.getDayBoundaryTimeStampFromUtcTimeStamp(
+            t, timeZones[locationMessageId])
+        key = (locationMessageId, msg[FREQ_RANGE], dayBoundary)
+        if key in days:
+            day = days[key]
+            day[COUNT] = day[COUNT] + 1
+            day[FIRST_TIME] = min(day[FIRST_TIME], t)
+            day[LAST_TIME] = max(day[LAST_TIME], t)
+        else:
+            days[key] = {COUNT: 1, FIRST_TIME: t, LAST_TIME: t}
+    name = "dayIndexBuild." + sensorId + "." + str(os.getpid())
+    index = DbCollections.createDayIndex(name)
+    for ((locationMessageId, freqRange, dayBoundary), day) in days.items():
+        day[LOCATION_MESSAGE_ID] = locationMessageId
+        day[FREQ_RANGE] = freqRange
+        day[DAY_BOUNDARY] = dayBoundary
+        index.insert(day)
+    index.insert({"_id": BUILT})
+    index.rename("dayIndex." + sensorId, dropTarget=True)
+    DbCollections.setDayIndexExists(sensorId, True)
+
+
+def addAcquisition(sensorId, locationMessage, freqRange, t):
+    """
+    Record a data message inserted at time t for the given location
+    message and band.
+    """
+    if not DbCollections.hasDayIndex(sensorId):
+        # Rebuilt from the data messages, this one included, when read.
+        return
+    dayBoundary = timezone.getDayBoundaryTimeStampFromUtcTimeStamp(
+        t, locationMessage[TIME_ZONE_KEY])
+    DbCollections.getDayIndex(sensorId).update(
+        {LOCATION_MESSAGE_ID: str(locationMessage["_id"]),
+         FREQ_RANGE: freqRange,
+         DAY_BOUNDARY: dayBoundary},
+        {"$inc": {COUNT: 1},
+         "$min": {FIRST_TIME: t},
+         "$max": {LAST_TIME: t}},
+        upsert=True)
+
+
+def _query(freqRange, locationMessageId):
+    query = {FREQ_RANGE: freqRange}
+    if locationMessageId is not None:
+        query[LOCATION_MESSAGE_ID] = locationMessageId
+    return query
+
+
+def getDays(sensorId, freqRange, startTime, endTime, locationMessageId=None):
+    """
+    Get the index entries with day boundaries in [startTime, endTime)
+    sorted by day. If locationMessageId is None all locations are included.
+    """
+    query = _query(freqRange, locationMessageId)
+    query[DAY_BOUNDARY] = {"$gte": startTime, "$lt": endTime}
+    return list(_getIndex(sensorId).find(query).sort(DAY_BOUNDARY,
+                                                      pymongo.ASCENDING))
+
+
+def getFirstDayEndingAfter(sensorId, freqRange, t, locationMessageId=None,
+                           inclusive=False):
+    """
+    Get the earliest day holding an acquisition after t (at or after t if
+    inclusive) or None if there is none.
+    """
+    query = _query(freqRange, locationMessageId)
+    query[LAST_TIME] = {"$gte" if inclusive else "$gt": t}
+    cur = _getIndex(sensorId).find(query).sort(DAY_BOUNDARY,
+                                               pymongo.ASCENDING).limit(1)
+    for day in cur:
+        return day
+    return None
+
+
+def getLastDayStartingBefore(sensorId, freqRange, t, locationMessageId=None):
+    """
+    Get the latest day holding an acquisition before t or None if there
+    is none.
+    """
+    query = _query(freqRange, locationMessageId)
+    query[FIRST_TIME] = {"$lt": t}
+    cur = _getIndex(sensorId).find(query).sort(DAY_BOUNDARY,
+                                               pymongo.DESCENDING).limit(1)
+    for day in cur:
+        return day
+    return None
+
+
+def getNextDayBoundary(sensorId, freqRange, t, default,
+                       locationMessageId=None, inclusive=False):
+    """
+    Day boundary of the first acquisition after t, or default.
+    """
+    day = getFirstDayEndingAfter(sensorId, freqRange, t, locationMessageId,
+                                 inclusive)
+    if day is None:
+        return default
+    return day[DAY_BOUNDARY]
+
+
+def getPrevDayBoundary(sensorId, freqRange, t, default,
+                       locationMessageId=None):
+    """
+    Day boundary of the last acquisition before t, or default.
+    """
+    day = getLastDayStartingBefore(sensorId, freqRange, t, locationMessageId)
+    if day is None:
+        return default
+    return day[DAY_BOUNDARY]
@@ -104,6 +104,69 @@ def dropDailyOccupancyCache(sensorId):
     getSpectrumDb().drop_collection("dailyOccupancy." + sensorId)
 
 
+# Seconds a missing day index is remembered before listing the
+# collections again.
+DAY_INDEX_CHECK_INTERVAL = 10
+
+
+def hasDayIndex(sensorId):
+    """
+    Whether the day index collection of the sensor exists. Existing ones
+    are remembered by the process (an index dropped by another process
+    is recreated without its completion marker, see DayIndex), missing
+    ones for DAY_INDEX_CHECK_INTERVAL.
+    """
+    global _dayIndexes
+    global _missingDayIndexes
+    if "_dayIndexes" not in globals():
+        _dayIndexes = set()
+        _missingDayIndexes = {}
+    if sensorId in _dayIndexes:
+        return True
+    checkTime = _missingDayIndexes.get(sensorId)
+    if checkTime is not None and \
+            time.time() - checkTime < DAY_INDEX_CHECK_INTERVAL:
+        return False
+    if "dayIndex." + sensorId in getSpectrumDb().collection_names():
+        _missingDayIndexes.pop(sensorId, None)
+        _dayIndexes.add(sensorId)
+        return True
+    _missingDayIndexes[sensorId] = time.time()
+    return False
+
+
+def getDayIndex(sensorId):
+    return getSpectrumDb()["dayIndex." + sensorId]
+
+
+def createDayIndex(name):
+    """
+    Create a collection with the indexes of a day index (built under a
+    temporary name and renamed into place by DayIndex.rebuild).
+    """
+    getSpectrumDb().drop_collection(name)
+    getSpectrumDb().create_collection(name)
+    getSpectrumDb()[name].create_index(
+        [("freqRange", pymongo.ASCENDING),
+         ("dayBoundaryTimeStamp", pymongo.ASCENDING)])
+    return getSpectrumDb()[name]
+
+
+def setDayIndexExists(sensorId, exists):
+    hasDayIndex(sensorId)
+    if exists:
+        _missingDayIndexes.pop(sensorId, None)
+        _dayIndexes.add(sensorId)
+    else:
+        _dayIndexes.discard(sensorId)
+        _missingDayIndexes[sensorId] = time.time()
+
+
+def dropDayIndex(sensorId):
+    getSpectrumDb().drop_collection("dayIndex." + sensorId)
+    setDayIndexExists(sensorId, False)
+
+
 def getUnprocessedDataMessages(sensorId):
     if "unProcessedDataMessages." + sensorId in getSpectrumDb().collection_names():
         return getSpectrumDb()["unProcessedDataMessages." + sensorId]
@@ -144,6 +207,18 @@ def getSensors():
     return admindb.sensors
 
 
+def getIngestNodes():
+    initConnections()
+    global admindb
+    return admindb.ingestNodes
+
+
+def getSensorOwners():
+    initConnections()
+    global admindb
+    return admindb.sensorOwners
+
+
 def getTempSensorsCollection():
     initConnections()
     global admindb
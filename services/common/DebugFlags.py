@@ -26,6 +26,7 @@ import logging
 import memcache
 import Bootstrap
 import util
+import VersionedCache
 from Defines import STATIC_GENERATED_FILE_LOCATION
 sbHome = Bootstrap.getSpectrumBrowserHome()
 
@@ -44,6 +45,11 @@ debugRelaxedPasswords = False
 if "mc" not in globals():
     mc = memcache.Client(['127.0.0.1:11211'], debug=0)
 
+# The debug flags as seen by this process (see VersionedCache).
+if "_debugFlags" not in globals():
+    _debugFlags = VersionedCache.VersionedCache(
+        "debugFlags", lambda: mc.get("MSOD_DEBUG_FLAGS"), mc)
+
 
 def setDefaults():
     global mc
@@ -56,11 +62,11 @@ def setDefaults():
     if not os.path.exists(dirname):
         os.makedirs(dirname)
     mc.set("MSOD_DEBUG_FLAGS", debugFlagDefaults)
+    _debugFlags.invalidate()
 
 
 def getEnvBoolean(envVarName, override):
-    global mc
-    debugFlags = mc.get("MSOD_DEBUG_FLAGS")
+    debugFlags = _debugFlags.get()
     if debugFlags is None:
         return override
     if envVarName not in debugFlags:
@@ -83,13 +89,18 @@ def getDebugFlag():
 
 
 def getDebugFlags():
-    global mc
-    return mc.get("MSOD_DEBUG_FLAGS")
+    return _debugFlags.get()
 
 
 def setDebugFlags(debugFlags):
     global mc
-    return mc.set("MSOD_DEBUG_FLAGS", debugFlags)
+    retval = mc.set("MSOD_DEBUG_FLAGS", debugFlags)
+    _debugFlags.invalidate()
+    return retval
+
+
+def getCacheStatistics():
+    return _debugFlags.getStatistics()
 
 
 def getLogLevel():
@@ -87,6 +87,7 @@ ACCOUNT_REQUEST_TIMEOUT_HOURS = "ACCOUNT_REQUEST_TIMEOUT_HOURS"
 ACCOUNT_USER_ACKNOW_HOURS = "ACCOUNT_USER_ACKNOW_HOURS"
 USER_SESSION_TIMEOUT_MINUTES = "USER_SESSION_TIMEOUT_MINUTES"
 ADMIN_SESSION_TIMEOUT_MINUTES = "ADMIN_SESSION_TIMEOUT_MINUTES"
+SESSION_RENEW_INTERVAL_SECONDS = "SESSION_RENEW_INTERVAL_SECONDS"
 CERT = "CERT"
 PRIV_KEY = "PRIV_KEY"
 MIN_STREAMING_INTER_ARRIVAL_TIME_SECONDS = "MIN_STREAMING_INTER_ARRIVAL_TIME_SECONDS"
@@ -95,6 +96,7 @@ USER = "user"
 SPECTRUMS_PER_FRAME = "_spectrumsPerFrame"
 TIME_PER_MEASUREMENT = "timePerMeasurement"
 STREAMING_FILTER = "streamingFilter"
+STREAM_COMPRESSION = "Compression"
 
 # accounts
 ACCOUNT_EMAIL_ADDRESS = "emailAddress"
@@ -141,6 +143,11 @@ SERVICE_NAME = "serviceName"
 
 # Streaming filter types
 MAX_HOLD = "MAX_HOLD"
+MEAN = "MEAN"
+
+# Decimation methods for long time range queries.
+MIN_MAX = "MIN_MAX"
+DECIMATION_METHODS = [MAX_HOLD, MEAN, MIN_MAX]
 
 TIME_ZONE_KEY = "TimeZone"
 
@@ -155,6 +162,7 @@ SECONDS_PER_DAY = MINUTES_PER_DAY * 60
 MILISECONDS_PER_DAY = SECONDS_PER_DAY * MILISECONDS_PER_SECOND
 STREAMING_SERVER_PORT = 9000
 OCCUPANCY_ALERT_PORT = 9001
+SENSOR_CONTROL_PORT = 9050
 UNDER_CUTOFF_COLOR = '#D6D6DB'
 OVER_CUTOFF_COLOR = '#000000'
 MAP_WIDTH = "mapWidth"
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+#
+#This software was developed by employees of the National Institute of
+#Standards and Technology (NIST), and others.
+#This software has been contributed to the public domain.
+#Pursuant to title 15 Untied States Code Section 105, works of NIST
+#employees are not subject to copyright protection in the United States
+#and are considered to be in the public domain.
+#As a result, a formal license is not needed to use this software.
+#
+#This software is provided "AS IS."
+#NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+#OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+#AND DATA ACCURACY.  NIST does not warrant or make any representations
+#regarding the use of the software or the results thereof, including but
+#not limited to the correctness, accuracy, reliability or usefulness of
+#this software.
+'''
+Registry of the ingest nodes and of the sensors each of them owns.
+
+An ingest node is a streaming server (with its sensor control router and
+occupancy alert broker). Several of them, on one or more hosts, can share
+the sensors: each registers itself in the ingestNodes collection and keeps
+it fresh (runHeartbeat, every HEARTBEAT_INTERVAL); a node whose heartbeat
+is older than NODE_TIMEOUT is gone. A sensor is owned by the node it is connected to (sensorOwners
+collection, claimed when it connects, released when it disconnects).
+
+Sensors, alert subscribers, viewers and commands are routed with
+getNodeForSensor: the live owner, else the live node with the fewest
+sensors. When a node goes away its sensors lose their connection, ask
+again where to connect and are claimed by the node they are sent to; the
+heartbeat of the remaining nodes cleans up after the dead one.
+
+A node with no host registered is reached at the host the client already
+uses (the single host setup).
+'''
+
+import os
+import sys
+import socket
+import time
+from pymongo.errors import PyMongoError
+import util
+import DbCollections
+
+# Seconds between heartbeats, and without one before a node is gone.
+HEARTBEAT_INTERVAL = 5
+NODE_TIMEOUT = 20
+
+# Gone nodes stay listed (for the admin) this long.
+DEAD_NODE_EXPIRY = 3600
+
+NODE_ID = "nodeId"
+
+
+def setLocalNodeId(nodeId):
+    """
+    Set by the streaming server at startup; inherited by its processes.
+    """
+    global _localNodeId
+    _localNodeId = nodeId
+
+
+def getLocalNodeId():
+    if "_localNodeId" not in globals():
+        setLocalNodeId(socket.gethostname())
+    return _localNodeId
+
+
+def registerNode(node):
+    """
+    Add or refresh the record of the local node: host (or None),
+    streamingPort, controlPort, controlKey, alertPort and webUrl (or None).
+    """
+    node = dict(node)
+    node["_id"] = getLocalNodeId()
+    node[NODE_ID] = getLocalNodeId()
+    node["pid"] = os.getpid()
+    node["heartbeat"] = time.time()
+    DbCollections.getIngestNodes().update({"_id": node["_id"]}, node,
+                                          upsert=True)
+
+
+def unregisterNode():
+    """
+    Remove the local node and release its sensors (clean shutdown).
+    """
+    DbCollections.getSensorOwners().remove({NODE_ID: getLocalNodeId()})
+    DbCollections.getIngestNodes().remove({"_id": getLocalNodeId()})
+
+
+def isLive(node, now=None):
+    if now is None:
+        now = time.time()
+    return now - node["heartbeat"] < NODE_TIMEOUT
+
+
+def getNodes():
+    """
+    All registered nodes, with a "live" flag and their number of sensors.
+    """
+    now = time.time()
+    counts = {}
+    for owner in DbCollections.getSensorOwners().find():
+        counts[owner[NODE_ID]] = counts.get(owner[NODE_ID], 0) + 1
+    retval = []
+    for node in DbCollections.getIngestNodes().find():
+        del node["_id"]
+        node["live"] = isLive(node, now)
+        node["sensors"] = counts.get(node[NODE_ID], 0)
+        retval.append(node)
+    return retval
+
+
+def getLiveNodes():
+    return [node for node in getNodes() if node["live"]]
+
+
+def claimSensor(sensorId):
+    """
+    The sensor connected to this node: it is the owner now.
+    """
+    DbCollections.getSensorOwners().update(
+        {"_id": sensorId},
+        {"_id": sensorId, NODE_ID: getLocalNodeId(), "since": time.time()},
+        upsert=True)
+
+
+def releaseSensor(sensorId):
+    """
+    The sensor disconnected, unless it already moved to another node.
+    """
+    DbCollections.getSensorOwners().remove({"_id": sensorId,
+                                            NODE_ID: getLocalNodeId()})
+
+
+def getOwners():
+    return dict((owner["_id"], owner[NODE_ID])
+                for owner in DbCollections.getSensorOwners().find())
+
+
+def getNodeForSensor(sensorId):
+    """
+    The node that owns the sensor, or the one it should connect to, or
+    None when no node is running.
+    """
+    nodes = getLiveNodes()
+    if len(nodes) == 0:
+        return None
+    owner = DbCollections.getSensorOwners().find_one({"_id": sensorId})
+    if owner is not None:
+        for node in nodes:
+            if node[NODE_ID] == owner[NODE_ID]:
+                return node
+    nodes.sort(key=lambda node: (node["sensors"], node[NODE_ID]))
+    return nodes[0]
+
+
+def reapDeadNodes():
+    """
+    Release the sensors of the nodes that are gone and forget nodes gone
+    for DEAD_NODE_EXPIRY.
+    """
+    now = time.time()
+    for node in DbCollections.getIngestNodes().find():
+        if isLive(node, now):
+            continue
+        released = DbCollections.getSensorOwners().remove(
+            {NODE_ID: node[NODE_ID]})
+        if released is not None and released.get("n", 0) != 0:
+            util.errorPrint("IngestRegistry: node " + node[NODE_ID] +
+                            " is gone, released " + str(released["n"]) +
+                            " sensors")
+        if now - node["heartbeat"] > DEAD_NODE_EXPIRY:
+            DbCollections.getIngestNodes().remove({"_id": node["_id"]})
+
+
+def claimConnectedSensors(sensorIds):
+    """
+    Claim again the sensors connected to this node whose ownership was
+    released while the node was taken for gone.
+    """
+    owners = getOwners()
+    for sensorId in sensorIds:
+        if owners.get(sensorId) != getLocalNodeId():
+            claimSensor(sensorId)
+
+
+def runHeartbeat(node, getConnectedSensors):
+    """
+    Entry point of the heartbeat process of a node. getConnectedSensors
+    returns the IDs of the sensors connected to the node.
+    """
+    while True:
+        try:
+            registerNode(node)
+            claimConnectedSensors(getConnectedSensors())
+            reapDeadNodes()
+        except PyMongoError:
+            # Keep trying; the node is gone for the others meanwhile.
+            util.errorPrint("IngestRegistry: heartbeat failed " +
+                            str(sys.exc_info()[1]))
+        time.sleep(HEARTBEAT_INTERVAL)
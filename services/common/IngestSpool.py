@@ -0,0 +1,533 @@
+# -*- coding: utf-8 -*-
+#
+#This software was developed by employees of the National Institute of
+#Standards and Technology (NIST), and others.
+#This software has been contributed to the public domain.
+#Pursuant to title 15 Untied States Code Section 105, works of NIST
+#employees are not subject to copyright protection in the United States
+#and are considered to be in the public domain.
+#As a result, a formal license is not needed to use this software.
+#
+#This software is provided "AS IS."
+#NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+#OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+#AND DATA ACCURACY.  NIST does not warrant or make any representations
+#regarding the use of the software or the results thereof, including but
+#not limited to the correctness, accuracy, reliability or usefulness of
+#this software.
+'''
+Local write-ahead spool for the messages of the sensors.
+
+The streaming server and the upload service append the location, system
+and data messages they receive to per sensor segment files in
+SPOOL_DIR/<sensorId> instead of writing them to the database directly.
+A single drainer process (runDrainer) replays the segments into MongoDB
+in order with populate_db.put_data, keeping its position in a cursor
+file. While the database is unreachable the drainer backs off and the
+spool grows, up to SPOOL_MAX_MB per sensor (oldest segments dropped
+first); once the database is back it catches up on its own.
+
+A message replayed twice (the drainer stopped between the insert and
+the cursor update) is recognized by its key (sensor, type and time
+stamp) and not inserted again by populate_db.
+
+Segment layout: SEGMENT_HEADER, then records of RECORD_HEADER (body
+length, header length, crc32 of body, flags, time spooled) followed by
+the body, the json header of the message followed by its data.
+'''
+
+import os
+import fcntl
+import json
+import struct
+import time
+import binascii
+import traceback
+import sys
+import numpy as np
+from pymongo.errors import PyMongoError
+import util
+import populate_db
+import Metrics
+from DataStreamSharedState import MemCache
+from Defines import SENSOR_ID
+
+SPOOL_DIR = "/var/tmp/msod-spool"
+
+# Segment rotation and total size allowed per sensor.
+SEGMENT_SIZE_MB = 16
+SPOOL_MAX_MB = 1024
+
+# Writers fsync at most this often (records in between share the fsync).
+FSYNC_INTERVAL = 1.0
+
+# Drainer settings.
+DRAIN_BATCH = 100
+DRAIN_POLL_INTERVAL = 1.0
+DRAIN_MAX_RETRY_INTERVAL = 60
+SPOOL_STATISTICS_INTERVAL = 10
+
+SEGMENT_MAGIC = "MSSP"
+SEGMENT_VERSION = 1
+SEGMENT_HEADER = struct.Struct("<4sI")
+RECORD_HEADER = struct.Struct("<IIIBd")
+
+# The data of the record are int8 power values to pass as powers=.
+POWERS_FLAG = 1
+
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor"
+LOCK_FILE = "lock"
+DRAINER_LOCK_FILE = "drainer.lock"
+
+# Upper bounds (seconds) of the buckets of the ingest lag.
+LAG_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+SPOOLED = Metrics.counter("spool_appended_total",
+                          "Messages appended to the ingest spool.")
+REPLAYED = Metrics.counter("spool_replayed_total",
+                           "Spooled messages inserted into the database.")
+REJECTED = Metrics.counter("spool_rejected_total",
+                           "Spooled messages the database rejected.")
+DROPPED_BYTES = Metrics.counter("spool_dropped_bytes_total",
+                                "Bytes of spool dropped over SPOOL_MAX_MB.")
+DB_RETRIES = Metrics.counter("spool_database_retries_total",
+                             "Drain attempts failed on a database error.")
+BACKLOG_BYTES = Metrics.gauge("spool_backlog_bytes",
+                              "Size of the spool files of all sensors.")
+INSERT_LAG = Metrics.histogram("spool_insert_lag_seconds",
+                               "Time from spooling to database insert.",
+                               LAG_BUCKETS)
+INSERT_TIME = Metrics.histogram("spool_insert_seconds",
+                                "Duration of the database inserts.")
+
+
+def isValidSensorId(sensorId):
+    """
+    The sensor ID is used as a directory name.
+    """
+    return (isinstance(sensorId, basestring) and sensorId != "" and
+            os.path.basename(sensorId) == sensorId and
+            not sensorId.startswith("."))
+
+
+def getSpoolDir(sensorId):
+    return os.path.join(SPOOL_DIR, sensorId)
+
+
+def makeDirs(directory):
+    if not os.path.exists(directory):
+        try:
+            os.makedirs(directory, 0700)
+        except OSError:
+            # Another process created it.
+            pass
+
+
+def listSegments(directory):
+    """
+    The segment file names of a spool directory, oldest first.
+    """
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    return sorted(name for name in names if name.endswith(SEGMENT_SUFFIX))
+
+
+def listSpooledSensors():
+    try:
+        names = os.listdir(SPOOL_DIR)
+    except OSError:
+        return []
+    return sorted(name for name in names
+                  if os.path.isdir(os.path.join(SPOOL_DIR, name)))
+
+
+def readCursor(directory):
+    try:
+        with open(os.path.join(directory, CURSOR_FILE)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def writeCursor(directory, segment, offset):
+    path = os.path.join(directory, CURSOR_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"segment": segment, "offset": offset}, f)
+    os.rename(path + ".tmp", path)
+
+
+def getCursor(directory, segments):
+    """
+    The (segment, offset) of the next record to replay. Starts at the
+    oldest segment if the one of the cursor was dropped.
+    """
+    cursor = readCursor(directory)
+    if cursor is None or cursor["segment"] not in segments:
+        return (segments[0], SEGMENT_HEADER.size)
+    return (cursor["segment"], cursor["offset"])
+
+
+def readRecord(f):
+    """
+    Reads the record at the current position of the segment file f.
+    Returns (headerLength, flags, spooledAt, body), None at the end of
+    the file or False if the record is incomplete or damaged.
+    """
+    header = f.read(RECORD_HEADER.size)
+    if header == "":
+        return None
+    if len(header) < RECORD_HEADER.size:
+        return False
+    bodyLength, headerLength, crc, flags, spooledAt = \
+        RECORD_HEADER.unpack(header)
+    body = f.read(bodyLength)
+    if len(body) < bodyLength or headerLength > bodyLength or \
+            binascii.crc32(body) & 0xffffffff != crc:
+        return False
+    return (headerLength, flags, spooledAt, body)
+
+
+def getSpoolStatus(sensorId):
+    """
+    The backlog of a sensor: segments, bytes not yet replayed and when
+    the oldest of them was spooled.
+    """
+    directory = getSpoolDir(sensorId)
+    segments = listSegments(directory)
+    retval = {SENSOR_ID: sensorId,
+              "segments": len(segments),
+              "backlogBytes": 0,
+              "oldestSpooledAt": None}
+    if not segments:
+        return retval
+    segment, offset = getCursor(directory, segments)
+    backlog = 0
+    for name in segments[segments.index(segment):]:
+        try:
+            backlog += os.path.getsize(os.path.join(directory, name))
+        except OSError:
+            # Dropped by the drainer.
+            pass
+    backlog -= offset
+    retval["backlogBytes"] = max(backlog, 0)
+    try:
+        with open(os.path.join(directory, segment), "rb") as f:
+            f.seek(offset)
+            record = readRecord(f)
+        if record:
+            retval["oldestSpooledAt"] = record[2]
+    except IOError:
+        pass
+    return retval
+
+
+def getUploadWriter(sensorId):
+    """
+    The writer of this process for the uploads of a sensor, kept open so
+    that uploads append to the same segment instead of each starting one.
+    """
+    global _uploadWriters
+    global _uploadWritersPid
+    if "_uploadWriters" not in globals() or _uploadWritersPid != os.getpid():
+        _uploadWriters = {}
+        _uploadWritersPid = os.getpid()
+    if sensorId not in _uploadWriters:
+        _uploadWriters[sensorId] = SpoolWriter(sensorId)
+    return _uploadWriters[sensorId]
+
+
+def spoolMessage(message):
+    """
+    Spool a message in the upload format (see populate_db.put_message).
+    It is on disk when this returns.
+    """
+    index = message.index("{")
+    headerLength = int(message[0:index - 1].rstrip())
+    message = message[index:]
+    sensorId = json.loads(message[0:headerLength])[SENSOR_ID]
+    writer = getUploadWriter(sensorId)
+    try:
+        writer.append(message, headerLength)
+        writer.sync()
+    except:
+        # Start over with a new writer (and segment) next time.
+        del _uploadWriters[sensorId]
+        writer.close()
+        raise
+
+
+class SpoolWriter:
+    """
+    Appends the messages of a sensor to its spool. Several processes may
+    write to the same spool: appends are serialized with a lock file and
+    always go to the newest segment. A writer starts a new segment the
+    first time it writes so a record torn by a crash of an earlier writer
+    is never followed by new records in the same segment.
+    """
+
+    def __init__(self, sensorId):
+        if not isValidSensorId(sensorId):
+            raise Exception("Invalid sensor ID " + repr(sensorId))
+        self.sensorId = sensorId
+        self.directory = getSpoolDir(sensorId)
+        makeDirs(self.directory)
+        self.lockFile = open(os.path.join(self.directory, LOCK_FILE), "a")
+        self.segmentSize = SEGMENT_SIZE_MB * 1024 * 1024
+        self.fd = None
+        self.segment = None
+        self.unsynced = 0
+        self.syncTime = 0
+
+    def _openSegment(self, segment, create):
+        self._closeSegment()
+        path = os.path.join(self.directory, segment)
+        if create:
+            self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT |
+                              os.O_EXCL, 0600)
+            self._write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION))
+            os.fsync(self.fd)
+            # Make the new directory entry durable.
+            dirfd = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(dirfd)
+            finally:
+                os.close(dirfd)
+        else:
+            self.fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+        self.segment = segment
+
+    def _closeSegment(self):
+        if self.fd is not None:
+            self.sync()
+            os.close(self.fd)
+            self.fd = None
+
+    def _write(self, data):
+        while data:
+            written = os.write(self.fd, data)
+            data = data[written:]
+
+    def append(self, message, headerLength, powers=None):
+        """
+        Spool a message: the json header (message[0:headerLength]) followed
+        by its data, or by powers if given.
+        """
+        flags = 0
+        if powers is not None:
+            message = message[0:headerLength] + \
+                np.array(powers, dtype=np.int8).tostring()
+            flags = flags | POWERS_FLAG
+        record = RECORD_HEADER.pack(len(message), headerLength,
+                                    binascii.crc32(message) & 0xffffffff,
+                                    flags, time.time()) + message
+        fcntl.flock(self.lockFile, fcntl.LOCK_EX)
+        try:
+            segments = listSegments(self.directory)
+            if self.fd is None or not segments:
+                nextSegment = True
+            elif segments[-1] != self.segment:
+                # Another writer rotated.
+                self._openSegment(segments[-1], False)
+                nextSegment = False
+            else:
+                nextSegment = False
+            if nextSegment or os.fstat(self.fd).st_size >= self.segmentSize:
+                if segments:
+                    count = int(segments[-1][:-len(SEGMENT_SUFFIX)]) + 1
+                else:
+                    count = 0
+                self._openSegment("%012d%s" % (count, SEGMENT_SUFFIX), True)
+            self._write(record)
+        finally:
+            fcntl.flock(self.lockFile, fcntl.LOCK_UN)
+        SPOOLED.inc()
+        self.unsynced = self.unsynced + 1
+        if time.time() - self.syncTime >= FSYNC_INTERVAL:
+            self.sync()
+
+    def sync(self):
+        if self.fd is not None and self.unsynced != 0:
+            os.fsync(self.fd)
+            self.unsynced = 0
+            self.syncTime = time.time()
+
+    def close(self):
+        self._closeSegment()
+        self.lockFile.close()
+
+
+class SpoolDrainer:
+    """
+    Replays the spools of all sensors into the database.
+    """
+
+    def __init__(self):
+        self.memCache = MemCache()
+        self.maxBytes = SPOOL_MAX_MB * 1024 * 1024
+        self.retryInterval = DRAIN_POLL_INTERVAL
+        self.statisticsTime = 0
+        self.statistics = {"state": "idle",
+                           "replayed": 0,
+                           "rejected": 0,
+                           "droppedBytes": 0,
+                           "retries": 0,
+                           "lastError": None,
+                           "lastReplayedAt": None,
+                           "lagSeconds": None}
+
+    def replay(self, record):
+        headerLength, flags, spooledAt, body = record
+        if flags & POWERS_FLAG:
+            powers = np.fromstring(body[headerLength:], dtype=np.int8)
+            populate_db.put_data(body, headerLength, powers=powers.tolist())
+        else:
+            populate_db.put_data(body, headerLength)
+
+    def drain(self, sensorId):
+        """
+        Replays up to DRAIN_BATCH records of a sensor. Returns the number
+        of records processed. Database errors propagate; the record is
+        replayed again on the next call.
+        """
+        directory = getSpoolDir(sensorId)
+        # List before reading: a segment that is not the newest is no
+        # longer written to.
+        segments = listSegments(directory)
+        if not segments:
+            return 0
+        segment, offset = getCursor(directory, segments)
+        count = 0
+        while count < DRAIN_BATCH:
+            isNewest = segment == segments[-1]
+            path = os.path.join(directory, segment)
+            try:
+                f = open(path, "rb")
+            except IOError:
+                # Dropped by enforceCap.
+                return count
+            try:
+                f.seek(offset)
+                record = readRecord(f)
+            finally:
+                f.close()
+            if record is None or record is False:
+                if isNewest:
+                    # Nothing more, or a record being written.
+                    break
+                if record is False:
+                    util.errorPrint("IngestSpool: skipping damaged end of " +
+                                    path)
+                segment = segments[segments.index(segment) + 1]
+                offset = SEGMENT_HEADER.size
+                writeCursor(directory, segment, offset)
+                os.remove(path)
+                continue
+            try:
+                with INSERT_TIME.time():
+                    self.replay(record)
+            except PyMongoError:
+                raise
+            except:
+                # Bad message: it will not get better by retrying.
+                self.statistics["rejected"] += 1
+                REJECTED.inc()
+                util.errorPrint("IngestSpool: rejected message for " +
+                                sensorId + " " + str(sys.exc_info()[1]))
+                util.logStackTrace(sys.exc_info())
+            else:
+                self.statistics["replayed"] += 1
+                self.statistics["lastReplayedAt"] = time.time()
+                self.statistics["lagSeconds"] = time.time() - record[2]
+                REPLAYED.inc()
+                INSERT_LAG.observe(self.statistics["lagSeconds"])
+            offset = offset + RECORD_HEADER.size + len(record[3])
+            writeCursor(directory, segment, offset)
+            count = count + 1
+        return count
+
+    def enforceCap(self, sensorId):
+        """
+        Drops the oldest segments of a sensor while its spool is larger
+        than SPOOL_MAX_MB. The newest segment is always kept. Returns the
+        size of the spool of the sensor.
+        """
+        directory = getSpoolDir(sensorId)
+        segments = listSegments(directory)
+        sizes = []
+        for segment in segments:
+            try:
+                sizes.append(os.path.getsize(os.path.join(directory,
+                                                          segment)))
+            except OSError:
+                sizes.append(0)
+        total = sum(sizes)
+        while total > self.maxBytes and len(segments) > 1:
+            util.errorPrint("IngestSpool: spool of " + sensorId +
+                            " is full, dropping " + segments[0])
+            try:
+                os.remove(os.path.join(directory, segments[0]))
+            except OSError:
+                pass
+            self.statistics["droppedBytes"] += sizes[0]
+            DROPPED_BYTES.inc(sizes[0])
+            total = total - sizes[0]
+            segments.pop(0)
+            sizes.pop(0)
+        return total
+
+    def publishStatistics(self):
+        now = time.time()
+        if now - self.statisticsTime > SPOOL_STATISTICS_INTERVAL:
+            self.memCache.setSpoolStatistics(self.statistics)
+            self.statisticsTime = now
+
+    def run(self):
+        while True:
+            progress = 0
+            try:
+                backlog = 0
+                for sensorId in listSpooledSensors():
+                    backlog = backlog + self.enforceCap(sensorId)
+                    progress = progress + self.drain(sensorId)
+                BACKLOG_BYTES.set(backlog)
+                self.statistics["state"] = "idle" if progress == 0 \
+                    else "replaying"
+                self.retryInterval = DRAIN_POLL_INTERVAL
+            except PyMongoError:
+                # Database is down or stalled. Keep spooling and retry.
+                self.statistics["state"] = "waiting for database"
+                self.statistics["retries"] += 1
+                DB_RETRIES.inc()
+                self.statistics["lastError"] = str(sys.exc_info()[1])
+                util.errorPrint("IngestSpool: database error " +
+                                self.statistics["lastError"] +
+                                " retrying in " + str(self.retryInterval))
+                time.sleep(self.retryInterval)
+                self.retryInterval = min(self.retryInterval * 2,
+                                         DRAIN_MAX_RETRY_INTERVAL)
+            except:
+                print "Unexpected error:", sys.exc_info()[0]
+                print sys.exc_info()
+                traceback.print_exc()
+                util.logStackTrace(sys.exc_info())
+                time.sleep(DRAIN_POLL_INTERVAL)
+            self.publishStatistics()
+            if progress == 0:
+                time.sleep(DRAIN_POLL_INTERVAL)
+
+
+def runDrainer():
+    """
+    Entry point of the drainer process. Both the streaming server and the
+    upload service start one; the lock lets only one of them run at a
+    time, the other takes over if it exits.
+    """
+    makeDirs(SPOOL_DIR)
+    lockFile = open(os.path.join(SPOOL_DIR, DRAINER_LOCK_FILE), "a")
+    fcntl.flock(lockFile, fcntl.LOCK_EX)
+    util.debugPrint("IngestSpool: drainer running " + str(os.getpid()))
+    SpoolDrainer().run()
@@ -36,6 +36,7 @@ global loggerName
 
 
 def configureLogging(moduleName):
+    global loggerName
     loggerName = moduleName
     FORMAT = "%(levelname)s %(asctime)-15s %(message)s"
     if not logging.getLogger(loggerName).disabled:
@@ -55,6 +56,19 @@ def getLogger():
         return logging.getLogger(loggerName)
 
 
+def isDebugEnabled():
+    """
+    Whether debug messages are logged: the MSOD_DEBUG_LOGGING debug flag,
+    which can change at run time (see DebugFlags, cheap to call).
+    """
+    global debugEnabled
+    enabled = DebugFlags.getDebugFlag()
+    if "debugEnabled" not in globals() or enabled != debugEnabled:
+        debugEnabled = enabled
+        getLogger().setLevel(DebugFlags.getLogLevel())
+    return enabled
+
+
 def load_symbol_map(symbolMapDir):
     files = [symbolMapDir + f for f in os.listdir(symbolMapDir)
              if os.path.isfile(symbolMapDir + f) and os.path.splitext(f)[1] ==
@@ -0,0 +1,539 @@
+# -*- coding: utf-8 -*-
+#
+#This software was developed by employees of the National Institute of
+#Standards and Technology (NIST), and others.
+#This software has been contributed to the public domain.
+#Pursuant to title 15 Untied States Code Section 105, works of NIST
+#employees are not subject to copyright protection in the United States
+#and are considered to be in the public domain.
+#As a result, a formal license is not needed to use this software.
+#
+#This software is provided "AS IS."
+#NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+#OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+#AND DATA ACCURACY.  NIST does not warrant or make any representations
+#regarding the use of the software or the results thereof, including but
+#not limited to the correctness, accuracy, reliability or usefulness of
+#this software.
+'''
+Counters, gauges and histograms of the services.
+
+The metrics are shared by all the processes of a service (its forked
+children, the gunicorn workers) through memcache, like the rest of the
+state in DataStreamSharedState:
+
+- A process counts locally and adds its counts to memcache with the atomic
+  incr at most every FLUSH_INTERVAL seconds (a background thread of the
+  process flushes), so that counting on a hot path is a dictionary update.
+  Counters and histograms are totals over all the processes of the service
+  since memcache started.
+- A gauge (the websockets open in a worker) is a value per process, stored
+  with an expiry together with a lease of the process, so that the values
+  of a process that died disappear. Gauges are reported summed over the
+  live processes.
+- A forked child starts with empty counts and gauges of its own.
+
+Each service names itself with setService at startup and exposes its
+metrics as text on a local port (startMetricsServer, METRICS_PORTS):
+
+    # HELP streaming_spectrums_total Spectrums received from the sensors.
+    # TYPE streaming_spectrums_total counter
+    streaming_spectrums_total 1234
+
+collect returns the same as a dictionary; the admin service aggregates
+the metrics of all the services of the host with it (see getServices).
+'''
+import os
+import sys
+import time
+import threading
+import util
+from DataStreamSharedState import MemCache
+from DataStreamSharedState import LEASE_TIME
+
+# Seconds between two flushes of the counts of a process.
+FLUSH_INTERVAL = 1
+
+# Gauges of a process not flushed within this many seconds expire.
+GAUGE_EXPIRY = 60
+
+# Upper bounds of the histogram buckets (seconds) unless given.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30)
+
+# Histogram sums are kept as integers in units of 1 / SUM_SCALE.
+SUM_SCALE = 1000000
+
+# Local port of the metrics text endpoint of each service.
+METRICS_PORTS = {"spectrumbrowser": 9200,
+                 "admin": 9201,
+                 "streaming": 9202,
+                 "occupancy": 9203,
+                 "federation": 9204,
+                 "spectrumdb": 9205,
+                 "monitoring": 9206}
+
+# Seconds between two checks that the service that started the metrics
+# server is still running.
+PARENT_CHECK_INTERVAL = 5
+
+METRICS = "metrics_"
+METRICS_SERVICES = "metrics_services"
+DEFINITIONS = "_definitions"
+PROCESSES = "_processes"
+GAUGES = "_gauges_"
+BUCKET = "_bucket_"
+SUM = "_sum"
+COUNT = "_count"
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+DEFAULT_SERVICE = "msod"
+
+
+def setService(service):
+    """
+    Name of the service of this process (inherited by its children).
+    """
+    global _service
+    _service = service
+
+
+def getService():
+    if "_service" not in globals():
+        return DEFAULT_SERVICE
+    return _service
+
+
+def getMemCache():
+    global _memCache
+    global _memCachePid
+    if "_memCache" not in globals() or _memCachePid != os.getpid():
+        _memCache = MemCache()
+        _memCachePid = os.getpid()
+    return _memCache
+
+
+def getKey(service, name):
+    return str(METRICS + service + "_" + name).encode("UTF-8")
+
+
+class Registry:
+    """
+    The metrics defined in this process and the counts not flushed yet.
+    """
+
+    def __init__(self):
+        self.definitions = {}
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.gauges = {}
+        self.used = set()
+        self.published = set()
+        self.flushedGauges = None
+        self.leaseTime = 0
+        self.flusher = None
+
+    def check(self):
+        """
+        Forget the counts of the parent after a fork and make sure a
+        flusher runs in this process.
+        """
+        if self.pid != os.getpid():
+            self.reset()
+        if self.flusher is None:
+            self.flusher = threading.Thread(target=self.runFlusher)
+            self.flusher.daemon = True
+            self.flusher.start()
+
+    def define(self, metric):
+        if metric.name in self.definitions:
+            existing = self.definitions[metric.name]
+            if existing.__class__ != metric.__class__:
+                raise ValueError("Metric " + metric.name +
+                                 " already defined as " + existing.TYPE)
+            return existing
+        self.definitions[metric.name] = metric
+        return metric
+
+    def add(self, name, key, delta):
+        self.check()
+        with self.lock:
+            self.pending[key] = self.pending.get(key, 0) + delta
+            self.used.add(name)
+
+    def setGauge(self, name, value):
+        self.check()
+        with self.lock:
+            self.gauges[name] = value
+            self.used.add(name)
+
+    def addGauge(self, name, delta):
+        self.check()
+        with self.lock:
+            self.gauges[name] = self.gauges.get(name, 0) + delta
+            self.used.add(name)
+
+    def publish(self, mc, service):
+        """
+        Record the definitions of the metrics this process started using
+        (and the service) where collect finds them.
+        """
+        with self.lock:
+            names = [name for name in self.used
+                     if name not in self.published]
+        if len(names) == 0:
+            return
+        definitions = dict((name, self.definitions[name].describe())
+                           for name in names)
+
+        def addDefinitions(current):
+            current = dict(current or {})
+            current.update(definitions)
+            return current
+
+        def addService(services):
+            services = list(services or [])
+            if service not in services:
+                services.append(service)
+            return services
+
+        if mc.casUpdate(getKey(service, DEFINITIONS),
+                        addDefinitions) is not None and \
+                mc.casUpdate(METRICS_SERVICES, addService) is not None:
+            self.published.update(names)
+
+    def flush(self):
+        """
+        Add the counts of this process to the totals of the service and
+        store its gauges.
+        """
+        if self.pid != os.getpid():
+            return
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+            gauges = dict(self.gauges)
+        service = getService()
+        mc = getMemCache()
+        self.publish(mc, service)
+        for key, delta in pending.items():
+            if delta != 0:
+                mc.increment(getKey(service, key), delta)
+        if len(gauges) == 0:
+            return
+        now = time.time()
+        if now - self.leaseTime > LEASE_TIME / 2:
+            mc.renewLease(getKey(service, PROCESSES), str(self.pid))
+            self.leaseTime = now
+            self.flushedGauges = None
+        if gauges != self.flushedGauges:
+            mc.mc.set(getKey(service, GAUGES + str(self.pid)), gauges,
+                      time=GAUGE_EXPIRY)
+            self.flushedGauges = gauges
+
+    def runFlusher(self):
+        pid = os.getpid()
+        while pid == os.getpid():
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except:
+                util.errorPrint("Metrics: flush failed " +
+                                str(sys.exc_info()[1]))
+
+
+def getRegistry():
+    global _registry
+    if "_registry" not in globals():
+        _registry = Registry()
+    return _registry
+
+
+class Counter:
+    TYPE = COUNTER
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+
+    def describe(self):
+        return {"type": self.TYPE, "help": self.description}
+
+    def inc(self, delta=1):
+        getRegistry().add(self.name, self.name, delta)
+
+
+class Gauge(Counter):
+    """
+    Value per process, summed over the processes of the service.
+    """
+    TYPE = GAUGE
+
+    def set(self, value):
+        getRegistry().setGauge(self.name, value)
+
+    def inc(self, delta=1):
+        getRegistry().addGauge(self.name, delta)
+
+    def dec(self, delta=1):
+        getRegistry().addGauge(self.name, -delta)
+
+
+class Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        self.histogram.observe(time.time() - self.start)
+        return False
+
+
+class Histogram(Counter):
+    """
+    Count of the observed values in buckets bounded above by buckets
+    (plus one for the larger values), with their sum and count.
+    """
+    TYPE = HISTOGRAM
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        Counter.__init__(self, name, description)
+        self.buckets = tuple(sorted(buckets))
+
+    def describe(self):
+        retval = Counter.describe(self)
+        retval["buckets"] = list(self.buckets)
+        return retval
+
+    def observe(self, value):
+        index = len(self.buckets)
+        for i in range(0, len(self.buckets)):
+            if value <= self.buckets[i]:
+                index = i
+                break
+        registry = getRegistry()
+        registry.add(self.name, self.name + BUCKET + str(index), 1)
+        registry.add(self.name, self.name + SUM, int(value * SUM_SCALE))
+        registry.add(self.name, self.name + COUNT, 1)
+
+    def time(self):
+        """
+        Observe the duration of a with block.
+        """
+        return Timer(self)
+
+
+def counter(name, description):
+    return getRegistry().define(Counter(name, description))
+
+
+def gauge(name, description):
+    return getRegistry().define(Gauge(name, description))
+
+
+def histogram(name, description, buckets=DEFAULT_BUCKETS):
+    return getRegistry().define(Histogram(name, description, buckets))
+
+
+def flush():
+    """
+    Flush the counts of this process now (before it exits).
+    """
+    getRegistry().flush()
+
+
+def getServices():
+    """
+    The services of this host that recorded metrics.
+    """
+    services = getMemCache().mc.get(METRICS_SERVICES)
+    if services is None:
+        return []
+    return sorted(services)
+
+
+def collect(service=None):
+    """
+    The metrics of a service (default this one): name -> type, help and
+    value (counters and gauges) or buckets, sum and count (histograms,
+    with cumulative bucket counts as [upper bound, count], the last
+    bound None).
+    """
+    if service is None:
+        service = getService()
+    mc = getMemCache()
+    definitions = mc.mc.get(getKey(service, DEFINITIONS)) or {}
+    keys = []
+    for name, definition in definitions.items():
+        if definition["type"] == COUNTER:
+            keys.append(getKey(service, name))
+        elif definition["type"] == HISTOGRAM:
+            for i in range(0, len(definition["buckets"]) + 1):
+                keys.append(getKey(service, name + BUCKET + str(i)))
+            keys.append(getKey(service, name + SUM))
+            keys.append(getKey(service, name + COUNT))
+    now = time.time()
+    leases = mc.mc.get(getKey(service, PROCESSES)) or {}
+    gaugeKeys = [getKey(service, GAUGES + pid)
+                 for (pid, expiry) in leases.items() if expiry > now]
+    values = mc.mc.get_multi(keys + gaugeKeys) if keys or gaugeKeys else {}
+
+    def value(name):
+        return int(values.get(getKey(service, name), 0))
+
+    gaugeTotals = {}
+    for key in gaugeKeys:
+        for name, gaugeValue in (values.get(key) or {}).items():
+            gaugeTotals[name] = gaugeTotals.get(name, 0) + gaugeValue
+    retval = {}
+    for name, definition in definitions.items():
+        metric = {"type": definition["type"], "help": definition["help"]}
+        if definition["type"] == COUNTER:
+            metric["value"] = value(name)
+        elif definition["type"] == GAUGE:
+            metric["value"] = gaugeTotals.get(name, 0)
+        else:
+            bounds = list(definition["buckets"]) + [None]
+            total = 0
+            buckets = []
+            for i in range(0, len(bounds)):
+                total = total + value(name + BUCKET + str(i))
+                buckets.append([bounds[i], total])
+            metric["buckets"] = buckets
+            metric["sum"] = float(value(name + SUM)) / SUM_SCALE
+            metric["count"] = value(name + COUNT)
+        retval[name] = metric
+    return retval
+
+
+def formatMetrics(service, metrics):
+    """
+    The metrics returned by collect as text, one sample per line.
+    """
+    lines = []
+    for name in sorted(metrics.keys()):
+        metric = metrics[name]
+        fullName = service + "_" + name
+        lines.append("# HELP " + fullName + " " + metric["help"])
+        lines.append("# TYPE " + fullName + " " + metric["type"])
+        if metric["type"] == HISTOGRAM:
+            for (bound, count) in metric["buckets"]:
+                le = "+Inf" if bound is None else repr(float(bound))
+                lines.append(fullName + "_bucket{le=\"" + le + "\"} " +
+                             str(count))
+            lines.append(fullName + "_sum " + repr(metric["sum"]))
+            lines.append(fullName + "_count " + str(metric["count"]))
+        else:
+            lines.append(fullName + " " + str(metric["value"]))
+    return "\n".join(lines) + "\n"
+
+
+def application(environ, start_response):
+    """
+    WSGI application of the metrics endpoint: GET /metrics.
+    """
+    if environ.get("PATH_INFO") != "/metrics" or \
+            environ.get("REQUEST_METHOD") != "GET":
+        start_response("404 Not Found", [("Content-Type", "text/plain")])
+        return ["Not found\n"]
+    try:
+        service = getService()
+        body = formatMetrics(service, collect(service))
+    except:
+        util.errorPrint("Metrics: collect failed " + str(sys.exc_info()[1]))
+        start_response("500 Internal Server Error",
+                       [("Content-Type", "text/plain")])
+        return ["Metrics unavailable\n"]
+    start_response("200 OK", [("Content-Type", "text/plain; version=0.0.4"),
+                              ("Content-Length", str(len(body)))])
+    return [body]
+
+
+def runMetricsServer(service, port, parentPid):
+    """
+    Serve the metrics of the service on localhost:port until the process
+    that started the server is gone.
+    """
+    import gevent
+    from gevent import pywsgi
+    gevent.reinit()
+    setService(service)
+    try:
+        server = pywsgi.WSGIServer(('localhost', port), application,
+                                   log=None)
+        server.start()
+    except:
+        util.errorPrint("Metrics: cannot serve on port " + str(port) +
+                        " " + str(sys.exc_info()[1]))
+        return
+    util.debugPrint("Metrics: serving %s on port %d", service, port)
+    while os.getppid() == parentPid:
+        gevent.sleep(PARENT_CHECK_INTERVAL)
+    server.stop()
+
+
+def startMetricsServer(port=None):
+    """
+    Start the metrics endpoint of the service of this process (see
+    setService) in a process of its own, on METRICS_PORTS unless given.
+    """
+    from multiprocessing import Process
+    service = getService()
+    if port is None:
+        port = METRICS_PORTS.get(service)
+    if port is None:
+        util.errorPrint("Metrics: no port for service " + service)
+        return None
+    proc = Process(target=runMetricsServer,
+                   args=(service, port, os.getpid()))
+    proc.daemon = True
+    proc.start()
+    return proc
+
+
+def instrumentApp(app):
+    """
+    Count the requests of a flask application, the failed ones (status
+    500 and above or unhandled exception) and their duration.
+    """
+    from flask import g
+    requests = counter("http_requests_total", "HTTP requests served.")
+    errors = counter("http_errors_total",
+                     "HTTP requests that failed (status >= 500).")
+    duration = histogram("http_request_seconds",
+                         "Duration of the HTTP requests.")
+
+    @app.before_request
+    def startRequestTimer():
+        g.metricsStartTime = time.time()
+
+    @app.after_request
+    def countRequest(response):
+        startTime = getattr(g, "metricsStartTime", None)
+        if startTime is not None:
+            g.metricsStartTime = None
+            requests.inc()
+            duration.observe(time.time() - startTime)
+            if response.status_code >= 500:
+                errors.inc()
+        return response
+
+    @app.teardown_request
+    def countFailedRequest(exc):
+        startTime = getattr(g, "metricsStartTime", None)
+        if exc is not None and startTime is not None:
+            g.metricsStartTime = None
+            requests.inc()
+            errors.inc()
+            duration.observe(time.time() - startTime)
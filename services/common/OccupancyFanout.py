@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+#
+#This software was developed by employees of the National Institute of
+#Standards and Technology (NIST), and others.
+#This software has been contributed to the public domain.
+#Pursuant to title 15 Untied States Code Section 105, works of NIST
+#employees are not subject to copyright protection in the United States
+#and are considered to be in the public domain.
+#As a result, a formal license is not needed to use this software.
+#
+#This software is provided "AS IS."
+#NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+#OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+#AND DATA ACCURACY.  NIST does not warrant or make any representations
+#regarding the use of the software or the results thereof, including but
+#not limited to the correctness, accuracy, reliability or usefulness of
+#this software.
+'''
+Push of occupancy changes from the streaming server (one process per
+connected sensor) to the occupancy alert broker processes.
+
+Each broker process binds a unix datagram socket named after its pid in
+BROKER_SOCKET_DIR. The streaming server sends every occupancy change of
+its sensor once to each broker; the broker fans it out to all of its
+subscribers of that sensor.
+
+Subscribers speak one of two protocols:
+
+Version 1 (legacy): the subscriber sends {"SensorID": sensorId} and then
+receives the occupancy bits of every change packed most significant bit
+first, without any framing.
+
+Version 2: the subscriber sends SUBSCRIPTION_MAGIC, a version byte and a
+uint16 length followed by the same JSON (packSubscription). Every alert is
+an ALERT_HEADER (flags, sequence number, source timestamp, number of
+channels n, payload count m) followed by either m bytes of packed bits
+(the full occupancy) or, with CHANGES_FLAG, m uint16 indexes of the
+channels that flipped since the alert with the previous sequence number.
+The first alert after subscribing (or after alerts were dropped) is
+always a full one. The alerts are framed once by the streaming server;
+the broker only picks which of the two frames a subscriber needs.
+
+An update from the streaming server to a broker is UPDATE_HEADER (length
+of the sensor ID, of the full frame and of the changes frame, 0 if there
+is none), the sensor ID, the full frame and the changes frame.
+'''
+
+import os
+import socket
+import struct
+import errno
+import time
+import json
+import numpy as np
+import util
+
+BROKER_SOCKET_DIR = "/tmp/msod-occupancy"
+
+# How often the publisher rescans BROKER_SOCKET_DIR for brokers.
+BROKER_SCAN_INTERVAL = 1.0
+
+UPDATE_HEADER = struct.Struct("<HHH")
+
+SUBSCRIPTION_MAGIC = "MSOA"
+SUBSCRIPTION_HEADER = struct.Struct("<BH")
+PROTOCOL_VERSION = 2
+
+ALERT_HEADER = struct.Struct("<BIdHH")
+CHANGES_FLAG = 1
+
+
+def packAlerts(seq, timestamp, occupancy, previous):
+    """
+    Frame an occupancy change (a uint8 array of 0/1 values). Returns the
+    full frame and the changes frame, which is None when previous is None
+    or listing the flipped channels would not be smaller.
+    """
+    n = len(occupancy)
+    bits = np.packbits(occupancy).tostring()
+    full = ALERT_HEADER.pack(0, seq, timestamp, n, len(bits)) + bits
+    changes = None
+    if previous is not None and len(previous) == n:
+        flipped = np.flatnonzero(occupancy != previous).astype("<u2")
+        if len(flipped) * 2 < len(bits):
+            changes = ALERT_HEADER.pack(CHANGES_FLAG, seq, timestamp, n,
+                                        len(flipped)) + flipped.tostring()
+    return full, changes
+
+
+def packUpdate(sensorId, full, changes):
+    sensorId = str(sensorId)
+    if changes is None:
+        changes = ""
+    return UPDATE_HEADER.pack(len(sensorId), len(full),
+                              len(changes)) + sensorId + full + changes
+
+
+def unpackUpdate(update):
+    """
+    Returns (sensorId, full frame, changes frame or None).
+    """
+    (idLength, fullLength, changesLength) = UPDATE_HEADER.unpack_from(update)
+    start = UPDATE_HEADER.size
+    sensorId = update[start:start + idLength]
+    start = start + idLength
+    full = update[start:start + fullLength]
+    start = start + fullLength
+    if changesLength == 0:
+        return sensorId, full, None
+    return sensorId, full, update[start:start + changesLength]
+
+
+def getAlertSeq(frame):
+    return ALERT_HEADER.unpack_from(frame)[1]
+
+
+def getAlertBits(frame):
+    """
+    The packed bits of a full frame (what version 1 subscribers get).
+    """
+    return frame[ALERT_HEADER.size:]
+
+
+def packSubscription(sensorId):
+    body = json.dumps({"SensorID": sensorId})
+    return SUBSCRIPTION_MAGIC + SUBSCRIPTION_HEADER.pack(PROTOCOL_VERSION,
+                                                         len(body)) + body
+
+
+def recvFully(sock, count):
+    buf = ""
+    while len(buf) < count:
+        data = sock.recv(count - len(buf))
+        if not data:
+            raise EOFError("Connection closed")
+        buf = buf + data
+    return buf
+
+
+class AlertDecoder:
+    """
+    Client side of protocol version 2: keeps the occupancy of a sensor up
+    to date from the alerts read off a subscriber connection.
+    """
+
+    def __init__(self):
+        self.seq = None
+        self.occupancy = None
+
+    def read(self, sock):
+        """
+        Read an alert. Returns (seq, timestamp, occupancy) where occupancy
+        is a uint8 array of 0/1 values.
+        """
+        header = recvFully(sock, ALERT_HEADER.size)
+        (flags, seq, timestamp, n, count) = ALERT_HEADER.unpack(header)
+        if flags & CHANGES_FLAG:
+            payload = recvFully(sock, count * 2)
+            if self.seq is None or seq != self.seq + 1:
+                raise ValueError("Changes without the previous alert")
+            flipped = np.frombuffer(payload, dtype="<u2")
+            self.occupancy[flipped] ^= 1
+        else:
+            payload = recvFully(sock, count)
+            self.occupancy = np.unpackbits(np.frombuffer(
+                payload, dtype=np.uint8))[:n]
+        self.seq = seq
+        return seq, timestamp, self.occupancy
+
+
+def getBrokerSocketPath(pid=None):
+    if pid is None:
+        pid = os.getpid()
+    return os.path.join(BROKER_SOCKET_DIR, str(pid))
+
+
+def bindBrokerSocket(sock):
+    """
+    Bind a datagram socket (AF_UNIX, SOCK_DGRAM) as the inbox of this
+    broker process. Returns the socket path.
+    """
+    if not os.path.exists(BROKER_SOCKET_DIR):
+        try:
+            os.makedirs(BROKER_SOCKET_DIR)
+        except OSError:
+            # Another process created it.
+            pass
+    path = getBrokerSocketPath()
+    if os.path.exists(path):
+        os.unlink(path)
+    sock.bind(path)
+    return path
+
+
+def unbindBrokerSocket():
+    try:
+        os.unlink(getBrokerSocketPath())
+    except OSError:
+        pass
+
+
+def listBrokers():
+    """
+    Returns the socket paths of the running broker processes.
+    """
+    if not os.path.exists(BROKER_SOCKET_DIR):
+        return []
+    return [os.path.join(BROKER_SOCKET_DIR, name)
+            for name in os.listdir(BROKER_SOCKET_DIR)]
+
+
+class OccupancyPublisher:
+    """
+    Sends the occupancy changes of one sensor to every broker process.
+    Sends never block: an update that does not fit in a broker's socket
+    buffer is dropped and counted.
+    """
+
+    def __init__(self, sensorId):
+        self.sensorId = sensorId
+        self.seq = 0
+        self.previous = None
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(0)
+        self.brokers = []
+        self.lastScan = 0
+        self.published = 0
+        self.dropped = 0
+
+    def hasBrokers(self):
+        now = time.time()
+        if now - self.lastScan > BROKER_SCAN_INTERVAL:
+            self.brokers = listBrokers()
+            self.lastScan = now
+        return len(self.brokers) != 0
+
+    def publish(self, occupancy, timestamp=None):
+        """
+        Send the occupancy (a sequence of 0/1 values) if it changed.
+        """
+        if not self.hasBrokers():
+            self.previous = None
+            return
+        occupancy = np.array(occupancy, dtype=np.uint8)
+        if self.previous is not None and np.array_equal(occupancy,
+                                                        self.previous):
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        self.seq = self.seq + 1
+        (full, changes) = packAlerts(self.seq, timestamp, occupancy,
+                                     self.previous)
+        self.previous = occupancy
+        update = packUpdate(self.sensorId, full, changes)
+        for path in list(self.brokers):
+            try:
+                self.sock.sendto(update, path)
+                self.published = self.published + 1
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                    self.dropped = self.dropped + 1
+                elif e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                    # The broker went away without removing its socket.
+                    util.debugPrint("OccupancyPublisher: removing stale " +
+                                    path)
+                    self.brokers.remove(path)
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                else:
+                    raise
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,466 @@
+# -*- coding: utf-8 -*-
+#
+#This software was developed by employees of the National Institute of
+#Standards and Technology (NIST), and others.
+#This software has been contributed to the public domain.
+#Pursuant to title 15 Untied States Code Section 105, works of NIST
+#employees are not subject to copyright protection in the United States
+#and are considered to be in the public domain.
+#As a result, a formal license is not needed to use this software.
+#
+#This software is provided "AS IS."
+#NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+#OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+#AND DATA ACCURACY.  NIST does not warrant or make any representations
+#regarding the use of the software or the results thereof, including but
+#not limited to the correctness, accuracy, reliability or usefulness of
+#this software.
+'''
+Control channel from the web services to the connected sensors.
+
+Each ingest node runs one router (runRouter, started by the streaming
+server) listening on a unix socket in CONTROL_SOCKET_DIR named after the
+node, and on the TCP control port of the node for clients on other hosts
+(these must present the key the node registered, see IngestRegistry). The
+streaming server process that owns the connection of a sensor registers
+with the router of its node (CommandChannel) and writes the commands
+routed to it to the sensor from its read loop, acknowledging each one.
+Clients submit commands with sendCommandToSensor, which goes to the node
+that owns the sensor.
+
+The router keeps a queue per sensor: commands for a sensor that is not
+connected wait (up to their timeout) for it to (re)connect. Every command
+gets a status (queued, sent, delivered, failed, timeout or rejected) and
+the last COMMAND_HISTORY_SIZE commands are kept for getCommandHistory.
+
+The messages on the socket are JSON objects, one per line.
+'''
+
+import os
+import json
+import time
+import socket
+import errno
+import sys
+import collections
+from pymongo.errors import PyMongoError
+import gevent
+import gevent.socket
+from gevent.event import AsyncResult
+from gevent.server import StreamServer
+import util
+import IngestRegistry
+
+CONTROL_SOCKET_DIR = "/tmp/msod-control"
+
+# Seconds a command waits for the sensor before it times out.
+COMMAND_TIMEOUT = 5
+MAX_QUEUED_COMMANDS = 100
+COMMAND_HISTORY_SIZE = 1000
+
+# How often an owner tries to register again after losing the router.
+CHANNEL_RECONNECT_INTERVAL = 5.0
+
+QUEUED = "queued"
+SENT = "sent"
+DELIVERED = "delivered"
+FAILED = "failed"
+TIMEOUT = "timeout"
+REJECTED = "rejected"
+UNREACHABLE = "unreachable"
+
+
+def getControlSocket():
+    """
+    The unix socket of the router of the local node.
+    """
+    return os.path.join(CONTROL_SOCKET_DIR,
+                        IngestRegistry.getLocalNodeId() + ".sock")
+
+
+def getSensorNode(sensorId):
+    """
+    The registered node of a sensor, None for the local router.
+    """
+    try:
+        return IngestRegistry.getNodeForSensor(sensorId)
+    except PyMongoError:
+        return None
+
+
+def _request(message, timeout, node=None):
+    """
+    Send a request to the router of a node (the local one if None) and
+    return its reply.
+    """
+    if node is None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        address = getControlSocket()
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        address = (node["host"] or "localhost", node["controlPort"])
+        message = dict(message)
+        message["key"] = node["controlKey"]
+    try:
+        sock.settimeout(timeout)
+        sock.connect(address)
+        sock.sendall(json.dumps(message) + "\n")
+        reply = sock.makefile().readline()
+        if reply == "":
+            raise socket.error("Connection closed")
+        return json.loads(reply)
+    finally:
+        sock.close()
+
+
+def sendCommandToSensor(sensorId, command, timeout=COMMAND_TIMEOUT):
+    """
+    Route a command (a JSON string) to a sensor. If the sensor is
+    connected, waits for it to be delivered; otherwise it is queued for
+    the sensor. Returns the command record (see Command.toJson); its
+    "status" is DELIVERED or QUEUED when all went well.
+    """
+    request = {"op": "send",
+               "sensorId": sensorId,
+               "command": command,
+               "timeout": timeout}
+    try:
+        return _request(request, timeout + 1, getSensorNode(sensorId))
+    except (socket.error, socket.timeout, ValueError) as e:
+        util.errorPrint("SensorControl: router unreachable " + str(e))
+        return {"sensorId": sensorId, "status": UNREACHABLE,
+                "error": str(e)}
+
+
+def getCommandHistory(sensorId):
+    """
+    The recent commands of a sensor, oldest first, from its node.
+    """
+    return _request({"op": "history", "sensorId": sensorId},
+                    COMMAND_TIMEOUT, getSensorNode(sensorId))["commands"]
+
+
+def getControlStatus(node=None):
+    """
+    The sensors known to the router of a node (the local one if None),
+    whether they are connected and their queued and in-flight command
+    counts.
+    """
+    return _request({"op": "status"}, COMMAND_TIMEOUT, node)["sensors"]
+
+
+class CommandChannel:
+    """
+    The owner side: registers the connection of a sensor with the router
+    and relays the commands routed to it. Used from the (single threaded)
+    read loop of the streaming server: select on it and call dispatch when
+    it is readable.
+    """
+
+    def __init__(self, sensorId):
+        self.sensorId = sensorId
+        self.sock = None
+        self.buf = ""
+        self.connectTime = 0
+        self.connect()
+
+    def connect(self):
+        self.connectTime = time.time()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(getControlSocket())
+            sock.sendall(json.dumps({"op": "register",
+                                     "sensorId": self.sensorId}) + "\n")
+            self.sock = sock
+            self.buf = ""
+        except socket.error as e:
+            util.errorPrint("SensorControl: cannot register " +
+                            self.sensorId + " " + str(e))
+            sock.close()
+
+    def checkConnection(self):
+        """
+        Registers again if the router went away (e.g. restarted).
+        """
+        if self.sock is None and \
+                time.time() - self.connectTime > CHANNEL_RECONNECT_INTERVAL:
+            self.connect()
+        return self.sock is not None
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def dispatch(self, send):
+        """
+        Reads the commands routed to the sensor, calls send(command) for
+        each of them and acknowledges it to the router.
+        """
+        try:
+            data = self.sock.recv(4096)
+        except socket.error:
+            data = ""
+        if data == "":
+            self.close()
+            return
+        self.buf = self.buf + data
+        while "\n" in self.buf:
+            line, self.buf = self.buf.split("\n", 1)
+            message = json.loads(line)
+            ack = {"op": "ack", "id": message["id"], "status": DELIVERED}
+            try:
+                send(message["command"])
+            except:
+                ack["status"] = FAILED
+                ack["error"] = str(sys.exc_info()[1])
+            try:
+                self.sock.sendall(json.dumps(ack) + "\n")
+            except socket.error:
+                self.close()
+                return
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class Command:
+    def __init__(self, commandId, sensorId, command, result):
+        self.id = commandId
+        self.sensorId = sensorId
+        self.command = command
+        self.status = QUEUED
+        self.error = None
+        self.submitted = time.time()
+        self.completed = None
+        # Set when the command reaches a final status.
+        self.result = result
+
+    def isDone(self):
+        return self.status not in (QUEUED, SENT)
+
+    def complete(self, status, error=None):
+        if self.isDone():
+            return
+        self.status = status
+        self.error = error
+        self.completed = time.time()
+        self.result.set(self.toJson())
+
+    def toJson(self):
+        return {"id": self.id,
+                "sensorId": self.sensorId,
+                "command": self.command,
+                "status": self.status,
+                "error": self.error,
+                "submitted": self.submitted,
+                "completed": self.completed}
+
+
+class Owner:
+    """
+    The registered connection of a sensor, in the router.
+    """
+
+    def __init__(self, sensorId, conn):
+        self.sensorId = sensorId
+        self.conn = conn
+        self.inflight = {}
+
+    def send(self, command):
+        self.conn.sendall(json.dumps({"op": "command",
+                                      "id": command.id,
+                                      "command": command.command}) + "\n")
+        command.status = SENT
+        self.inflight[command.id] = command
+
+
+class SensorControlRouter:
+    def __init__(self, controlKey=None):
+        self.controlKey = controlKey
+        self.owners = {}
+        self.queues = {}
+        self.history = collections.deque(maxlen=COMMAND_HISTORY_SIZE)
+        self.commandCount = 0
+
+    def submit(self, sensorId, command, timeout):
+        self.commandCount = self.commandCount + 1
+        cmd = Command(self.commandCount, sensorId, command, AsyncResult())
+        self.history.append(cmd)
+        queue = self.queues.setdefault(sensorId, collections.deque())
+        if len(queue) >= MAX_QUEUED_COMMANDS:
+            cmd.complete(REJECTED, "Too many queued commands")
+            return cmd
+        queue.append(cmd)
+        gevent.spawn_later(timeout, self.expire, cmd)
+        self.flush(sensorId)
+        return cmd
+
+    def expire(self, cmd):
+        if cmd.isDone():
+            return
+        queue = self.queues.get(cmd.sensorId)
+        if queue is not None and cmd in queue:
+            queue.remove(cmd)
+        owner = self.owners.get(cmd.sensorId)
+        if owner is not None:
+            owner.inflight.pop(cmd.id, None)
+        cmd.complete(TIMEOUT)
+
+    def flush(self, sensorId):
+        """
+        Forward the queued commands of a sensor to its owner, in order.
+        """
+        owner = self.owners.get(sensorId)
+        queue = self.queues.get(sensorId)
+        while owner is not None and queue:
+            cmd = queue[0]
+            try:
+                owner.send(cmd)
+            except socket.error:
+                self.unregister(owner)
+                return
+            queue.popleft()
+
+    def register(self, owner):
+        previous = self.owners.get(owner.sensorId)
+        if previous is not None:
+            self.unregister(previous)
+        self.owners[owner.sensorId] = owner
+        util.debugPrint("SensorControl: registered " + owner.sensorId)
+        self.flush(owner.sensorId)
+
+    def unregister(self, owner):
+        if self.owners.get(owner.sensorId) is owner:
+            del self.owners[owner.sensorId]
+        for cmd in owner.inflight.values():
+            cmd.complete(FAILED, "Sensor connection closed")
+        owner.inflight = {}
+        try:
+            owner.conn.close()
+        except socket.error:
+            pass
+
+    def getHistory(self, sensorId):
+        return [cmd.toJson() for cmd in self.history
+                if sensorId is None or cmd.sensorId == sensorId]
+
+    def getStatus(self):
+        retval = {}
+        for sensorId, queue in self.queues.items():
+            retval[sensorId] = {"connected": False,
+                                "queued": len(queue),
+                                "inflight": 0}
+        for sensorId, owner in self.owners.items():
+            retval[sensorId] = {"connected": True,
+                                "queued": len(self.queues.get(sensorId, [])),
+                                "inflight": len(owner.inflight)}
+        return retval
+
+    def handle(self, conn, addr):
+        """
+        StreamServer handler of the unix socket: one greenlet per
+        connection (an owner, or a client with a single request).
+        """
+        self.serve(conn, True)
+
+    def handleRemote(self, conn, addr):
+        """
+        StreamServer handler of the TCP control port: clients only.
+        """
+        self.serve(conn, False)
+
+    def serve(self, conn, isLocal):
+        f = conn.makefile()
+        owner = None
+        try:
+            line = f.readline()
+            if line == "":
+                return
+            request = json.loads(line)
+            op = request["op"]
+            if not isLocal and request.get("key") != self.controlKey:
+                util.errorPrint("SensorControl: bad key from " +
+                                str(conn.getpeername()))
+                return
+            if op == "register" and isLocal:
+                owner = Owner(request["sensorId"], conn)
+                self.register(owner)
+                while True:
+                    line = f.readline()
+                    if line == "":
+                        break
+                    ack = json.loads(line)
+                    cmd = owner.inflight.pop(ack["id"], None)
+                    if cmd is not None:
+                        cmd.complete(ack["status"], ack.get("error"))
+            elif op == "send":
+                cmd = self.submit(request["sensorId"], request["command"],
+                                  request.get("timeout", COMMAND_TIMEOUT))
+                if cmd.sensorId in self.owners:
+                    reply = cmd.result.get()
+                else:
+                    reply = cmd.toJson()
+                conn.sendall(json.dumps(reply) + "\n")
+            elif op == "history":
+                conn.sendall(json.dumps(
+                    {"commands": self.getHistory(request.get("sensorId"))}) +
+                    "\n")
+            elif op == "status":
+                conn.sendall(json.dumps({"sensors": self.getStatus()}) +
+                             "\n")
+        except:
+            util.errorPrint("SensorControl: " + str(sys.exc_info()[1]))
+        finally:
+            if owner is not None:
+                self.unregister(owner)
+            conn.close()
+
+
+def bindControlSocket():
+    """
+    Bind the unix socket of the local router, replacing a stale socket
+    file. Returns None if a router is already running.
+    """
+    if not os.path.exists(CONTROL_SOCKET_DIR):
+        try:
+            os.makedirs(CONTROL_SOCKET_DIR)
+        except OSError:
+            # Another process created it.
+            pass
+    path = getControlSocket()
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        return None
+    except socket.error as e:
+        if e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+            raise
+    finally:
+        probe.close()
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    listener = gevent.socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(128)
+    return listener
+
+
+def runRouter(controlPort=None, controlKey=None):
+    """
+    Entry point of the router process. Clients on other hosts reach it on
+    controlPort if given.
+    """
+    gevent.reinit()
+    listener = bindControlSocket()
+    if listener is None:
+        util.debugPrint("SensorControl: router already running")
+        return
+    util.debugPrint("SensorControl: router running " + str(os.getpid()))
+    router = SensorControlRouter(controlKey)
+    if controlPort is not None:
+        StreamServer(("0.0.0.0", controlPort), router.handleRemote).start()
+    StreamServer(listener, router.handle).serve_forever()
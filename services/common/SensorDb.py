@@ -25,6 +25,7 @@ Created on Jan 26, 2015
 import Accounts
 import DbCollections
 import msgutils
+import DayIndex
 import SessionLock
 import pymongo
 import authentication
@@ -33,10 +34,10 @@ import os
 import sys
 import signal
 import util
-import socket
 import traceback
 import json
 from DataStreamSharedState import MemCache
+import SensorControl
 import Config
 
 from Sensor import Sensor
@@ -66,6 +67,7 @@ def getAllSensorIds():
     sensorIds = []
     for sensor in DbCollections.getSensors().find():
         sensorIds.append(sensor[SENSOR_ID])
+    return sensorIds
 
 
 def checkSensorConfig(sensorConfig):
@@ -102,6 +104,7 @@ def addSensor(sensorConfig):
         DbCollections.getSensors().insert(sensorConfig)
         dataPosts = DbCollections.getDataMessages(sensorId)
         dataPosts.create_index([('t', pymongo.ASCENDING)])
+        DayIndex.create(sensorId)
         sensors = getAllSensors()
         return {STATUS: "OK", "sensors": sensors}
 
@@ -131,13 +134,9 @@ def addDefaultOccupancyCalculationParameters(sensorId, jsonData):
 
 
 def notifyConfigChange(sensorId):
-    memCache = MemCache()
-    port = memCache.getSensorArmPort(sensorId)
-    soc = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    soc.sendto(
-        json.dumps({"sensorId": sensorId,
-                    "command": "retune"}), ("localhost", port))
-    soc.close()
+    SensorControl.sendCommandToSensor(sensorId, json.dumps(
+        {"sensorId": sensorId,
+         "command": "retune"}))
 
 
 def activateBand(sensorId, bandName):
@@ -305,6 +304,7 @@ def purgeSensor(sensor):
             msgutils.removeData(dataMessage)
         DbCollections.getDataMessages(sensorId).remove({SENSOR_ID: sensorId})
         DbCollections.dropDataMessages(sensorId)
+        DbCollections.dropDayIndex(sensorId)
         # remove the capture events.
         DbCollections.getCaptureEventDb(sensorId).remove({SENSOR_ID: sensorId})
         # Location messages contain no associated data.
@@ -21,16 +21,27 @@
 Created on Feb 11, 2015
 
 @author: local
+
+Sessions are kept in memcache, one key per session (SESSION_KEY + session
+ID) that expires with the session, plus an index of the session IDs split
+in SESSION_INDEX_SHARDS keys (by hash of the ID) so that sessions can be
+listed. Adding a session is an atomic add of its key, updating it a
+replace (so that a removed session is not brought back) and the index is
+updated with check-and-set: logging in, checking and logging out a session
+take no lock. The garbage collector (runGc) cleans up one index shard per
+GC_INTERVAL.
+
+acquire/release is a lock for the admin maintenance operations (e.g.
+removing a sensor) that must not run concurrently with each other.
 '''
 import time
 import util
-import memcache
 import os
+import zlib
 import timezone
 import SendMail
 from flask import request
 from Defines import EXPIRE_TIME
-from Defines import SESSIONS
 from Defines import SESSION_ID
 from Defines import USER_NAME
 from Defines import REMOTE_ADDRESS
@@ -48,15 +59,45 @@ from Defines import FIFTEEN_MINUTES
 from Defines import FROZEN
 from Defines import FREEZE_REQUESTER
 from multiprocessing import Process
+import DataStreamSharedState
+from DataStreamSharedState import MemCache
+
+SESSION_KEY = "session_"
+SESSION_INDEX = "sessionIndex_"
+SESSION_INDEX_SHARDS = 16
+
+# Seconds between two index shards cleaned up by the garbage collector,
+# and between two checks of the freeze request.
+GC_INTERVAL = 1
+FREEZE_CHECK_INTERVAL = 10
+
+
+def getSessionKey(sessionId):
+    return str(SESSION_KEY + sessionId).encode("UTF-8")
+
+
+def getIndexKey(shard):
+    return SESSION_INDEX + str(shard)
+
+
+def getShard(sessionId):
+    return zlib.crc32(str(sessionId)) % SESSION_INDEX_SHARDS
+
+
+def getSessionExpiry(session):
+    """
+    Seconds memcache keeps a session.
+    """
+    return max(int(session[EXPIRE_TIME] - time.time()), 1)
 
 
 class SessionLock:
     def __init__(self):
-        self.mc = memcache.Client(['127.0.0.1:11211'], debug=0)
+        self.mc = DataStreamSharedState.getClient()
         self.key = os.getpid()
         self.mc.set("_memCacheTest", 1)
         self.memcacheStarted = (self.mc.get("_memCacheTest") == 1)
-        self.mc.add(SESSIONS, {})
+        self.gcShard = 0
 
     def acquire(self):
         if not self.memcacheStarted:
@@ -82,19 +123,27 @@ class SessionLock:
             return
         self.mc.delete("sessionLock")
 
+    def addToIndex(self, sessionId):
+        def update(index):
+            return (index or set()) | set([sessionId])
+        getMemCache().casUpdate(getIndexKey(getShard(sessionId)), update)
+
+    def removeFromIndex(self, shard, sessionIds):
+        def update(index):
+            return (index or set()) - set(sessionIds)
+        getMemCache().casUpdate(getIndexKey(shard), update)
+
     def addSession(self, session):
-        self.acquire()
-        try:
-            util.debugPrint("addSession: " + str(session))
-            activeSessions = self.mc.get(SESSIONS)
-            self.mc.delete(SESSIONS)
-            if activeSessions is None:
-                activeSessions = {}
-            activeSessions[session[SESSION_ID]] = session
-            self.mc.add(SESSIONS, activeSessions)
-            util.debugPrint("sessions:" + str(self.getSessions()))
-        finally:
-            self.release()
+        """
+        Add a new session. Returns False if the session ID is taken.
+        """
+        util.debugPrint("addSession: %s", session)
+        sessionId = session[SESSION_ID]
+        if not self.mc.add(getSessionKey(sessionId), session,
+                           time=getSessionExpiry(session)):
+            return False
+        self.addToIndex(sessionId)
+        return True
 
     def freezeRequest(self, userName):
         self.mc.add(FROZEN, {STATE: PENDING_FREEZE,
@@ -123,62 +172,30 @@ class SessionLock:
             return frozen[USER_NAME]
 
     def getSession(self, sessionId):
-        self.acquire()
-        try:
-            activeSessions = self.mc.get(SESSIONS)
-            if activeSessions is None:
-                return None
-            else:
-                if sessionId in activeSessions:
-                    return activeSessions[sessionId]
-                else:
-                    return None
-        finally:
-            self.release()
+        session = self.mc.get(getSessionKey(sessionId))
+        if session is None or time.time() > session[EXPIRE_TIME]:
+            return None
+        return session
 
     def removeSession(self, sessionId):
-        self.acquire()
-        try:
-            util.debugPrint("removeSession: " + sessionId)
-            activeSessions = self.mc.get(SESSIONS)
-            self.mc.delete(SESSIONS)
-            if sessionId in activeSessions:
-                del activeSessions[sessionId]
-            self.mc.add(SESSIONS, activeSessions)
-        finally:
-            self.release()
+        util.debugPrint("removeSession: " + sessionId)
+        self.mc.delete(getSessionKey(sessionId))
+        self.removeFromIndex(getShard(sessionId), [sessionId])
 
     def removeSessionByAddr(self, userName, remoteAddress):
-        self.acquire()
-        try:
-            activeSessions = self.mc.get(SESSIONS)
-            if activeSessions is None:
-                return
-            self.mc.delete(SESSIONS)
-            for sessionId in activeSessions.keys():
-                session = activeSessions[sessionId]
-                if session[REMOTE_ADDRESS] == remoteAddress and session[
-                        USER_NAME] == userName:
-                    del activeSessions[sessionId]
-                    break
-            self.mc.add(SESSIONS, activeSessions)
-        finally:
-            self.release()
+        activeSessions = self.getSessions()
+        for sessionId in activeSessions.keys():
+            session = activeSessions[sessionId]
+            if session[REMOTE_ADDRESS] == remoteAddress and session[
+                    USER_NAME] == userName:
+                self.removeSession(sessionId)
+                break
 
     def removeSessionsByPrivilege(self, privilege):
-        self.acquire()
-        try:
-            activeSessions = self.mc.get(SESSIONS)
-            if activeSessions is None:
-                return
-            self.mc.delete(SESSIONS)
-            for sessionId in activeSessions.keys():
-                session = activeSessions[sessionId]
-                if sessionId.startswith(privilege):
-                    del activeSessions[sessionId]
-            self.mc.add(SESSIONS, activeSessions)
-        finally:
-            self.release()
+        activeSessions = self.getSessions()
+        for sessionId in activeSessions.keys():
+            if sessionId.startswith(privilege):
+                self.removeSession(sessionId)
 
     def findSessionByRemoteAddr(self, sid):
         try:
@@ -187,83 +204,88 @@ class SessionLock:
             util.debugPrint("remoteAddress = " + remoteAddress)
         except:
             remoteAddress = None
-        self.acquire()
-        try:
-            activeSessions = self.mc.get(SESSIONS)
-            for sessionId in activeSessions:
-                session = activeSessions[sessionId]
-                if session[
-                        REMOTE_ADDRESS] == remoteAddress and sid != sessionId:
-                    return session
-            return None
-        finally:
-            self.release()
+        activeSessions = self.getSessions()
+        for sessionId in activeSessions:
+            session = activeSessions[sessionId]
+            if session[
+                    REMOTE_ADDRESS] == remoteAddress and sid != sessionId:
+                return session
+        return None
 
     def updateSession(self, session):
-        self.acquire()
-        try:
-            activeSessions = self.mc.get(SESSIONS)
-            if activeSessions is None:
-                activeSessions = {}
-            sessionId = session[SESSION_ID]
-            if sessionId in activeSessions:
-                del activeSessions[sessionId]
-                self.mc.delete(SESSIONS)
-            activeSessions[session[SESSION_ID]] = session
-            self.mc.add(SESSIONS, activeSessions)
-        finally:
-            self.release()
+        """
+        Save a changed session (e.g. its expiry time) unless it was
+        removed meanwhile.
+        """
+        return self.mc.replace(getSessionKey(session[SESSION_ID]), session,
+                               time=getSessionExpiry(session))
 
     def gc(self):
-        self.acquire()
-        try:
-            activeSessions = self.mc.get(SESSIONS)
-            if activeSessions is None:
-                util.debugPrint("No active sessions")
-                # nothing to do.
-                return
-            self.mc.delete(SESSIONS)
-            for sessionId in activeSessions.keys():
-                session = activeSessions[sessionId]
-                if time.time() > session[EXPIRE_TIME]:
-                    util.debugPrint("SessionLock.gc removing: " + sessionId)
-                    del activeSessions[sessionId]
-            self.mc.add(SESSIONS, activeSessions)
-        finally:
-            self.release()
+        """
+        Remove the expired sessions of the next index shard.
+        """
+        shard = self.gcShard
+        self.gcShard = (self.gcShard + 1) % SESSION_INDEX_SHARDS
+        index = self.mc.get(getIndexKey(shard))
+        if not index:
+            return
+        sessions = self.mc.get_multi([getSessionKey(sessionId)
+                                      for sessionId in index])
+        now = time.time()
+        expired = []
+        for sessionId in index:
+            session = sessions.get(getSessionKey(sessionId))
+            if session is None or now > session[EXPIRE_TIME]:
+                util.debugPrint("SessionLock.gc removing: " + sessionId)
+                self.mc.delete(getSessionKey(sessionId))
+                expired.append(sessionId)
+        if len(expired) != 0:
+            self.removeFromIndex(shard, expired)
 
     def getSessionCount(self):
         return len(self.getSessions())
 
     def isUserLoggedIn(self, userName):
         sessions = self.getSessions()
-        for session in sessions:
+        for session in sessions.values():
             if session[USER_NAME] == userName:
                 return True
         return False
 
     def checkFreezeRequest(self):
-        self.acquire()
-        try:
-            frozen = self.mc.get(FROZEN)
-            currentTime = time.time()
-            if frozen is not None:
-                freezeRequester = frozen[USER_NAME]
-                t = frozen[TIME]
-                if frozen[STATE] == PENDING_FREEZE and self.getSessionCount() == 0:
+        frozen = self.mc.gets(FROZEN)
+        currentTime = time.time()
+        if frozen is not None:
+            freezeRequester = frozen[USER_NAME]
+            t = frozen[TIME]
+            if frozen[STATE] == PENDING_FREEZE and self.getSessionCount() == 0:
+                frozen[STATE] = FROZEN
+                frozen[TIME] = time.time()
+                # Only the process that made the change sends the mail.
+                if self.mc.cas(FROZEN, frozen):
                     SendMail.sendMail("No sessions active - please log in within 15 minutes and do your admin actions",
                                       freezeRequester, "System ready for administrator login")
-                    frozen[STATE] = FROZEN
-                    frozen[TIME] = time.time()
-                    self.mc.set(FROZEN, frozen)
-                elif frozen[STATE] == FROZEN and currentTime - t > FIFTEEN_MINUTES \
-                        and not self.isUserLoggedIn(freezeRequester):
-                    self.mc.delete(FROZEN)
-        finally:
-            self.release()
+            elif frozen[STATE] == FROZEN and currentTime - t > FIFTEEN_MINUTES \
+                    and not self.isUserLoggedIn(freezeRequester):
+                self.mc.delete(FROZEN)
 
     def getSessions(self):
-        return self.mc.get(SESSIONS)
+        """
+        The active sessions, by session ID.
+        """
+        indexes = self.mc.get_multi([getIndexKey(shard) for shard in
+                                     range(0, SESSION_INDEX_SHARDS)])
+        keys = []
+        for index in indexes.values():
+            keys.extend([getSessionKey(sessionId) for sessionId in index])
+        if len(keys) == 0:
+            return {}
+        now = time.time()
+        retval = {}
+        for session in self.mc.get_multi(keys).values():
+            if now <= session[EXPIRE_TIME]:
+                retval[session[SESSION_ID]] = session
+        return retval
 
 
 def getSessionLock():
@@ -282,7 +304,7 @@ def release():
 
 
 def isAcquired():
-    getSessionLock().isAquired()
+    return getSessionLock().isAquired()
 
 
 def getSession(sessionId):
@@ -290,7 +312,7 @@ def getSession(sessionId):
 
 
 def addSession(session):
-    getSessionLock().addSession(session)
+    return getSessionLock().addSession(session)
 
 
 def removeSessionByAddr(userName, remoteAddr):
@@ -302,14 +324,17 @@ def removeSession(sessionId):
 
 
 def updateSession(session):
-    getSessionLock().updateSession(session)
+    return getSessionLock().updateSession(session)
 
 
 def runGc():
+    freezeCheckTime = 0
     while True:
         getSessionLock().gc()
-        getSessionLock().checkFreezeRequest()
-        time.sleep(10)
+        if time.time() - freezeCheckTime > FREEZE_CHECK_INTERVAL:
+            getSessionLock().checkFreezeRequest()
+            freezeCheckTime = time.time()
+        time.sleep(GC_INTERVAL)
 
 
 def startSessionExpiredSessionScanner():
@@ -319,8 +344,6 @@ def startSessionExpiredSessionScanner():
 
 def getUserSessionCount():
     sessions = getSessionLock().getSessions()
-    if sessions is None:
-        return 0
     userSessionCount = 0
     for sessionKey in sessions.keys():
         if sessionKey.startswith(USER):
@@ -330,8 +353,6 @@ def getUserSessionCount():
 
 def getAdminSessionCount():
     sessions = getSessionLock().getSessions()
-    if sessions is None:
-        return 0
     adminSessionCount = 0
     for sessionKey in sessions.keys():
         if sessionKey.startswith(ADMIN):
@@ -370,6 +391,13 @@ def removeSessionsByPrivilege(privilege):
     return getSessionLock().removeSessionsByPrivilege(privilege)
 
 
+def getMemCache():
+    global _memCache
+    if "_memCache" not in globals():
+        _memCache = MemCache()
+    return _memCache
+
+
 def getSessions():
     retval = {}
     sessions = getSessionLock().getSessions()
@@ -390,6 +418,11 @@ def getSessions():
             userSession[EXPIRE_TIME] = timezone.getDateTimeFromLocalTimeStamp(
                 session[EXPIRE_TIME])
             userSession[REMOTE_ADDRESS] = session[REMOTE_ADDRESS]
+            # Live stream lag and drop statistics of the session if it has
+            # a viewer open (see DataStreaming.Viewer).
+            streaming = getMemCache().getViewerStatistics(sessionKey)
+            if streaming is not None:
+                userSession["streaming"] = streaming
             userSessions.append(userSession)
         elif sessionKey.startswith(ADMIN):
             adminSession = {}
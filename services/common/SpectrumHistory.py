@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#
+#This software was developed by employees of the National Institute of
+#Standards and Technology (NIST), and others.
+#This software has been contributed to the public domain.
+#Pursuant to title 15 Untied States Code Section 105, works of NIST
+#employees are not subject to copyright protection in the United States
+#and are considered to be in the public domain.
+#As a result, a formal license is not needed to use this software.
+#
+#This software is provided "AS IS."
+#NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+#OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+#AND DATA ACCURACY.  NIST does not warrant or make any representations
+#regarding the use of the software or the results thereof, including but
+#not limited to the correctness, accuracy, reliability or usefulness of
+#this software.
+'''
+Recent history of the live spectrums of each streaming sensor band.
+
+The streaming server writes every spectrum it reads into a fixed size
+ring in a memory mapped file (in /dev/shm when available) named after the
+sensor band. Web server workers map the same file read only, so a viewer
+can be back filled with the last few minutes of spectrums without
+waiting for a capture to be written to the database.
+
+The file is a header (magic, version, n, capacity, seconds per spectrum,
+count of spectrums written) followed by capacity slots of a float64
+timestamp and n int8 powers. The writer fills a slot before it bumps the
+count; readers re-read the count after copying to discard slots that
+were overwritten while they were being copied.
+'''
+
+import os
+import mmap
+import struct
+import numpy as np
+
+# Seconds of spectrums kept for each sensor band, at most HISTORY_MAX_MB
+# of them (fast sensors with many channels keep fewer seconds).
+HISTORY_SECONDS = 300
+HISTORY_MAX_MB = 16
+
+if os.path.isdir("/dev/shm"):
+    HISTORY_DIR = "/dev/shm/msod-history"
+else:
+    HISTORY_DIR = "/tmp/msod-history"
+
+MAGIC = "MSRH"
+VERSION = 1
+HEADER = struct.Struct("<4sIIIdQ")
+COUNT_OFFSET = HEADER.size - 8
+
+
+def getHistoryPath(sensorId, bandName):
+    return os.path.join(HISTORY_DIR, sensorId + ":" + bandName)
+
+
+def _slotDtype(n):
+    return np.dtype([("t", "<f8"), ("v", np.int8, (n, ))])
+
+
+class SpectrumHistoryWriter:
+    """
+    Owned by the streaming server process of a sensor. Not safe for more
+    than one writer per sensor band.
+    """
+
+    def __init__(self, sensorId, bandName, n, secondsPerSpectrum,
+                 seconds=HISTORY_SECONDS):
+        self.n = n
+        self.slotSize = _slotDtype(n).itemsize
+        maxSlots = max(1, HISTORY_MAX_MB * 1024 * 1024 // self.slotSize)
+        if secondsPerSpectrum > 0:
+            self.capacity = max(1, min(int(seconds / secondsPerSpectrum),
+                                       maxSlots))
+        else:
+            self.capacity = maxSlots
+        self.count = 0
+        if not os.path.exists(HISTORY_DIR):
+            try:
+                os.makedirs(HISTORY_DIR)
+            except OSError:
+                # Another process created it.
+                pass
+        path = getHistoryPath(sensorId, bandName)
+        # Build the file under a temporary name and rename it so readers
+        # never map a partially initialized file.
+        tmpPath = path + "." + str(os.getpid())
+        size = HEADER.size + self.capacity * self.slotSize
+        with open(tmpPath, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, n, self.capacity,
+                                secondsPerSpectrum, 0))
+            f.truncate(size)
+        self.f = open(tmpPath, "r+b")
+        self.mm = mmap.mmap(self.f.fileno(), size)
+        os.rename(tmpPath, path)
+
+    def append(self, timestamp, powers):
+        """
+        Append a spectrum (int8 array of length n).
+        """
+        offset = HEADER.size + (self.count % self.capacity) * self.slotSize
+        self.mm[offset:offset + 8] = struct.pack("<d", timestamp)
+        self.mm[offset + 8:offset + self.slotSize] = powers.tostring()
+        self.count = self.count + 1
+        struct.pack_into("<Q", self.mm, COUNT_OFFSET, self.count)
+
+    def close(self):
+        self.mm.close()
+        self.f.close()
+
+
+def readHistory(sensorId, bandName, seconds=None):
+    """
+    Read the spectrums of the last seconds (all that are kept if None).
+    Returns (timestamps, powers) with powers an int8 (spectrums x n) array,
+    or None if there is no history for the sensor band.
+    """
+    path = getHistoryPath(sensorId, bandName)
+    try:
+        f = open(path, "rb")
+    except IOError:
+        return None
+    try:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+    try:
+        (magic, version, n, capacity, secondsPerSpectrum,
+         countBefore) = HEADER.unpack_from(mm)
+        if magic != MAGIC or version != VERSION:
+            return None
+        slots = np.frombuffer(mm, dtype=_slotDtype(n), count=capacity,
+                              offset=HEADER.size).copy()
+        (countAfter, ) = struct.unpack_from("<Q", mm, COUNT_OFFSET)
+    finally:
+        mm.close()
+    # Oldest slot that was not overwritten while copying.
+    first = max(0, countBefore - capacity, countAfter + 1 - capacity)
+    indices = np.arange(first, countBefore) % capacity
+    timestamps = slots["t"][indices]
+    powers = slots["v"][indices]
+    if seconds is not None and len(timestamps) != 0:
+        keep = timestamps >= timestamps[-1] - seconds
+        timestamps = timestamps[keep]
+        powers = powers[keep]
+    return (timestamps, powers)
+
+
+def getHistoryCount(sensorId, bandName):
+    """
+    The number of spectrums written for the sensor band since the
+    streaming server last (re)started it, or None if there is no history.
+    """
+    try:
+        f = open(getHistoryPath(sensorId, bandName), "rb")
+    except IOError:
+        return None
+    try:
+        header = f.read(HEADER.size)
+    finally:
+        f.close()
+    if len(header) != HEADER.size:
+        return None
+    (magic, version, n, capacity, secondsPerSpectrum,
+     count) = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        return None
+    return count
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+#This software was developed by employees of the National Institute of
+#Standards and Technology (NIST), and others.
+#This software has been contributed to the public domain.
+#Pursuant to title 15 Untied States Code Section 105, works of NIST
+#employees are not subject to copyright protection in the United States
+#and are considered to be in the public domain.
+#As a result, a formal license is not needed to use this software.
+#
+#This software is provided "AS IS."
+#NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+#OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+#AND DATA ACCURACY.  NIST does not warrant or make any representations
+#regarding the use of the software or the results thereof, including but
+#not limited to the correctness, accuracy, reliability or usefulness of
+#this software.
+'''
+Optional compressed framing of the spectrums of a sensor stream.
+
+A sensor that supports it asks the server which framing versions and
+codecs it accepts (/sensorcontrol/getStreamingCapabilities) and declares
+the one it uses in its data message:
+
+    "Compression": {"ver": 1, "codec": "delta-zlib"}
+
+The power values then come in blocks instead of one spectrum after the
+other: BLOCK_HEADER (number of spectrums m, payload length, big endian)
+followed by the payload, which decodes to the m * n int8 values of the
+block. Codecs (version 1):
+
+    zlib       -- zlib of the int8 values.
+    delta-zlib -- the first spectrum of the block as is, then each one as
+                  its difference (mod 256) from the previous one, zlib
+                  compressed. Adjacent spectrums that differ little give
+                  long runs of small values.
+
+Each block stands on its own. Sensors that do not declare compression
+(no Compression field, or the standard "Compression": "None") stream raw
+int8 values as before.
+'''
+
+import struct
+import time
+import zlib
+import numpy as np
+
+COMPRESSION_VERSION = 1
+ZLIB = "zlib"
+DELTA_ZLIB = "delta-zlib"
+
+# Codecs supported for each framing version.
+CODECS = {1: [ZLIB, DELTA_ZLIB]}
+
+BLOCK_HEADER = struct.Struct(">HI")
+
+# Upper bound of the decoded size of a block.
+MAX_BLOCK_BYTES = 16 * 1024 * 1024
+
+
+def getCapabilities():
+    return {"versions": dict((str(version), codecs)
+                             for version, codecs in CODECS.items())}
+
+
+def checkCompression(compression):
+    """
+    Validates the Compression field of a data message. Returns the codec.
+    """
+    if not isinstance(compression, dict):
+        raise Exception("Unsupported compression " + str(compression))
+    version = compression.get("ver")
+    codec = compression.get("codec")
+    if version not in CODECS:
+        raise Exception("Unsupported compression version " + str(version))
+    if codec not in CODECS[version]:
+        raise Exception("Unsupported compression codec " + str(codec))
+    return codec
+
+
+def encodeBlock(codec, spectrums, level=6):
+    """
+    Frame a block of spectrums (int8 array, one row per spectrum).
+    """
+    values = np.array(spectrums, dtype=np.int8).view(np.uint8)
+    if codec == DELTA_ZLIB:
+        values = values.copy()
+        values[1:] = values[1:] - values[:-1]
+    payload = zlib.compress(values.tostring(), level)
+    return BLOCK_HEADER.pack(len(spectrums), len(payload)) + payload
+
+
+def decodeBlock(codec, payload, count, n):
+    """
+    The (count, n) int8 spectrums of a block payload.
+    """
+    size = count * n
+    decompressor = zlib.decompressobj()
+    data = decompressor.decompress(payload, size)
+    if len(data) != size or decompressor.unconsumed_tail != "":
+        raise Exception("Compressed block does not match its size")
+    values = np.fromstring(data, dtype=np.uint8).reshape(count, n)
+    if codec == DELTA_ZLIB:
+        values = np.cumsum(values, axis=0, dtype=np.uint8)
+    return values.view(np.int8)
+
+
+class BlockReader:
+    """
+    Stands in for the stream buffer of a sensor that sends compressed
+    blocks: readByte returns the power values one by one, decoding a whole
+    block when the previous one is used up. Keeps the compression ratio
+    and decode cost.
+    """
+
+    def __init__(self, bbuf, n, codec):
+        self.bbuf = bbuf
+        self.n = n
+        self.codec = codec
+        self.values = []
+        self.index = 0
+        self.blocks = 0
+        self.spectrums = 0
+        self.wireBytes = 0
+        self.decodeSeconds = 0
+
+    def readBlock(self):
+        count, length = BLOCK_HEADER.unpack(
+            self.bbuf.readBytes(BLOCK_HEADER.size))
+        if count == 0 or count * self.n > MAX_BLOCK_BYTES:
+            raise Exception("Invalid compressed block of " + str(count) +
+                            " spectrums")
+        payload = self.bbuf.readBytes(length)
+        start = time.time()
+        spectrums = decodeBlock(self.codec, payload, count, self.n)
+        self.values = spectrums.ravel().tolist()
+        self.decodeSeconds = self.decodeSeconds + time.time() - start
+        self.index = 0
+        self.blocks = self.blocks + 1
+        self.spectrums = self.spectrums + count
+        self.wireBytes = self.wireBytes + BLOCK_HEADER.size + length
+
+    def readByte(self):
+        if self.index == len(self.values):
+            self.readBlock()
+        value = self.values[self.index]
+        self.index = self.index + 1
+        return value
+
+    def getStatistics(self):
+        rawBytes = self.spectrums * self.n
+        retval = {"codec": self.codec,
+                  "blocks": self.blocks,
+                  "spectrums": self.spectrums,
+                  "rawBytes": rawBytes,
+                  "wireBytes": self.wireBytes,
+                  "ratio": None,
+                  "decodeMicrosPerSpectrum": None}
+        if self.wireBytes != 0:
+            retval["ratio"] = float(rawBytes) / self.wireBytes
+        if self.spectrums != 0:
+            retval["decodeMicrosPerSpectrum"] = \
+                1e6 * self.decodeSeconds / self.spectrums
+        return retval
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#
+#This software was developed by employees of the National Institute of
+#Standards and Technology (NIST), and others.
+#This software has been contributed to the public domain.
+#Pursuant to title 15 Untied States Code Section 105, works of NIST
+#employees are not subject to copyright protection in the United States
+#and are considered to be in the public domain.
+#As a result, a formal license is not needed to use this software.
+#
+#This software is provided "AS IS."
+#NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+#OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+#AND DATA ACCURACY.  NIST does not warrant or make any representations
+#regarding the use of the software or the results thereof, including but
+#not limited to the correctness, accuracy, reliability or usefulness of
+#this software.
+'''
+Recording tap for the raw stream of a sensor.
+
+When recording is turned on for a sensor (admin setStreamRecording), its
+streaming server writes the messages and spectrums it receives to
+preallocated memory mapped files in RECORDING_DIR/<sensorId>, rotating
+to a new file every fileSizeMB and keeping the newest maxFiles.
+
+Each file is in the .dat layout used by the test tools (<length>\\r<json>
+for the location, system and data messages, then the int8 power values)
+and starts with the messages in effect, so any file can be replayed on
+its own (e.g. unit-tests/SensorLoadGenerator.py -data). A message that
+changes once spectrums were recorded starts a new file. Next to it, a
+.idx file holds (timestamp float64, file offset uint64) entries every
+INDEX_INTERVAL seconds for seeking by time.
+
+Settings take effect when the sensor next connects.
+'''
+
+import os
+import mmap
+import struct
+import time
+import util
+from Defines import LOC
+from Defines import SYS
+from Defines import DATA
+
+RECORDING_DIR = "/var/tmp/msod-recordings"
+
+# Defaults for the per sensor settings.
+RECORDING_FILE_SIZE_MB = 64
+RECORDING_MAX_FILES = 16
+
+# Accepted file sizes: the smallest holds the location, system and data
+# messages that start every file with room to spare.
+MIN_FILE_SIZE_MB = 1
+MAX_FILE_SIZE_MB = 1024
+
+# Seconds between time index entries.
+INDEX_INTERVAL = 1.0
+
+INDEX_ENTRY = struct.Struct("<dQ")
+
+# Order of the messages at the start of a file.
+HEADER_TYPES = [LOC, SYS, DATA]
+
+
+def getRecordingDir(sensorId):
+    return os.path.join(RECORDING_DIR, sensorId)
+
+
+def listRecordings(sensorId):
+    """
+    Returns the recordings of a sensor, oldest first, as a list of
+    dictionaries (file name, size in bytes, start and end times).
+    """
+    directory = getRecordingDir(sensorId)
+    if not os.path.exists(directory):
+        return []
+    retval = []
+    for name in os.listdir(directory):
+        if not name.endswith(".dat"):
+            continue
+        path = os.path.join(directory, name)
+        entries = readIndex(path)
+        retval.append({"file": name,
+                       "size": os.path.getsize(path),
+                       "startTime": entries[0][0] if entries else None,
+                       "endTime": entries[-1][0] if entries else None})
+    retval.sort(key=lambda r: r["file"])
+    return retval
+
+
+def readIndex(path):
+    """
+    The (timestamp, offset) entries of the time index of a recording.
+    """
+    try:
+        with open(path[:-len(".dat")] + ".idx", "rb") as f:
+            data = f.read()
+    except IOError:
+        return []
+    count = len(data) // INDEX_ENTRY.size
+    return [INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size)
+            for i in range(0, count)]
+
+
+class StreamRecorder:
+    """
+    Owned by the streaming server process of a sensor.
+    """
+
+    def __init__(self, sensorId, fileSizeMB=RECORDING_FILE_SIZE_MB,
+                 maxFiles=RECORDING_MAX_FILES):
+        self.sensorId = sensorId
+        fileSizeMB = min(max(fileSizeMB, MIN_FILE_SIZE_MB), MAX_FILE_SIZE_MB)
+        self.fileSize = int(fileSizeMB * 1024 * 1024)
+        self.maxFiles = max(int(maxFiles), 1)
+        self.mapSize = 0
+        self.path = None
+        self.directory = getRecordingDir(sensorId)
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        self.headers = {}
+        self.fileCount = 0
+        self.f = None
+        self.mm = None
+        self.indexFile = None
+
+    def _open(self, length=0):
+        """
+        Start a new file with the header messages and room for length
+        more bytes (beyond fileSize if they do not fit).
+        """
+        self.fileCount = self.fileCount + 1
+        name = "%d-%d-%06d" % (int(time.time()), os.getpid(), self.fileCount)
+        self.path = os.path.join(self.directory, name + ".dat")
+        headerLength = sum(len(h) for h in self.headers.values())
+        self.mapSize = max(self.fileSize, headerLength + length)
+        self.f = open(self.path, "w+b")
+        self.f.truncate(self.mapSize)
+        self.mm = mmap.mmap(self.f.fileno(), self.mapSize)
+        self.indexFile = open(os.path.join(self.directory, name + ".idx"),
+                              "wb")
+        self.indexTime = 0
+        self._writeHeaders()
+        self._removeOldFiles()
+
+    def _writeHeaders(self):
+        self.offset = 0
+        for headerType in HEADER_TYPES:
+            if headerType in self.headers:
+                self._write(self.headers[headerType])
+        self.headerEnd = self.offset
+
+    def _finish(self):
+        if self.mm is None:
+            return
+        self.mm.close()
+        # Drop the unused preallocated tail.
+        self.f.truncate(self.offset)
+        self.f.close()
+        self.indexFile.close()
+        self.mm = None
+
+    def _removeOldFiles(self):
+        recordings = listRecordings(self.sensorId)
+        for recording in recordings[0:max(0, len(recordings) -
+                                          self.maxFiles)]:
+            path = os.path.join(self.directory, recording["file"])
+            if path == self.path:
+                # The file being written.
+                continue
+            util.debugPrint("StreamRecorder: removing " + path)
+            for p in [path, path[:-len(".dat")] + ".idx"]:
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+
+    def _write(self, data):
+        self.mm[self.offset:self.offset + len(data)] = data
+        self.offset = self.offset + len(data)
+
+    def _reserve(self, length):
+        if self.mm is None:
+            self._open(length)
+        elif self.offset + length > self.mapSize:
+            self._finish()
+            self._open(length)
+
+    def writeHeader(self, headerType, jsonString):
+        """
+        Record a message as received (the JSON string).
+        """
+        data = str(len(jsonString)) + "\r" + jsonString
+        if self.headers.get(headerType) == data:
+            return
+        self.headers[headerType] = data
+        headerLength = sum(len(h) for h in self.headers.values())
+        if self.mm is not None and self.offset == self.headerEnd and \
+                headerLength <= self.mapSize:
+            # No spectrums in this file yet: rewrite its messages.
+            self._writeHeaders()
+            return
+        # The spectrums of a file follow the messages at its start, so
+        # a new file starts with all the messages, this one included.
+        self._finish()
+        self._open()
+
+    def writeSpectrum(self, timestamp, powers):
+        """
+        Record a spectrum (int8 array).
+        """
+        data = powers.tostring()
+        self._reserve(len(data))
+        if timestamp - self.indexTime >= INDEX_INTERVAL:
+            self.indexFile.write(INDEX_ENTRY.pack(timestamp, self.offset))
+            self.indexFile.flush()
+            self.indexTime = timestamp
+        self._write(data)
+
+    def close(self):
+        self._finish()
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+#
+#This software was developed by employees of the National Institute of
+#Standards and Technology (NIST), and others.
+#This software has been contributed to the public domain.
+#Pursuant to title 15 Untied States Code Section 105, works of NIST
+#employees are not subject to copyright protection in the United States
+#and are considered to be in the public domain.
+#As a result, a formal license is not needed to use this software.
+#
+#This software is provided "AS IS."
+#NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+#OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+#AND DATA ACCURACY.  NIST does not warrant or make any representations
+#regarding the use of the software or the results thereof, including but
+#not limited to the correctness, accuracy, reliability or usefulness of
+#this software.
+'''
+Push based fan out of live spectrums from the streaming server (one
+process per connected sensor) to the web server workers.
+
+Each web server worker that has viewers for a sensor band binds a unix
+datagram socket named <sensorId>:<bandName>:<pid> in FANOUT_SOCKET_DIR.
+The streaming server sends every spectrum it reads to all of the sockets
+for that sensor band, so there is one delivery per worker regardless of
+how many browsers are watching and no polling of memcache.
+
+A frame is a (sequence number, timestamp, spectrums per frame) header
+followed by one int8 power value per frequency bin. When viewers ask for
+a lower frame rate than the sensor produces, the streaming server
+combines consecutive spectrums with the streaming filter of the sensor
+(SpectrumAggregator) and publishes once per combined frame.
+'''
+
+import os
+import socket
+import struct
+import errno
+import time
+import zlib
+import numpy as np
+import util
+from Defines import MAX_HOLD
+
+FANOUT_SOCKET_DIR = "/tmp/msod-streaming"
+
+# How often the publisher rescans FANOUT_SOCKET_DIR for subscribers.
+SUBSCRIBER_SCAN_INTERVAL = 1.0
+
+FRAME_HEADER = struct.Struct("<IdH")
+
+# Formats a browser can ask for when it opens /sensordata.
+CSV_FORMAT = "csv"
+BINARY_FORMAT = "binary"
+BINARY_DELTA_FORMAT = "binary-delta"
+VIEWER_FRAME_FORMATS = [CSV_FORMAT, BINARY_FORMAT, BINARY_DELTA_FORMAT]
+
+# Binary websocket frames are (flags, seq, timestamp, spectrums per frame,
+# n) followed by the payload. Without flags the payload is n int8 powers. DELTA_FLAG means
+# each byte is the difference (mod 256) from the previous frame sent on
+# the websocket; DEFLATE_FLAG means the payload is zlib compressed.
+VIEWER_FRAME_HEADER = struct.Struct("<BIdHH")
+DELTA_FLAG = 1
+DEFLATE_FLAG = 2
+
+# A delta encoded stream sends a complete frame this often.
+KEY_FRAME_INTERVAL = 100
+
+
+def packFrame(seq, timestamp, spectrumsPerFrame, powers):
+    return FRAME_HEADER.pack(seq & 0xffffffff, timestamp,
+                             spectrumsPerFrame) + \
+        np.asarray(powers, dtype=np.int8).tostring()
+
+
+def unpackFrame(frame):
+    """
+    Returns (seq, timestamp, spectrumsPerFrame, payload) where payload
+    holds the int8 powers.
+    """
+    (seq, timestamp, spectrumsPerFrame) = FRAME_HEADER.unpack_from(frame)
+    return (seq, timestamp, spectrumsPerFrame, frame[FRAME_HEADER.size:])
+
+
+class SpectrumAggregator:
+    """
+    Combines every count consecutive spectrums into one using the
+    streaming filter: MAX_HOLD keeps the per bin maximum, anything else
+    (MEAN) the per bin mean.
+    """
+
+    def __init__(self, count, method=MAX_HOLD):
+        self.count = count
+        self.maxHold = method is None or method == MAX_HOLD
+        self.n = 0
+        self.acc = None
+
+    def add(self, powers):
+        """
+        Add a spectrum. Returns the combined int8 spectrum when count
+        spectrums have been added, else None.
+        """
+        if self.count <= 1:
+            return np.asarray(powers, dtype=np.int8)
+        if self.n == 0:
+            self.acc = np.array(powers, dtype=np.int32)
+        elif self.maxHold:
+            np.maximum(self.acc, powers, out=self.acc)
+        else:
+            self.acc += powers
+        self.n = self.n + 1
+        if self.n < self.count:
+            return None
+        self.n = 0
+        if self.maxHold:
+            return self.acc.astype(np.int8)
+        return np.round(self.acc / float(self.count)).astype(np.int8)
+
+
+class ViewerFrameEncoder:
+    """
+    Encodes the frames sent on one websocket in the negotiated format.
+    """
+
+    def __init__(self, frameFormat):
+        self.frameFormat = frameFormat
+        self.prev = None
+        self.framesSinceKeyFrame = 0
+
+    def isBinary(self):
+        return self.frameFormat != CSV_FORMAT
+
+    def encode(self, seq, timestamp, spectrumsPerFrame, powers):
+        """
+        Encode a spectrum (int8 array) for sending.
+        """
+        if self.frameFormat == CSV_FORMAT:
+            return ",".join(map(str, powers))
+        flags = 0
+        payload = powers
+        if self.frameFormat == BINARY_DELTA_FORMAT:
+            if self.prev is not None and len(self.prev) == len(powers) and \
+                    self.framesSinceKeyFrame < KEY_FRAME_INTERVAL:
+                payload = powers.view(np.uint8) - self.prev.view(np.uint8)
+                flags = DELTA_FLAG
+                self.framesSinceKeyFrame = self.framesSinceKeyFrame + 1
+            else:
+                self.framesSinceKeyFrame = 0
+            self.prev = powers
+        payload = payload.tostring()
+        if self.frameFormat == BINARY_DELTA_FORMAT:
+            compressed = zlib.compress(payload, 1)
+            if len(compressed) < len(payload):
+                payload = compressed
+                flags = flags | DEFLATE_FLAG
+        return VIEWER_FRAME_HEADER.pack(flags, seq & 0xffffffff, timestamp,
+                                        spectrumsPerFrame,
+                                        len(powers)) + payload
+
+
+class ViewerFrameDecoder:
+    """
+    Client side decoder for binary websocket frames.
+    """
+
+    def __init__(self):
+        self.prev = None
+
+    def decode(self, message):
+        """
+        Returns (seq, timestamp, spectrumsPerFrame, powers) where powers is
+        an int8 array.
+        """
+        (flags, seq, timestamp, spectrumsPerFrame,
+         n) = VIEWER_FRAME_HEADER.unpack_from(message)
+        payload = message[VIEWER_FRAME_HEADER.size:]
+        if flags & DEFLATE_FLAG:
+            payload = zlib.decompress(payload)
+        powers = np.frombuffer(payload, dtype=np.int8)
+        if flags & DELTA_FLAG:
+            if self.prev is None:
+                raise ValueError("Delta frame without a previous frame")
+            powers = (self.prev.view(np.uint8) +
+                      powers.view(np.uint8)).view(np.int8)
+        self.prev = powers
+        return (seq, timestamp, spectrumsPerFrame, powers)
+
+
+def _socketPrefix(sensorId, bandName):
+    return sensorId + ":" + bandName + ":"
+
+
+def getSubscriberSocketPath(sensorId, bandName, pid=None):
+    if pid is None:
+        pid = os.getpid()
+    return os.path.join(FANOUT_SOCKET_DIR,
+                        _socketPrefix(sensorId, bandName) + str(pid))
+
+
+def bindSubscriberSocket(sock, sensorId, bandName):
+    """
+    Bind a datagram socket (AF_UNIX, SOCK_DGRAM) as the subscriber of
+    this process for a sensor band. Returns the socket path.
+    """
+    if not os.path.exists(FANOUT_SOCKET_DIR):
+        try:
+            os.makedirs(FANOUT_SOCKET_DIR)
+        except OSError:
+            # Another process created it.
+            pass
+    path = getSubscriberSocketPath(sensorId, bandName)
+    if os.path.exists(path):
+        os.unlink(path)
+    sock.bind(path)
+    return path
+
+
+def unbindSubscriberSocket(sensorId, bandName):
+    path = getSubscriberSocketPath(sensorId, bandName)
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def listSubscribers():
+    """
+    Returns a list of (sensorId, bandName, pid) for all subscriber sockets.
+    """
+    retval = []
+    if not os.path.exists(FANOUT_SOCKET_DIR):
+        return retval
+    for name in os.listdir(FANOUT_SOCKET_DIR):
+        parts = name.split(":")
+        if len(parts) < 3:
+            continue
+        retval.append((parts[0], ":".join(parts[1:-1]), int(parts[-1])))
+    return retval
+
+
+class FramePublisher:
+    """
+    Sends the frames of one sensor band to every subscribed web server
+    worker. Sends never block: a frame that does not fit in a subscriber's
+    socket buffer is dropped and counted.
+
+    Spectrums are combined with the streaming filter into frames of the
+    smallest number of spectrums per frame any subscriber asked for.
+    """
+
+    def __init__(self, sensorId, bandName, memCache, method=MAX_HOLD):
+        self.sensorId = sensorId
+        self.bandName = bandName
+        self.memCache = memCache
+        self.method = method
+        self.prefix = _socketPrefix(sensorId, bandName)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(0)
+        self.subscribers = []
+        self.spectrumsPerFrame = 1
+        self.aggregator = SpectrumAggregator(1, method)
+        self.lastScan = 0
+        self.seq = 0
+        self.published = 0
+        self.dropped = 0
+
+    def scanSubscribers(self):
+        self.lastScan = time.time()
+        if not os.path.exists(FANOUT_SOCKET_DIR):
+            self.subscribers = []
+            return
+        names = [name for name in os.listdir(FANOUT_SOCKET_DIR)
+                 if name.startswith(self.prefix)]
+        self.subscribers = [os.path.join(FANOUT_SOCKET_DIR, name)
+                            for name in names]
+        spectrumsPerFrame = None
+        for name in names:
+            requested = self.memCache.getRequestedSpectrumsPerFrame(
+                self.sensorId, self.bandName, name[len(self.prefix):])
+            if requested is None:
+                requested = 1
+            if spectrumsPerFrame is None or requested < spectrumsPerFrame:
+                spectrumsPerFrame = requested
+        if spectrumsPerFrame is not None and \
+                spectrumsPerFrame != self.spectrumsPerFrame:
+            self.spectrumsPerFrame = spectrumsPerFrame
+            self.aggregator = SpectrumAggregator(spectrumsPerFrame,
+                                                 self.method)
+
+    def hasSubscribers(self):
+        if time.time() - self.lastScan > SUBSCRIBER_SCAN_INTERVAL:
+            self.scanSubscribers()
+        return len(self.subscribers) != 0
+
+    def publish(self, powers, timestamp=None):
+        """
+        Add a spectrum (a sequence of int8 powers) and send a frame to the
+        subscribers if it completes one.
+        """
+        if not self.hasSubscribers():
+            return
+        powers = self.aggregator.add(powers)
+        if powers is None:
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        self.seq = self.seq + 1
+        frame = packFrame(self.seq, timestamp, self.spectrumsPerFrame, powers)
+        for path in list(self.subscribers):
+            try:
+                self.sock.sendto(frame, path)
+                self.published = self.published + 1
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                    self.dropped = self.dropped + 1
+                elif e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                    # The worker went away without removing its socket.
+                    util.debugPrint("FramePublisher: removing stale " + path)
+                    self.subscribers.remove(path)
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                else:
+                    raise
+
+    def getStatistics(self):
+        return {"seq": self.seq,
+                "spectrumsPerFrame": self.spectrumsPerFrame,
+                "published": self.published,
+                "dropped": self.dropped,
+                "subscribers": len(self.subscribers)}
+
+    def close(self):
+        self.sock.close()
+
+
+def getStatistics(memCache):
+    """
+    Collect the publisher and per worker hub statistics saved in memcache
+    for all sensor bands that currently have subscribers.
+    """
+    hubs = []
+    publishers = []
+    bands = set()
+    for (sensorId, bandName, pid) in listSubscribers():
+        stats = memCache.getFanoutStatistics(sensorId, bandName, pid)
+        if stats is not None:
+            stats = dict(stats)
+            stats.update({"sensorId": sensorId, "bandName": bandName,
+                          "pid": pid})
+            hubs.append(stats)
+        bands.add((sensorId, bandName))
+    for (sensorId, bandName) in bands:
+        stats = memCache.getPublisherStatistics(sensorId, bandName)
+        if stats is not None:
+            stats = dict(stats)
+            stats.update({"sensorId": sensorId, "bandName": bandName})
+            publishers.append(stats)
+    return {"hubs": hubs, "publishers": publishers}
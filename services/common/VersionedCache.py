@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+#This software was developed by employees of the National Institute of
+#Standards and Technology (NIST), and others.
+#This software has been contributed to the public domain.
+#Pursuant to title 15 Untied States Code Section 105, works of NIST
+#employees are not subject to copyright protection in the United States
+#and are considered to be in the public domain.
+#As a result, a formal license is not needed to use this software.
+#
+#This software is provided "AS IS."
+#NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+#OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+#AND DATA ACCURACY.  NIST does not warrant or make any representations
+#regarding the use of the software or the results thereof, including but
+#not limited to the correctness, accuracy, reliability or usefulness of
+#this software.
+'''
+Process-local copy of a shared value that is costly to fetch and rarely
+changes (the system configuration, the debug flags).
+
+Whoever changes the value calls invalidate, which bumps a version counter
+in memcache. A process keeps its copy and looks at the counter at most
+every CHECK_INTERVAL seconds, fetching the value again only when the
+counter moved. The process that made the change sees it at once, the
+others within CHECK_INTERVAL.
+
+Lookups, version checks and fetches of all the processes are counted in
+memcache (see getStatistics).
+'''
+import time
+
+# Seconds between two checks of the version counter.
+CHECK_INTERVAL = 2
+
+VERSIONED_CACHE = "versionedCache_"
+LOOKUPS = "lookups"
+CHECKS = "checks"
+FETCHES = "fetches"
+
+
+class VersionedCache:
+    def __init__(self, name, fetch, mc):
+        """
+        name identifies the value in memcache, fetch() returns the value
+        and mc is the memcache client of the caller.
+        """
+        self.name = name
+        self.fetch = fetch
+        self.mc = mc
+        self.versionKey = VERSIONED_CACHE + name + "_version"
+        self.loaded = False
+        self.value = None
+        self.version = None
+        self.checkTime = 0
+        self.lookups = 0
+
+    def getCounterKey(self, counter):
+        return VERSIONED_CACHE + self.name + "_" + counter
+
+    def increment(self, key, delta=1):
+        if self.mc.incr(key, delta) is None:
+            if not self.mc.add(key, delta):
+                self.mc.incr(key, delta)
+
+    def get(self):
+        """
+        The value, from the copy of this process unless it is stale.
+        """
+        self.lookups = self.lookups + 1
+        now = time.time()
+        if self.loaded and now - self.checkTime < CHECK_INTERVAL:
+            return self.value
+        version = self.mc.get(self.versionKey)
+        self.increment(self.getCounterKey(LOOKUPS), self.lookups)
+        self.increment(self.getCounterKey(CHECKS))
+        self.lookups = 0
+        if not self.loaded or version is None or version != self.version:
+            self.value = self.fetch()
+            self.version = version
+            self.loaded = True
+            self.increment(self.getCounterKey(FETCHES))
+        self.checkTime = now
+        return self.value
+
+    def invalidate(self):
+        """
+        The value changed: have every process fetch it again.
+        """
+        self.increment(self.versionKey)
+        self.loaded = False
+
+    def getStatistics(self):
+        """
+        Lookups, version checks and fetches since memcache started, for
+        all the processes (lookups are counted at the version checks).
+        """
+        keys = [self.getCounterKey(c) for c in (LOOKUPS, CHECKS, FETCHES)]
+        counts = self.mc.get_multi(keys)
+        retval = {"version": self.mc.get(self.versionKey)}
+        for counter in (LOOKUPS, CHECKS, FETCHES):
+            retval[counter] = int(counts.get(self.getCounterKey(counter), 0))
+        return retval
@@ -52,6 +52,45 @@ from Defines import SESSION_ID
 from Defines import SESSION_LOGIN_TIME
 from Defines import ACCOUNT_LOCKED_ERROR
 
+# Seconds a process trusts a session it looked up (a session logged out by
+# another process remains valid here for that long).
+SESSION_CACHE_SECONDS = 2
+MAX_CACHED_SESSIONS = 1000
+
+# sessionId -> (session, time looked up, time of the next renewal)
+_sessionCache = {}
+
+
+def getSessionTimeout(sessionId):
+    if sessionId.startswith(USER):
+        return Config.getUserSessionTimeoutMinutes() * 60
+    else:
+        return Config.getAdminSessionTimeoutMinutes() * 60
+
+
+def getCachedSession(sessionId, now):
+    """
+    The session (None if not found) and the time its expiry is due for a
+    renewal, from the process cache or the session store.
+    """
+    entry = _sessionCache.get(sessionId)
+    if entry is not None and now - entry[1] < SESSION_CACHE_SECONDS:
+        return entry[0], entry[2]
+    session = SessionLock.getSession(sessionId)
+    if session is None:
+        _sessionCache.pop(sessionId, None)
+        return None, None
+    renewAt = session[EXPIRE_TIME] - getSessionTimeout(sessionId) + \
+        Config.getSessionRenewIntervalSeconds()
+    cacheSession(session, now, renewAt)
+    return session, renewAt
+
+
+def cacheSession(session, now, renewAt):
+    if len(_sessionCache) >= MAX_CACHED_SESSIONS:
+        _sessionCache.clear()
+    _sessionCache[session[SESSION_ID]] = (session, now, renewAt)
+
 
 # TODO -- figure out how to get the remote IP address from a web socket.
 def checkSessionId(sessionId, privilege, updateSessionTimer=True):
@@ -69,27 +108,28 @@ def checkSessionId(sessionId, privilege, updateSessionTimer=True):
     if DebugFlags.getDisableSessionIdCheckFlag():
         sessionFound = True
     else:
-        SessionLock.acquire()
         try:
-            session = SessionLock.getSession(sessionId)
-            if session is not None and (
+            now = time.time()
+            session, renewAt = getCachedSession(sessionId, now)
+            if session is not None and now <= session[EXPIRE_TIME] and (
                     remoteAddress is None or
                     session[REMOTE_ADDRESS] == remoteAddress):
                 sessionFound = True
-                if sessionId.startswith(USER):
-                    delta = Config.getUserSessionTimeoutMinutes() * 60
-                else:
-                    delta = Config.getAdminSessionTimeoutMinutes() * 60
-                if updateSessionTimer:
-                    expireTime = time.time() + delta
-                    session[EXPIRE_TIME] = expireTime
-                    SessionLock.updateSession(session)
-                    util.debugPrint("updated session ID expireTime")
+                # Sliding expiry, extended at most once per renew interval.
+                if updateSessionTimer and now >= renewAt:
+                    session = dict(session)
+                    session[EXPIRE_TIME] = now + getSessionTimeout(sessionId)
+                    if SessionLock.updateSession(session):
+                        cacheSession(session, now, now +
+                                     Config.getSessionRenewIntervalSeconds())
+                        util.debugPrint("updated session ID expireTime")
+                    else:
+                        # Logged out meanwhile.
+                        _sessionCache.pop(sessionId, None)
+                        sessionFound = False
         except:
             traceback.print_exc()
             util.debugPrint("Problem checking sessionKey " + sessionId)
-        finally:
-            SessionLock.release()
     return sessionFound
 
 
@@ -103,7 +143,6 @@ def authenticateSensor(sensorId, sensorKey):
 
 
 def logOut(sessionId):
-    SessionLock.acquire()
     logOutSuccessful = False
     try:
         util.debugPrint("Logging off " + sessionId)
@@ -114,11 +153,10 @@ def logOut(sessionId):
                 sessionId)
         else:
             SessionLock.removeSession(session[SESSION_ID])
+            _sessionCache.pop(sessionId, None)
             logOutSuccessful = True
     except:
         util.debugPrint("Problem logging off " + sessionId)
-    finally:
-        SessionLock.release()
     return logOutSuccessful
 
 
@@ -145,7 +183,6 @@ def generateSessionKey(privilege):
         sessionId = -1
         uniqueSessionId = False
         num = 0
-        SessionLock.acquire()
         # try 5 times to get a unique session id
         if DebugFlags.getDisableSessionIdCheckFlag():
             return privilege + "-" + str(123)
@@ -172,8 +209,6 @@ def generateSessionKey(privilege):
         util.debugPrint("Problem generating sessionKey " + str(sessionId))
         traceback.print_exc()
         sessionId = -1
-    finally:
-        SessionLock.release()
     util.debugPrint("SessionKey = " + str(sessionId))
     return sessionId
 
@@ -185,7 +220,6 @@ def addSessionKey(sessionId, userName, privilege):
         return False
     remoteAddress = request.environ.get('HTTP_X_REAL_IP', request.remote_addr)
     if sessionId != -1:
-        SessionLock.acquire()
         try:
             util.debugPrint("getSession")
             session = SessionLock.getSession(sessionId)
@@ -200,8 +234,8 @@ def addSessionKey(sessionId, userName, privilege):
                 newSession = {SESSION_ID:sessionId, USER_NAME:userName,
                               REMOTE_ADDRESS: remoteAddress, SESSION_LOGIN_TIME:time.time(),
                               EXPIRE_TIME:time.time() + delta}
-                SessionLock.addSession(newSession)
-                return True
+                # Fails if another request took the session ID meanwhile.
+                return SessionLock.addSession(newSession)
             else:
                 util.debugPrint(
                     "session key already exists, we should never reach since only should generate unique session keys")
@@ -209,8 +243,6 @@ def addSessionKey(sessionId, userName, privilege):
         except:
             util.debugPrint("Problem adding sessionKey " + sessionId)
             return False
-        finally:
-            SessionLock.release()
     else:
         return False
 
@@ -26,10 +26,10 @@ import timezone
 from bson.objectid import ObjectId
 import gridfs
 import DbCollections
+import DayIndex
 import Defines
 from Defines import SENSOR_ID, TIME_ZONE_KEY, \
     DATA_TYPE, FREQ_RANGE
-import DebugFlags
 from Defines import ASCII, BINARY_INT8, BINARY_FLOAT32, BINARY_INT16, LAT, LON, ALT
 import DataMessage
 import LocationMessage
@@ -87,6 +87,22 @@ def getCalData(systemMessage):
         return None
 
 
+# numpy element types for the binary data types a sensor may report.
+_NUMPY_DATA_TYPES = {BINARY_INT8: np.int8,
+                     BINARY_INT16: np.int16,
+                     BINARY_FLOAT32: np.float32}
+
+
+def decodeData(msg, messageBytes):
+    """
+    decode the raw bytes of an acquisition into a float numpy array.
+    """
+    if msg[DATA_TYPE] == ASCII:
+        return np.array(eval(messageBytes), dtype=np.float64)
+    dtype = _NUMPY_DATA_TYPES[msg[DATA_TYPE]]
+    return np.frombuffer(messageBytes, dtype=dtype).astype(np.float64)
+
+
 # Extract data from a data message
 def getData(msg):
     """
@@ -100,21 +116,55 @@ def getData(msg):
     if lengthToRead == 0:
         util.debugPrint("No data to read")
         return None
+    return list(decodeData(msg, messageBytes))
+
+
+def getDataFileSystem(msg):
+    """
+    get the GridFS store that holds the data of a message.
+    """
+    return gridfs.GridFS(DbCollections.getSpectrumDb(), msg[SENSOR_ID] + "_data")
+
+
+def readDataRange(msg, start, count, fs=None):
+    """
+    read count values starting at value index start from the data of msg.
+    Binary data is read with a seek so only the GridFS chunks that hold
+    the range are fetched.
+    """
+    if msg[DATA_TYPE] == ASCII:
+        return np.array(getData(msg))[start:start + count]
+    if fs is None:
+        fs = getDataFileSystem(msg)
+    itemSize = np.dtype(_NUMPY_DATA_TYPES[msg[DATA_TYPE]]).itemsize
+    gridOut = fs.get(ObjectId(msg[Defines.DATA_KEY]))
+    gridOut.seek(start * itemSize)
+    return decodeData(msg, gridOut.read(count * itemSize))
+
+
+def readDataStrided(msg, start, stride, count, fs=None):
+    """
+    read count values at value indices start, start + stride, ... from
+    the data of msg (e.g. one frequency bin across measurements).
+    When the stride spans a GridFS chunk or more each value is read with
+    its own seek so that skipped chunks are never fetched.
+    """
     if msg[DATA_TYPE] == ASCII:
-        powerVal = eval(messageBytes)
-    elif msg[DATA_TYPE] == BINARY_INT8:
-        powerVal = np.array(np.zeros(n * nM))
-        for i in range(0, int(lengthToRead)):
-            powerVal[i] = float(struct.unpack('b', messageBytes[i:i + 1])[0])
-    elif msg[DATA_TYPE] == BINARY_INT16:
-        powerVal = np.array(np.zeros(n * nM))
-        for i in range(0, lengthToRead, 2):
-            powerVal[i] = float(struct.unpack('h', messageBytes[i:i + 2])[0])
-    elif msg[DATA_TYPE] == BINARY_FLOAT32:
-        powerVal = np.array(np.zeros(n * nM))
-        for i in range(0, lengthToRead, 4):
-            powerVal[i] = float(struct.unpack('f', messageBytes[i:i + 4])[0])
-    return list(powerVal)
+        return np.array(getData(msg))[start:start + stride * count:stride]
+    if fs is None:
+        fs = getDataFileSystem(msg)
+    itemSize = np.dtype(_NUMPY_DATA_TYPES[msg[DATA_TYPE]]).itemsize
+    gridOut = fs.get(ObjectId(msg[Defines.DATA_KEY]))
+    if stride * itemSize >= gridOut.chunk_size:
+        values = []
+        for i in range(0, count):
+            gridOut.seek((start + i * stride) * itemSize)
+            values.append(gridOut.read(itemSize))
+        return decodeData(msg, "".join(values))
+    else:
+        gridOut.seek(start * itemSize)
+        spanBytes = ((count - 1) * stride + 1) * itemSize
+        return decodeData(msg, gridOut.read(spanBytes))[::stride]
 
 
 def getOccupancyData(msg):
@@ -324,15 +374,8 @@ def getPrevDayBoundary(msg):
     """
     get the previous acquisition day boundary.
     """
-    prevMsg = getPrevAcquisition(msg)
-    if prevMsg is None:
-        locationMessage = getLocationMessage(msg)
-        return timezone.getDayBoundaryTimeStampFromUtcTimeStamp(
-            msg['t'], locationMessage[TIME_ZONE_KEY])
-    locationMessage = msgutils.getLocationMessage(prevMsg)
-    timeZone = locationMessage[TIME_ZONE_KEY]
-    return timezone.getDayBoundaryTimeStampFromUtcTimeStamp(prevMsg['t'],
-                                                            timeZone)
+    return DayIndex.getPrevDayBoundary(msg[SENSOR_ID], msg[FREQ_RANGE],
+                                       msg['t'], getDayBoundaryTimeStamp(msg))
 
 
 def getDayBoundaryTimeStamp(msg):
@@ -348,42 +391,60 @@ def getNextDayBoundary(msg):
     """
     get the next acquistion day boundary.
     """
-    nextMsg = getNextAcquisition(msg)
-    if nextMsg is None:
-        locationMessage = getLocationMessage(msg)
-        return timezone.getDayBoundaryTimeStampFromUtcTimeStamp(
-            msg['t'], locationMessage[TIME_ZONE_KEY])
-    locationMessage = getLocationMessage(nextMsg)
-    timeZone = locationMessage[TIME_ZONE_KEY]
-    nextDayBoundary = timezone.getDayBoundaryTimeStampFromUtcTimeStamp(
-        nextMsg['t'], timeZone)
-    if DebugFlags.debug:
-        thisDayBoundary = timezone.getDayBoundaryTimeStampFromUtcTimeStamp(
-            msg['t'], locationMessage[TIME_ZONE_KEY])
-        util.debugPrint("getNextDayBoundary: dayBoundary difference " + str((
-            nextDayBoundary - thisDayBoundary) / 60 / 60))
-    return nextDayBoundary
+    return DayIndex.getNextDayBoundary(msg[SENSOR_ID], msg[FREQ_RANGE],
+                                       msg['t'], getDayBoundaryTimeStamp(msg))
 
 
-def trimSpectrumToSubBand(msg, subBandMinFreq, subBandMaxFreq):
+def getSubBandIndices(msg, subBandMinFreq, subBandMaxFreq):
     """
-    Trim spectrum to a sub band of a measurement band.
+    get the (start, end) slice of frequency bins that covers a sub band
+    of the measurement band of msg.
     """
-    data = msgutils.getData(msg)
     n = msg["mPar"]["n"]
     minFreq = msg["mPar"]["fStart"]
     maxFreq = msg["mPar"]["fStop"]
     freqRangePerReading = float(maxFreq - minFreq) / float(n)
     endReadingsToIgnore = int((maxFreq - subBandMaxFreq) / freqRangePerReading)
     topReadingsToIgnore = int((subBandMinFreq - minFreq) / freqRangePerReading)
-    if topReadingsToIgnore == 0 and endReadingsToIgnore == 0:
-        # if reporting the whole array just wrap and return it.
-        powerArray = np.array(data)
-    else:
-        # Otherwise, slice and return it.
-        powerArray = np.array(
-            [data[i] for i in range(topReadingsToIgnore, n - endReadingsToIgnore)])
-    return powerArray
+    return (topReadingsToIgnore, n - endReadingsToIgnore)
+
+
+def trimSpectrumToSubBand(msg, subBandMinFreq, subBandMaxFreq):
+    """
+    Trim spectrum to a sub band of a measurement band.
+    """
+    data = np.array(msgutils.getData(msg))
+    (start, end) = getSubBandIndices(msg, subBandMinFreq, subBandMaxFreq)
+    return data[start:end]
+
+
+def getSubBandDataMatrix(msgs, subBandMinFreq, subBandMaxFreq):
+    """
+    Load the spectrums of a sequence of swept frequency acquisitions
+    (all in the same band) into a (messages x bins) array and trim every
+    row to the sub band in one slice. Returns None if msgs is empty.
+    """
+    if len(msgs) == 0:
+        return None
+    firstMsg = msgs[0]
+    fs = getDataFileSystem(firstMsg)
+    n = int(firstMsg["mPar"]["n"])
+    dataMatrix = np.zeros((len(msgs), n))
+    for i in range(0, len(msgs)):
+        msg = msgs[i]
+        messageBytes = fs.get(ObjectId(msg[Defines.DATA_KEY])).read()
+        dataMatrix[i, :] = decodeData(msg, messageBytes)[0:n]
+    (start, end) = getSubBandIndices(firstMsg, subBandMinFreq, subBandMaxFreq)
+    return dataMatrix[:, start:end]
+
+
+def computeOccupancies(dataMatrix, cutoff):
+    """
+    Compute the fraction of bins at or above cutoff for every row of a
+    (messages x bins) array. cutoff is either a scalar or one value per row.
+    """
+    cutoffs = np.reshape(np.array(cutoff, dtype=np.float64), (-1, 1))
+    return np.mean(dataMatrix >= cutoffs, axis=1)
 
 
 def trimNoiseFloorToSubBand(msg, subBandMinFreq, subBandMaxFreq):
@@ -28,6 +28,7 @@ import timezone
 import util
 import authentication
 import DbCollections
+import DayIndex
 import SensorDb
 import Message
 import DataMessage
@@ -115,7 +116,7 @@ def put_data(jsonString,
     else:
         jsonStringBytes = jsonString
 
-    util.debugPrint("jsonStringBytes = " + jsonStringBytes)
+    util.debugPrint("jsonStringBytes = %s", jsonStringBytes)
     jsonData = json.loads(jsonStringBytes)
     sensorId = jsonData[SENSOR_ID]
     sensorKey = jsonData[SENSOR_KEY]
@@ -168,7 +169,7 @@ def put_data(jsonString,
         else:
             util.debugPrint("not inserting duplicate system post")
         end_time = time.time()
-        util.debugPrint("Insertion time " + str(end_time - start_time))
+        util.debugPrint("Insertion time %f", end_time - start_time)
         sensorObj.updateSystemMessageTimeStamp(Message.getTime(jsonData))
         SensorDb.updateSensor(sensorObj.getJson(), False, False)
     elif jsonData[TYPE] == LOC:
@@ -342,6 +343,8 @@ def put_data(jsonString,
         #    print json.dumps(jsonData, sort_keys=True, indent=4)
         if DataMessage.isProcessed(jsonData):
             dataPosts.insert(jsonData)
+            DayIndex.addAcquisition(sensorId, lastLocationPost, freqRange,
+                                    Message.getTime(jsonData))
         else:
             DbCollections.getUnprocessedDataMessages(sensorId).insert(jsonData)
 
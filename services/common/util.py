@@ -19,6 +19,8 @@
 #this software.
 
 import os
+import sys
+import time
 import DbCollections
 from Defines import SENSOR_ID
 import logging
@@ -79,9 +81,78 @@ def getPath(x):
     return flaskRoot + x
 
 
-def debugPrint(string):
-    logger = Log.getLogger()
-    logger.debug(string)
+# Call site (file, line) -> [calls, time of the last message, skipped]
+_callSites = {}
+
+
+def formatMessage(message, args, fields):
+    if callable(message):
+        message = message()
+    if len(args) != 0:
+        message = message % args
+    if len(fields) != 0:
+        message = str(message) + " " + " ".join(
+            [key + "=" + str(value() if callable(value) else value)
+             for (key, value) in sorted(fields.items())])
+    return message
+
+
+def debugPrint(message, *args, **fields):
+    """
+    Log a debug message. Nothing is formatted when debug logging is off:
+    pass values as %-args or key=value fields, or a callable returning
+    the message, rather than building the string at the call. e.g.
+
+        util.debugPrint("Inserted %d spectrums", count, sensorId=sensorId)
+        util.debugPrint(lambda: json.dumps(message, indent=4))
+    """
+    if not Log.isDebugEnabled():
+        return
+    Log.getLogger().debug(formatMessage(message, args, fields))
+
+
+def getCallSite():
+    frame = sys._getframe(2)
+    key = (frame.f_code.co_filename, frame.f_lineno)
+    site = _callSites.get(key)
+    if site is None:
+        site = [0, 0, 0]
+        _callSites[key] = site
+    return site
+
+
+def debugPrintEvery(seconds, message, *args, **fields):
+    """
+    debugPrint at most once every seconds from the calling line; the
+    message says how many were skipped since the last one.
+    """
+    if not Log.isDebugEnabled():
+        return
+    site = getCallSite()
+    now = time.time()
+    if now - site[1] < seconds:
+        site[2] = site[2] + 1
+        return
+    if site[2] != 0:
+        fields["skipped"] = site[2]
+    site[1] = now
+    site[2] = 0
+    Log.getLogger().debug(formatMessage(message, args, fields))
+
+
+def debugPrintSampled(n, message, *args, **fields):
+    """
+    debugPrint one in n calls from the calling line (the first, then
+    every n-th).
+    """
+    if not Log.isDebugEnabled():
+        return
+    site = getCallSite()
+    site[0] = site[0] + 1
+    if (site[0] - 1) % n != 0:
+        return
+    fields["sampled"] = "1/" + str(n)
+    Log.getLogger().debug(formatMessage(message, args, fields))
 
 
 def logStackTrace(tb):
@@ -35,6 +35,7 @@ import json
 import sys
 import traceback
 import GetLocationInfo
+import Metrics
 from gevent import pywsgi
 from multiprocessing import Process
 import time
@@ -42,6 +43,8 @@ import pwd
 
 app = Flask(__name__, static_url_path="")
 app.static_folder = sbHome + "/flask/static"
+Metrics.setService("federation")
+Metrics.instrumentApp(app)
 
 
 @app.route("/federated/peerSignIn/<peerServerId>/<peerKey>", methods=["POST"])
@@ -142,6 +145,9 @@ if __name__ == '__main__':
             proc = Process(target=PeerConnectionManager.start)
             proc.start()
             jobs.append(proc.pid)
+            proc = Metrics.startMetricsServer()
+            if proc is not None:
+                jobs.append(proc.pid)
             app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
             app.config['CORS_HEADERS'] = 'Content-Type'
             Log.loadGwtSymbolMap()
@@ -155,6 +161,9 @@ if __name__ == '__main__':
             proc = Process(target=PeerConnectionManager.start)
             proc.start()
             jobs.append(proc.pid)
+            proc = Metrics.startMetricsServer()
+            if proc is not None:
+                jobs.append(proc.pid)
             app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
             app.config['CORS_HEADERS'] = 'Content-Type'
             Log.loadGwtSymbolMap()
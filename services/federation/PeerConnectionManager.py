@@ -28,6 +28,12 @@ import time
 import json
 import os
 import MemCacheKeys
+import Metrics
+
+SIGN_INS = Metrics.counter("peer_sign_ins_total",
+                           "Successful sign ins with the peer servers.")
+SIGN_IN_FAILURES = Metrics.counter("peer_sign_in_failures_total",
+                                   "Failed sign ins with the peer servers.")
 
 # stores a table of peer keys generated randomly
 global peerSystemAndLocationInfo
@@ -142,6 +148,7 @@ class ConnectionMaintainer:
                         if r.status_code == 200:
                             jsonObj = r.json()
                             if jsonObj["status"] == "OK":
+                                SIGN_INS.inc()
                                 if "locationInfo" in jsonObj:
                                     self.readPeerSystemAndLocationInfo()
                                     locationInfo = jsonObj["locationInfo"]
@@ -152,12 +159,15 @@ class ConnectionMaintainer:
                             else:
                                 if peerUrl in peerSystemAndLocationInfo:
                                     del peerSystemAndLocationInfo[peerUrl]
+                                SIGN_IN_FAILURES.inc()
                                 util.debugPrint("Sign in with peer failed")
                         else:
+                            SIGN_IN_FAILURES.inc()
                             util.debugPrint(
                                 "Sign in with peer failed HTTP Status Code " +
                                 str(r.status_code))
                     except RequestException:
+                        SIGN_IN_FAILURES.inc()
                         print "Could not contact Peer at " + peerUrl
                         self.readPeerSystemAndLocationInfo()
                         if peerUrl in peerSystemAndLocationInfo:
@@ -25,129 +25,303 @@ Created on Jun 4, 2015
 
 import Bootstrap
 Bootstrap.setPath()
-import ssl
-import traceback
+import gevent
+from gevent import socket
+from gevent.server import StreamServer
+from gevent.queue import Queue, Full
 import util
 import Config
 import sys
 import json
-import socket
-from bitarray import bitarray
 import argparse
-from multiprocessing import Process
 import os
 import signal
 import Log
 import pwd
 import logging
+import OccupancyFanout
+import Metrics
+import DataStreamSharedState
+from DataStreamSharedState import MemCache
 
-_OccupancyConnectionDebug = True
+# Occupancy updates buffered per subscriber before the oldest is dropped.
+SUBSCRIBER_QUEUE_DEPTH = 100
 
-from DataStreamSharedState import MemCache
+# Seconds a new connection has to send its subscription request.
+SUBSCRIBE_TIMEOUT = 30
+
+# Seconds a write to a subscriber may block before it is disconnected.
+SUBSCRIBER_SEND_TIMEOUT = 30
+
+# Longest subscription request accepted.
+MAX_REQUEST_LENGTH = 1024
+
+# Pending connections on the subscriber port.
+LISTEN_BACKLOG = 1024
 
-isSecure = Config.isSecure()
+# How often (seconds) each broker process logs its statistics.
+STATISTICS_INTERVAL = 60
+
+# How often (seconds) the subscriptions are renewed in memcache.
+SUBSCRIPTION_RENEW_INTERVAL = DataStreamSharedState.LEASE_TIME / 3
+
+SUBSCRIBERS = Metrics.gauge("subscribers",
+                            "Connections subscribed to occupancy alerts.")
+UPDATES_RECEIVED = Metrics.counter("updates_received_total",
+                                   "Occupancy changes received by brokers.")
+UPDATES_DELIVERED = Metrics.counter("updates_queued_total",
+                                    "Occupancy changes queued to subscribers.")
+UPDATES_DROPPED = Metrics.counter("updates_dropped_total",
+                                  "Occupancy changes dropped for slow "
+                                  "subscribers.")
 
 childPids = []
+mainPid = None
 
 
-def runOccupancyWorker(conn):
+class Subscriber:
+    """
+    A connection subscribed to the occupancy alerts of a sensor. Updates
+    are queued without blocking and written by the subscriber's own
+    greenlet, so a slow subscriber only falls behind (losing its oldest
+    updates) without holding up the others.
+    """
 
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    memcache = MemCache()
-    sensorId = None
-    try:
-        c = ""
-        jsonStr = ""
+    def __init__(self, conn, sensorId, version):
+        self.conn = conn
+        self.sensorId = sensorId
+        self.version = version
+        self.queue = Queue(maxsize=SUBSCRIBER_QUEUE_DEPTH)
+        self.dropped = 0
+        self.lastSeq = None
+
+    def offer(self, update):
+        try:
+            self.queue.put_nowait(update)
+        except Full:
+            self.queue.get_nowait()
+            self.dropped = self.dropped + 1
+            UPDATES_DROPPED.inc()
+            self.queue.put_nowait(update)
+
+    def getMessage(self, update):
+        """
+        What to write for an update (full frame, changes frame): the bare
+        bits for version 1, the changes frame for version 2 only when the
+        subscriber got the previous alert.
+        """
+        (full, changes) = update
+        if self.version == 1:
+            return OccupancyFanout.getAlertBits(full)
+        seq = OccupancyFanout.getAlertSeq(full)
+        previousSeq = self.lastSeq
+        self.lastSeq = seq
+        if changes is not None and previousSeq is not None and \
+                seq == previousSeq + 1:
+            return changes
+        return full
+
+    def run(self):
+        try:
+            while True:
+                message = self.getMessage(self.queue.get())
+                with gevent.Timeout(SUBSCRIBER_SEND_TIMEOUT):
+                    self.conn.sendall(message)
+        except:
+            util.debugPrint("OccupancyAlert: write failed " + self.sensorId)
+            # Wakes up the connection handler.
+            self.conn.close()
+
+
+def readSubscription(conn):
+    """
+    Read the subscription request (see OccupancyFanout). Returns the
+    request and the protocol version.
+    """
+    c = conn.recv(1)
+    if c == "{":
+        # Version 1: bare JSON read up to the closing brace.
+        jsonStr = c
         while c != "}":
             c = conn.recv(1)
+            if not c or len(jsonStr) > MAX_REQUEST_LENGTH:
+                raise Exception("Bad subscription request")
             jsonStr = jsonStr + c
-        jsonObj = json.loads(jsonStr)
-        print "subscription received for " + jsonObj["SensorID"]
-        sensorId = jsonObj["SensorID"]
-        port = memcache.getPubSubPort(sensorId)
-        sock.bind(("localhost", port))
-        memcache.incrementSubscriptionCount(sensorId)
+        return json.loads(jsonStr), 1
+    magic = c + OccupancyFanout.recvFully(
+        conn, len(OccupancyFanout.SUBSCRIPTION_MAGIC) - 1)
+    if magic != OccupancyFanout.SUBSCRIPTION_MAGIC:
+        raise Exception("Bad subscription request")
+    (version, length) = OccupancyFanout.SUBSCRIPTION_HEADER.unpack(
+        OccupancyFanout.recvFully(conn,
+                                  OccupancyFanout.SUBSCRIPTION_HEADER.size))
+    if length > MAX_REQUEST_LENGTH:
+        raise Exception("Bad subscription request")
+    request = json.loads(OccupancyFanout.recvFully(conn, length))
+    return request, min(version, OccupancyFanout.PROTOCOL_VERSION)
+
+
+class OccupancyBroker:
+    """
+    Receives the occupancy changes of every streaming sensor once (see
+    OccupancyFanout) and fans them out to the subscribers of the sensor
+    connected to this process. The subscriptions are also registered in
+    memcache (MemCache.addSubscription) for the other services to count.
+    """
+
+    def __init__(self):
+        self.memCache = MemCache()
+        self.subscribers = {}
+        # The last update of each sensor, sent to new version 2 subscribers.
+        self.lastUpdates = {}
+        self.received = 0
+        self.delivered = 0
+        self.inbox = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        OccupancyFanout.bindBrokerSocket(self.inbox)
+
+    def getSubscriptionCount(self, sensorId):
+        if sensorId not in self.subscribers:
+            return 0
+        return len(self.subscribers[sensorId])
+
+    def receive(self):
+        while True:
+            (sensorId, full, changes) = OccupancyFanout.unpackUpdate(
+                self.inbox.recv(65536))
+            self.received = self.received + 1
+            UPDATES_RECEIVED.inc()
+            update = (full, changes)
+            self.lastUpdates[sensorId] = update
+            if sensorId not in self.subscribers:
+                continue
+            for subscriber in self.subscribers[sensorId]:
+                subscriber.offer(update)
+                self.delivered = self.delivered + 1
+                UPDATES_DELIVERED.inc()
+
+    def handle(self, conn, addr):
+        """
+        StreamServer handler: one greenlet per subscriber connection.
+        """
+        subscriber = None
         try:
-            while True:
-                msgstr, addr = sock.recvfrom(1024)
-                msg = json.loads(msgstr)
-                if sensorId in msg:
-                    msgdatabin = bitarray(msg[sensorId])
-                    conn.send(msgdatabin.tobytes())
+            with gevent.Timeout(SUBSCRIBE_TIMEOUT):
+                (request, version) = readSubscription(conn)
+            sensorId = str(request["SensorID"])
+            util.debugPrint("OccupancyAlert: subscription received for " +
+                            sensorId + " from " + str(addr) + " version " +
+                            str(version))
+            subscriber = Subscriber(conn, sensorId, version)
+            if version != 1 and sensorId in self.lastUpdates:
+                subscriber.offer(self.lastUpdates[sensorId])
+            if sensorId not in self.subscribers:
+                self.subscribers[sensorId] = []
+            self.subscribers[sensorId].append(subscriber)
+            self.memCache.addSubscription(sensorId,
+                                          self.getSubscriptionId(subscriber))
+            SUBSCRIBERS.inc()
+            writer = gevent.spawn(subscriber.run)
+            try:
+                # Subscribers send nothing more: wait for the hang up.
+                while conn.recv(1024):
+                    pass
+            finally:
+                writer.kill(block=False)
         except:
-            print sys.exc_info()
-            traceback.print_exc()
-            print "Subscriber disconnected"
+            util.debugPrint("OccupancyAlert: subscriber disconnected " +
+                            str(addr))
         finally:
-            sock.close()
-            memcache.decrementSubscriptionCount(sensorId)
+            if subscriber is not None:
+                sensorSubscribers = self.subscribers[subscriber.sensorId]
+                sensorSubscribers.remove(subscriber)
+                if len(sensorSubscribers) == 0:
+                    del self.subscribers[subscriber.sensorId]
+                self.memCache.removeSubscription(
+                    subscriber.sensorId, self.getSubscriptionId(subscriber))
+                SUBSCRIBERS.dec()
+            conn.close()
+
+    def getStatistics(self):
+        subscriberCount = 0
+        dropped = 0
+        for sensorSubscribers in self.subscribers.values():
+            subscriberCount = subscriberCount + len(sensorSubscribers)
+            for subscriber in sensorSubscribers:
+                dropped = dropped + subscriber.dropped
+        return {"sensors": len(self.subscribers),
+                "subscribers": subscriberCount,
+                "received": self.received,
+                "delivered": self.delivered,
+                "dropped": dropped}
+
+    def getSubscriptionId(self, subscriber):
+        return str(os.getpid()) + ":" + str(id(subscriber))
+
+    def renewSubscriptions(self):
+        while True:
+            gevent.sleep(SUBSCRIPTION_RENEW_INTERVAL)
+            for (sensorId, sensorSubscribers) in self.subscribers.items():
+                for subscriber in list(sensorSubscribers):
+                    self.memCache.renewSubscription(
+                        sensorId, self.getSubscriptionId(subscriber))
 
-    except:
-        tb = sys.exc_info()
-        util.logStackTrace(tb)
+    def logStatistics(self):
+        while True:
+            gevent.sleep(STATISTICS_INTERVAL)
+            util.debugPrint("OccupancyAlert: " + str(os.getpid()) + " " +
+                            json.dumps(self.getStatistics()))
+
+    def close(self):
+        OccupancyFanout.unbindBrokerSocket()
+        self.inbox.close()
+
+
+def runBroker(listener, secure):
+    """
+    Serve the subscribers connecting to the listening socket (TLS if
+    secure) until the process is killed.
+    """
+    broker = OccupancyBroker()
+    if secure:
+        server = StreamServer(listener, broker.handle,
+                              certfile=Config.getCertFile(),
+                              keyfile=Config.getKeyFile())
+    else:
+        server = StreamServer(listener, broker.handle)
+    gevent.spawn(broker.receive)
+    gevent.spawn(broker.logStatistics)
+    gevent.spawn(broker.renewSubscriptions)
+    try:
+        server.serve_forever()
     finally:
-        if conn is not None:
-            conn.close()
-        if sock is not None:
-            sock.close()
+        broker.close()
 
 
-def startOccupancyServer(occupancyServerPort):
-    global childPids
-    global occupancySock
-    occupancySock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+def startOccupancyServer(occupancyServerPort, processes=1):
+    """
+    Listen on the occupancy alert port and serve subscribers from
+    processes broker processes sharing the listening socket (one per core
+    is plenty; each handles thousands of connections).
+    """
+    global mainPid
+    mainPid = os.getpid()
     print "OccupancyServerPort", occupancyServerPort
-    occupancySock.bind(("0.0.0.0", occupancyServerPort))
-    occupancySock.listen(10)
-    cert = Config.getCertFile()
-    keyfile = Config.getKeyFile()
-    conn = None
-    while True:
-        try:
-            print "OccupancyServer: Accepting connections "
-            (conn, addr) = occupancySock.accept()
-            print "Addr connected ", str(addr)
-            if isSecure:
-                try:
-                    c = ssl.wrap_socket(conn,
-                                        server_side=True,
-                                        certfile=cert,
-                                        keyfile=keyfile)
-                    # Was: ssl_version=ssl.PROTOCOL_SSLv23)
-                    t = Process(target=runOccupancyWorker, args=(c, ))
-                except:
-                    if conn is not None:
-                        conn.close()
-                        conn = None
-                    occupancySock.close()
-                    occupancySock = socket.socket(socket.AF_INET,
-                                                  socket.SOCK_STREAM)
-                    occupancySock.bind(("0.0.0.0", occupancyServerPort))
-                    occupancySock.listen(10)
-                    if _OccupancyConnectionDebug:
-                        util.errorPrint(
-                            "OccupancyServer: Error accepting connection")
-                        traceback.print_exc()
-                        util.logStackTrace(sys.exc_info())
-                    continue
-            else:
-                t = Process(target=runOccupancyWorker, args=(conn, ))
-            util.debugPrint("OccupancyServer: Accepted a connection from " +
-                            str(addr))
-            t.start()
-            pid = t.pid
-            childPids.append(pid)
-        except:
-            print "OccupancyServer: Error ACCEPTING Connection:"
-            traceback.print_exc()
-            util.logStackTrace(sys.exc_info())
-            if conn is not None:
-                conn.close()
-                conn = None
-            occupancySock.close()
-            occupancySock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            occupancySock.bind(("0.0.0.0", occupancyServerPort))
-            occupancySock.listen(10)
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("0.0.0.0", occupancyServerPort))
+    listener.listen(LISTEN_BACKLOG)
+    secure = Config.isSecure()
+    Metrics.setService("occupancy")
+    metricsServer = Metrics.startMetricsServer()
+    if metricsServer is not None:
+        childPids.append(metricsServer.pid)
+    for i in range(1, processes):
+        pid = gevent.fork()
+        if pid == 0:
+            del childPids[:]
+            break
+        childPids.append(pid)
+    runBroker(listener, secure)
 
 
 def signal_handler(signo, frame):
@@ -159,7 +333,9 @@ def signal_handler(signo, frame):
             os.kill(pid, signal.SIGKILL)
         except:
             print str(pid), " Not Found"
-    os.remove(pidfile)
+    OccupancyFanout.unbindBrokerSocket()
+    if os.getpid() == mainPid:
+        os.remove(pidfile)
     os._exit(0)
 
 
@@ -179,6 +355,9 @@ if __name__ == "__main__":
                         default="spectrumbrowser")
     parser.add_argument("--port", help="GROUP name", default="9001")
     parser.add_argument("--daemon", help="daemon switch", default="True")
+    parser.add_argument("--processes",
+                        help="Number of broker processes",
+                        default="1")
 
     args = parser.parse_args()
 
@@ -221,8 +400,9 @@ if __name__ == "__main__":
                 os.remove(args.pidfile)
         context.pidfile = daemon.pidfile.TimeoutPIDLockFile(args.pidfile)
         with context:
-            startOccupancyServer(occupancyServerPort)
+            startOccupancyServer(occupancyServerPort, int(args.processes))
     else:
         Log.configureLogging("occupancy")
+        occupancyServerPort = int(args.port)
         with util.pidfile(args.pidfile):
-            startOccupancyServer(occupancyServerPort)
+            startOccupancyServer(occupancyServerPort, int(args.processes))
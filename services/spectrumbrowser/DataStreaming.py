@@ -21,24 +21,349 @@ from bson.json_util import dumps
 import util
 import authentication
 import time
+import os
+import sys
 import gevent
+from gevent import socket
+from gevent.queue import Queue, Full, Empty
+import numpy as np
 from DataStreamSharedState import MemCache
+import StreamingFanout
+import SpectrumHistory
 import traceback
+import json
 import SensorDb
+import IngestRegistry
+import Metrics
+from pymongo.errors import PyMongoError
 from Defines import ENABLED
 from Defines import STREAMING_SERVER_PORT
-
-APPLY_DRIFT_CORRECTION = False
+from Defines import SPECTRUMS_PER_FRAME
+from Defines import SENSOR_ID
 
 memCache = None
 
+VIEWERS = Metrics.gauge("websocket_viewers",
+                        "Websockets streaming spectrums to viewers.")
+FRAMES_SENT = Metrics.counter("viewer_frames_sent_total",
+                              "Frames sent to the viewers.")
+SLOW_VIEWERS = Metrics.counter("viewer_timeouts_total",
+                               "Viewers disconnected for not keeping up.")
+
+# Frames buffered per viewer before new frames are dropped.
+VIEWER_QUEUE_DEPTH = 10
+
+# Frame dropping policies of a viewer that does not keep up.
+# LATEST_WINS drops the oldest queued frame for the newest one. DECIMATE
+# drops every other queued frame and halves the frame rate of the viewer
+# until its queue stays empty again.
+LATEST_WINS = "latest-wins"
+DECIMATE = "decimate"
+VIEWER_DROP_POLICIES = [LATEST_WINS, DECIMATE]
+
+# Frames a decimated viewer sends with an empty queue before its frame
+# rate is doubled again.
+VIEWER_RECOVERY_FRAMES = 50
+
+# Seconds a websocket send may block before the viewer is disconnected.
+VIEWER_SEND_TIMEOUT = 30
+
+# How often (seconds) the statistics of a viewer are saved to memcache.
+VIEWER_STATISTICS_INTERVAL = 10
+
+# How often (seconds) a viewer checks that its websocket is still open
+# when no frames arrive.
+VIEWER_IDLE_TIMEOUT = 5
+
+# How often (seconds) the hub statistics are saved to memcache.
+HUB_STATISTICS_INTERVAL = 10
+
+# Upper bound on the spectrums combined into one frame for a viewer.
+MAX_SPECTRUMS_PER_FRAME = 1000
+
+# Upper bound on the seconds of history a viewer can ask to be back filled.
+MAX_BACKFILL_SECONDS = SpectrumHistory.HISTORY_SECONDS
+
+# The frame hubs of this worker keyed by sensorId:bandName.
+frameHubs = {}
+
+
+class Viewer:
+    """
+    A websocket watching a sensor band. Frames from the hub are combined
+    down to the spectrums per frame the viewer asked for and queued for
+    sending. The queue is bounded: when the viewer does not keep up, the
+    drop policy decides which frames go (see VIEWER_DROP_POLICIES).
+    """
+
+    def __init__(self, spectrumsPerFrame, method, dropPolicy=LATEST_WINS):
+        self.queue = Queue(maxsize=VIEWER_QUEUE_DEPTH)
+        self.spectrumsPerFrame = spectrumsPerFrame
+        self.method = method
+        self.dropPolicy = dropPolicy
+        # Extra factor by which the frames of a slow viewer are combined
+        # (DECIMATE policy).
+        self.rateDivisor = 1
+        self.aggregator = None
+        self.inputSpectrumsPerFrame = None
+        self.seq = 0
+        self.sent = 0
+        self.dropped = 0
+        self.lag = 0.0
+        self.maxLag = 0.0
+        self.drainedSends = 0
+
+    def getSpectrumsPerFrame(self):
+        return self.spectrumsPerFrame * self.rateDivisor
+
+    def offer(self, timestamp, spectrumsPerFrame, powers):
+        """
+        Hand a frame of spectrumsPerFrame combined spectrums to the viewer.
+        Returns False if frames had to be dropped.
+        """
+        if spectrumsPerFrame != self.inputSpectrumsPerFrame:
+            self.inputSpectrumsPerFrame = spectrumsPerFrame
+            self.aggregator = StreamingFanout.SpectrumAggregator(
+                max(1, self.getSpectrumsPerFrame() // spectrumsPerFrame),
+                self.method)
+        powers = self.aggregator.add(powers)
+        if powers is None:
+            return True
+        self.seq = self.seq + 1
+        frameSpectrums = spectrumsPerFrame * max(1, self.aggregator.count)
+        frame = (self.seq, timestamp, frameSpectrums, powers)
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except Full:
+            pass
+        if self.dropPolicy == DECIMATE:
+            self.decimate()
+        else:
+            # Drop the oldest frame so the viewer catches up with the
+            # newest one.
+            self.queue.get_nowait()
+            self.dropped = self.dropped + 1
+        self.queue.put_nowait(frame)
+        return False
+
+    def decimate(self):
+        """
+        Drop every other queued frame and combine twice as many spectrums
+        per frame from now on.
+        """
+        frames = []
+        while not self.queue.empty():
+            frames.append(self.queue.get_nowait())
+        for frame in frames[1::2]:
+            self.queue.put_nowait(frame)
+        self.dropped = self.dropped + len(frames) - len(frames[1::2])
+        if self.getSpectrumsPerFrame() * 2 <= MAX_SPECTRUMS_PER_FRAME:
+            self.rateDivisor = self.rateDivisor * 2
+            self.inputSpectrumsPerFrame = None
+        self.drainedSends = 0
+
+    def get(self, timeout):
+        return self.queue.get(timeout=timeout)
+
+    def frameSent(self, timestamp):
+        """
+        Account for a frame written to the websocket. A decimated viewer
+        whose queue stays empty goes back towards the rate it asked for.
+        """
+        self.sent = self.sent + 1
+        self.lag = time.time() - timestamp
+        self.maxLag = max(self.maxLag, self.lag)
+        if self.rateDivisor == 1 or not self.queue.empty():
+            self.drainedSends = 0
+            return
+        self.drainedSends = self.drainedSends + 1
+        if self.drainedSends >= VIEWER_RECOVERY_FRAMES:
+            self.rateDivisor = self.rateDivisor // 2
+            self.inputSpectrumsPerFrame = None
+            self.drainedSends = 0
+
+    def getStatistics(self):
+        return {"dropPolicy": self.dropPolicy,
+                "spectrumsPerFrame": self.getSpectrumsPerFrame(),
+                "queued": self.queue.qsize(),
+                "sent": self.sent,
+                "dropped": self.dropped,
+                "lag": self.lag,
+                "maxLag": self.maxLag}
+
+
+class FrameHub:
+    """
+    The single subscriber of this worker for the live spectrums of a
+    sensor band. Frames pushed by the streaming server are received once
+    and handed to the queue of every viewer (websocket) in this worker.
+    """
+
+    def __init__(self, sensorId, bandName):
+        self.sensorId = sensorId
+        self.bandName = bandName
+        self.viewers = []
+        self.lastSeq = None
+        self.received = 0
+        self.lost = 0
+        self.dropped = 0
+        self.latencySum = 0.0
+        self.latencyMax = 0.0
+        self.statisticsTime = time.time()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        StreamingFanout.bindSubscriberSocket(self.sock, sensorId, bandName)
+        self.greenlet = gevent.spawn(self.run)
+
+    def addViewer(self, spectrumsPerFrame, method, dropPolicy):
+        viewer = Viewer(spectrumsPerFrame, method, dropPolicy)
+        self.viewers.append(viewer)
+        self.requestSpectrumsPerFrame()
+        return viewer
+
+    def removeViewer(self, viewer):
+        self.viewers.remove(viewer)
+        self.requestSpectrumsPerFrame()
+
+    def requestSpectrumsPerFrame(self):
+        """
+        Ask the streaming server to combine spectrums down to what the
+        viewer wanting the most frames needs.
+        """
+        if len(self.viewers) == 0:
+            spectrumsPerFrame = None
+        else:
+            spectrumsPerFrame = min([viewer.spectrumsPerFrame
+                                     for viewer in self.viewers])
+        memCache.setRequestedSpectrumsPerFrame(
+            self.sensorId, self.bandName, os.getpid(), spectrumsPerFrame)
+
+    def run(self):
+        try:
+            while True:
+                frame = self.sock.recv(65536)
+                self.deliver(frame)
+        except:
+            if len(self.viewers) != 0:
+                traceback.print_exc()
+                util.debugPrint("FrameHub: receive failed " + self.sensorId)
+
+    def deliver(self, frame):
+        now = time.time()
+        (seq, timestamp, spectrumsPerFrame,
+         payload) = StreamingFanout.unpackFrame(frame)
+        powers = np.frombuffer(payload, dtype=np.int8)
+        if self.lastSeq is not None and seq > self.lastSeq + 1:
+            self.lost = self.lost + seq - self.lastSeq - 1
+        self.lastSeq = seq
+        self.received = self.received + 1
+        latency = now - timestamp
+        self.latencySum = self.latencySum + latency
+        self.latencyMax = max(self.latencyMax, latency)
+        for viewer in self.viewers:
+            if not viewer.offer(timestamp, spectrumsPerFrame, powers):
+                self.dropped = self.dropped + 1
+        if now - self.statisticsTime > HUB_STATISTICS_INTERVAL:
+            memCache.setFanoutStatistics(self.sensorId, self.bandName,
+                                         os.getpid(), self.getStatistics())
+            self.statisticsTime = now
+
+    def getStatistics(self):
+        if self.received == 0:
+            meanLatency = 0
+        else:
+            meanLatency = self.latencySum / self.received
+        return {"viewers": len(self.viewers),
+                "received": self.received,
+                "lost": self.lost,
+                "dropped": self.dropped,
+                "meanLatency": meanLatency,
+                "maxLatency": self.latencyMax}
+
+    def close(self):
+        StreamingFanout.unbindSubscriberSocket(self.sensorId, self.bandName)
+        self.greenlet.kill(block=False)
+        self.sock.close()
+
+
+def addViewer(sensorId, bandName, spectrumsPerFrame, method,
+              dropPolicy=LATEST_WINS):
+    key = sensorId + ":" + bandName
+    if key not in frameHubs:
+        frameHubs[key] = FrameHub(sensorId, bandName)
+    return frameHubs[key].addViewer(spectrumsPerFrame, method, dropPolicy)
+
+
+def removeViewer(sensorId, bandName, viewer):
+    key = sensorId + ":" + bandName
+    if key not in frameHubs:
+        return
+    hub = frameHubs[key]
+    hub.removeViewer(viewer)
+    if len(hub.viewers) == 0:
+        del frameHubs[key]
+        hub.close()
+
+
+def getBackfillFrames(sensorId, bandName, seconds, spectrumsPerFrame, method):
+    """
+    Combine the last seconds of spectrums kept by the streaming server into
+    frames of spectrumsPerFrame spectrums. Returns a list of
+    (timestamp, powers) in time order (empty if there is no history).
+    """
+    history = SpectrumHistory.readHistory(sensorId, bandName, seconds)
+    if history is None:
+        return []
+    (timestamps, spectrums) = history
+    aggregator = StreamingFanout.SpectrumAggregator(spectrumsPerFrame, method)
+    frames = []
+    for i in range(0, len(timestamps)):
+        powers = aggregator.add(spectrums[i])
+        if powers is not None:
+            frames.append((timestamps[i], powers))
+    return frames
+
+
+def sendFrame(ws, message, binary):
+    with gevent.Timeout(VIEWER_SEND_TIMEOUT):
+        ws.send(message, binary=binary)
+
+
+def saveViewerStatistics(sessionId, sensorId, bandName, frameFormat, viewer):
+    stats = viewer.getStatistics()
+    stats[SENSOR_ID] = sensorId
+    stats["bandName"] = bandName
+    stats["frameFormat"] = frameFormat
+    memCache.setViewerStatistics(sessionId, stats)
+
 
 def getSensorData(ws):
     """
 
     Handle sensor data streaming requests from the web browser.
 
+    The browser sends sessionId:sensorId:sys2detect:minFreq:maxFreq and
+    optionally :format where format is csv (default), binary or
+    binary-delta (see StreamingFanout.ViewerFrameEncoder), and then
+    optionally :framesPerSecond. When the sensor produces spectrums faster
+    than framesPerSecond they are combined with the streaming filter of
+    the sensor and the data message sent to the viewer carries the
+    resulting spectrums per frame. Finally, optionally :backfillSeconds
+    asks for the last backfillSeconds of spectrums (from the history kept
+    by the streaming server) to be sent before the live frames. The data
+    message then carries the number of such frames as backfillFrames;
+    back filled binary frames have sequence number 0. The last optional
+    field, :dropPolicy, is latest-wins (default) or decimate and says what
+    happens to the frames of a viewer that does not keep up (see Viewer).
+
+    Every viewer has its own bounded queue so a slow websocket only holds
+    up its own greenlet, and one that blocks for VIEWER_SEND_TIMEOUT
+    seconds is disconnected. Viewer statistics (lag, drops) are saved in
+    memcache under the session ID for the admin session list.
+
     """
+    viewer = None
+    listenerId = None
     try:
         util.debugPrint("DataStreamng:getSensorData")
         global memCache
@@ -64,15 +389,21 @@ def getSensorData(ws):
         systemToDetect = parts[2]
         minFreq = int(parts[3])
         maxFreq = int(parts[4])
+        if len(parts) > 5 and parts[5] in StreamingFanout.VIEWER_FRAME_FORMATS:
+            frameFormat = parts[5]
+        else:
+            frameFormat = StreamingFanout.CSV_FORMAT
         util.debugPrint("sensorId " + sensorId)
-        memCache.incrementStreamingListenerCount(sensorId)
+        listenerId = str(os.getpid()) + ":" + str(id(ws))
+        memCache.addStreamingListener(sensorId, listenerId)
+        VIEWERS.inc()
         sensorObj = SensorDb.getSensorObj(sensorId)
         if sensorObj is None:
             ws.send(dumps({"status": "Sensor not found: " + sensorId}))
 
         bandName = systemToDetect + ":" + str(minFreq) + ":" + str(maxFreq)
-        util.debugPrint("isStreamingEnabled = " + str(
-            sensorObj.isStreamingEnabled()))
+        util.debugPrint("isStreamingEnabled = %s",
+                        sensorObj.isStreamingEnabled())
         lastDataMessage = memCache.loadLastDataMessage(sensorId, bandName)
         key = sensorId + ":" + bandName
         if key not in lastDataMessage or not sensorObj.isStreamingEnabled():
@@ -80,41 +411,81 @@ def getSensorData(ws):
                 {"status":
                  "NO_DATA: Data message not found or streaming not enabled"}))
         else:
-            ws.send(dumps({"status": "OK"}))
-            util.debugPrint("DataStreaming lastDataMessage: " + str(
-                lastDataMessage[key]))
-            ws.send(str(lastDataMessage[key]))
-            lastdatatime = -1
-            drift = 0
-            while True:
-                secondsPerFrame = sensorObj.getStreamingSecondsPerFrame()
-                lastdataseen = memCache.loadLastDataSeenTimeStamp(sensorId,
-                                                                  bandName)
-                if key in lastdataseen and lastdatatime != lastdataseen[key]:
-                    lastdatatime = lastdataseen[key]
-                    sensordata = memCache.loadSensorData(sensorId, bandName)
-                    memCache.incrementDataConsumedCounter(sensorId, bandName)
-                    currentTime = time.time()
-                    lastdatasent = currentTime
-                    drift = drift + (currentTime - lastdatasent
-                                     ) - secondsPerFrame
-                    ws.send(sensordata[key])
-                    # If we drifted, send the last reading again to fill in.
-                    if drift < 0:
-                        drift = 0
-                    if drift > secondsPerFrame:
-                        if APPLY_DRIFT_CORRECTION:
-                            util.debugPrint("Drift detected")
-                            ws.send(sensordata[key])
-                        drift = 0
-                sleepTime = secondsPerFrame
-                gevent.sleep(sleepTime)
+            ws.send(dumps({"status": "OK", "frameFormat": frameFormat}))
+            util.debugPrint("DataStreaming lastDataMessage: %s",
+                            lastDataMessage[key])
+            spectrumsPerFrame = 1
+            if len(parts) > 6:
+                framesPerSecond = float(parts[6])
+                spectrumsPerSecond = 1.0 / float(
+                    sensorObj.getStreamingSecondsPerFrame())
+                if framesPerSecond > 0:
+                    spectrumsPerFrame = int(round(spectrumsPerSecond /
+                                                  framesPerSecond))
+                    spectrumsPerFrame = min(max(spectrumsPerFrame, 1),
+                                            MAX_SPECTRUMS_PER_FRAME)
+            # Start queueing live frames before reading the history so
+            # nothing falls in between.
+            if len(parts) > 8 and parts[8] in VIEWER_DROP_POLICIES:
+                dropPolicy = parts[8]
+            else:
+                dropPolicy = LATEST_WINS
+            viewer = addViewer(sensorId, bandName, spectrumsPerFrame,
+                               sensorObj.getStreamingFilter(), dropPolicy)
+            backfill = []
+            if len(parts) > 7:
+                backfillSeconds = min(float(parts[7]), MAX_BACKFILL_SECONDS)
+                if backfillSeconds > 0:
+                    backfill = getBackfillFrames(
+                        sensorId, bandName, backfillSeconds,
+                        spectrumsPerFrame, sensorObj.getStreamingFilter())
+            dataMessage = json.loads(lastDataMessage[key])
+            dataMessage[SPECTRUMS_PER_FRAME] = spectrumsPerFrame
+            dataMessage["backfillFrames"] = len(backfill)
+            ws.send(json.dumps(dataMessage))
+            encoder = StreamingFanout.ViewerFrameEncoder(frameFormat)
+            backfillEnd = 0
+            for (timestamp, powers) in backfill:
+                sendFrame(ws, encoder.encode(0, timestamp, spectrumsPerFrame,
+                                             powers), encoder.isBinary())
+                backfillEnd = timestamp
+            statisticsTime = 0
+            while not ws.closed:
+                now = time.time()
+                if now - statisticsTime > VIEWER_STATISTICS_INTERVAL:
+                    saveViewerStatistics(sessionId, sensorId, bandName,
+                                         frameFormat, viewer)
+                    memCache.renewStreamingListener(sensorId, listenerId)
+                    statisticsTime = now
+                try:
+                    (seq, timestamp, frameSpectrums,
+                     powers) = viewer.get(VIEWER_IDLE_TIMEOUT)
+                except Empty:
+                    continue
+                if timestamp <= backfillEnd:
+                    # Already sent from the history.
+                    continue
+                memCache.incrementDataConsumedCounter(sensorId, bandName)
+                sendFrame(ws, encoder.encode(seq, timestamp, frameSpectrums,
+                                             powers), encoder.isBinary())
+                viewer.frameSent(timestamp)
+                FRAMES_SENT.inc()
+    except gevent.Timeout:
+        util.debugPrint("DataStreaming: viewer too slow, closing " +
+                        sessionId)
+        SLOW_VIEWERS.inc()
+        ws.close()
     except:
         traceback.print_exc()
         ws.close()
         util.debugPrint("Error writing to websocket")
     finally:
-        memCache.decrementStreamingListenerCount(sensorId)
+        if viewer is not None:
+            removeViewer(sensorId, bandName, viewer)
+            memCache.setViewerStatistics(sessionId, None)
+        if listenerId is not None:
+            memCache.removeStreamingListener(sensorId, listenerId)
+            VIEWERS.dec()
 
 
 def getSocketServerPort(sensorId):
@@ -130,4 +501,15 @@ def getSocketServerPort(sensorId):
         retval["port"] = -1
         return retval
     retval["port"] = STREAMING_SERVER_PORT
+    # With several ingest nodes the sensor goes to the node that owns it
+    # (or the least loaded one).
+    try:
+        node = IngestRegistry.getNodeForSensor(sensorId)
+    except PyMongoError:
+        util.logStackTrace(sys.exc_info())
+        node = None
+    if node is not None:
+        retval["port"] = node["streamingPort"]
+        if node["host"] is not None:
+            retval["host"] = node["host"]
     return retval
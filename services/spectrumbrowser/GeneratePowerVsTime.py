@@ -20,7 +20,7 @@
 import util
 import msgutils
 import timezone
-import numpy as np
+import pymongo
 import matplotlib.pyplot as plt
 from Defines import TIME_ZONE_KEY
 from Defines import SENSOR_ID
@@ -33,6 +33,7 @@ from Defines import ERROR_MESSAGE
 from Defines import NOK
 from Defines import CHART_WIDTH
 from Defines import CHART_HEIGHT
+from Defines import FREQ_RANGE
 
 import Config
 import DbCollections
@@ -61,23 +62,21 @@ def generatePowerVsTimeForSweptFrequency(sensorId, startTime, freqHz,
     if freqHz < minFreq:
         freqHz = minFreq
     n = int(msg["mPar"]["n"])
-    freqIndex = int(float(freqHz - minFreq) / float(maxFreq - minFreq) *
-                    float(n))
+    freqIndex = min(int(float(freqHz - minFreq) / float(maxFreq - minFreq) *
+                        float(n)), n - 1)
     powerArray = []
     timeArray = []
     startTime = timezone.getDayBoundaryTimeStampFromUtcTimeStamp(msg['t'],
                                                                  timeZone)
-    while True:
-        data = msgutils.getData(msg)
-        powerArray.append(data[freqIndex])
+    dayMessages = dataMessages.find({SENSOR_ID: sensorId,
+                                     FREQ_RANGE: msg[FREQ_RANGE],
+                                     "t": {"$gte": msg['t'],
+                                           "$lte": startTime + SECONDS_PER_DAY}})
+    fs = msgutils.getDataFileSystem(msg)
+    for msg in dayMessages.sort("t", pymongo.ASCENDING):
+        # Read just the one bin we plot from each acquisition.
+        powerArray.append(float(msgutils.readDataRange(msg, freqIndex, 1, fs)[0]))
         timeArray.append(float(msg['t'] - startTime) / float(3600))
-        nextMsg = msgutils.getNextAcquisition(msg)
-        if nextMsg is None:
-            break
-        elif nextMsg['t'] - startTime > SECONDS_PER_DAY:
-            break
-        else:
-            msg = nextMsg
 
     plt.figure(figsize=(chWidth, chHeight))
     plt.xlim([0, 23])
@@ -129,11 +128,6 @@ def generatePowerVsTimeForFFTPower(sensorId, startTime, leftBound, rightBound,
                         " rightColumnsToExclude " + str(rightColumnsToExclude))
         return None
     nM = int(msg["nM"]) - leftColumnsToExclude - rightColumnsToExclude
-    power = np.array(msgutils.getData(msg))
-    lengthToRead = int(n * msg["nM"])
-    powerVal = power[n * leftColumnsToExclude:lengthToRead - n *
-                     rightColumnsToExclude]
-    spectrogramData = np.transpose(powerVal.reshape(nM, n))
     maxFreq = msg["mPar"]["fStop"]
     minFreq = msg["mPar"]["fStart"]
     freqDeltaPerIndex = float(maxFreq - minFreq) / float(n)
@@ -142,7 +136,9 @@ def generatePowerVsTimeForFFTPower(sensorId, startTime, leftBound, rightBound,
     if row < 0:
         util.debugPrint("WARNING: row < 0")
         row = 0
-    powerValues = spectrogramData[row, :]
+    # Strided read of the one frequency bin across the measurements in bounds.
+    powerValues = msgutils.readDataStrided(msg, n * leftColumnsToExclude + row,
+                                           n, nM)
     timeArray = [float((leftColumnsToExclude + i) * miliSecondsPerMeasurement) /
                  float(MILISECONDS_PER_SECOND) for i in range(0, nM)]
     plt.figure(figsize=(chWidth, chHeight))
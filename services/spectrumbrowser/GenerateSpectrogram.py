@@ -19,6 +19,7 @@
 
 import msgutils
 import numpy as np
+import pymongo
 import util
 import matplotlib.pyplot as plt
 import timezone
@@ -27,12 +28,10 @@ import matplotlib as mpl
 mpl.use('Agg')
 import png
 import sys
-import gridfs
-from bson.objectid import ObjectId
 import DbCollections
 from Defines import TIME_ZONE_KEY, SENSOR_ID, \
     MINUTES_PER_DAY, SECONDS_PER_DAY, UNDER_CUTOFF_COLOR, \
-    OVER_CUTOFF_COLOR, HOURS_PER_DAY, DATA_KEY, TIME, FREQ_RANGE, \
+    OVER_CUTOFF_COLOR, HOURS_PER_DAY, TIME, FREQ_RANGE, \
     STATUS, NOK, OK, ERROR_MESSAGE, LAT, LON, ALT
 
 from Defines import STATIC_GENERATED_FILE_LOCATION
@@ -42,8 +41,16 @@ from Defines import LOCATION_MESSAGE_ID
 import DataMessage
 import DebugFlags
 import Config
+import Metrics
 import traceback
 
+RENDER_TIME = Metrics.histogram("spectrogram_render_seconds",
+                                "Time to render a spectrogram image.")
+CACHE_HITS = Metrics.counter("spectrogram_cache_hits_total",
+                             "Spectrograms served from a generated image.")
+CACHE_MISSES = Metrics.counter("spectrogram_cache_misses_total",
+                               "Spectrograms rendered.")
+
 
 # get minute index offset from given time in seconds.
 # startTime is the starting time from which to compute the offset.
@@ -131,9 +138,21 @@ def generateSingleDaySpectrogramAndOccupancyForSweptFrequency(
 
         msg = startMsg
         sensorId = msg[SENSOR_ID]
-        powerValues = msgutils.trimSpectrumToSubBand(msg, subBandMinFreq,
-                                                     subBandMaxFreq)
-        vectorLength = len(powerValues)
+        # Load every acquisition of the day in one query and trim them all
+        # to the sub band in one step.
+        dayMessages = list(DbCollections.getDataMessages(sensorId).find(
+            {SENSOR_ID: sensorId,
+             FREQ_RANGE: DataMessage.getFreqRange(startMsg),
+             TIME: {"$gte": DataMessage.getTime(startMsg),
+                    "$lt": startTimeUtc + SECONDS_PER_DAY}}).sort(
+                        TIME, pymongo.ASCENDING))
+        if len(dayMessages) == 0:
+            # startMsg is at (or past) the end of the day.
+            util.debugPrint("Not found - no acquisitions in the day")
+            return {STATUS: NOK, ERROR_MESSAGE: "Data Not Found"}
+        acquisitions = msgutils.getSubBandDataMatrix(
+            dayMessages, subBandMinFreq, subBandMaxFreq)
+        vectorLength = acquisitions.shape[1]
         if cutoff is None:
             cutoff = DataMessage.getThreshold(msg)
         else:
@@ -159,27 +178,20 @@ def generateSingleDaySpectrogramAndOccupancyForSweptFrequency(
         else:
             prevAcquisitionTime = timezone.getDayBoundaryTimeStampFromUtcTimeStamp(
                 prevMessage['t'], tz)
-            util.debugPrint("prevMessage[t] " + str(prevMessage[
-                't']) + " msg[t] " + str(msg['t']) + " prevDayBoundary " + str(
-                    prevAcquisitionTime))
-            prevAcquisition = np.transpose(np.array(
-                msgutils.trimSpectrumToSubBand(prevMessage, subBandMinFreq,
-                                               subBandMaxFreq)))
-        occupancy = []
+            util.debugPrint("prevMessage[t] %s msg[t] %s prevDayBoundary %s",
+                            prevMessage['t'], msg['t'], prevAcquisitionTime)
+            prevAcquisition = msgutils.getSubBandDataMatrix(
+                [prevMessage], subBandMinFreq, subBandMaxFreq)[0]
+        occupancy = msgutils.computeOccupancies(acquisitions, cutoff).tolist()
         timeArray = []
-        maxpower = -1000
-        minpower = 1000
-        # Note that we are starting with the first message.
-        count = 1
-        while True:
-            acquisition = msgutils.trimSpectrumToSubBand(msg, subBandMinFreq,
-                                                         subBandMaxFreq)
-            occupancyCount = float(len(filter(lambda x: x >= cutoff,
-                                              acquisition)))
-            occupancyVal = occupancyCount / float(len(acquisition))
-            occupancy.append(occupancyVal)
-            minpower = np.minimum(minpower, msgutils.getMinPower(msg))
-            maxpower = np.maximum(maxpower, msgutils.getMaxPower(msg))
+        # The power range comes from the location message, which is the
+        # same for all the acquisitions of the day.
+        minpower = np.minimum(1000, msgutils.getMinPower(msg))
+        maxpower = np.maximum(-1000, msgutils.getMaxPower(msg))
+        count = len(dayMessages)
+        for index in range(0, count):
+            msg = dayMessages[index]
+            acquisition = acquisitions[index]
             if prevMessage['t1'] != msg['t1']:
                 # GAP detected so fill it with sensorOff
                 sindex = get_index(
@@ -209,32 +221,17 @@ def generateSingleDaySpectrogramAndOccupancyForSweptFrequency(
                              float(3600))
             prevMessage = msg
             prevAcquisition = acquisition
-            msg = msgutils.getNextAcquisition(msg)
-            if msg is None:
-                lastMessage = prevMessage
-                for i in range(
-                        get_index(
-                            DataMessage.getTime(prevMessage), startTimeUtc),
-                        MINUTES_PER_DAY):
-                    spectrogramData[:, i] = sensorOffPower
-                break
-            elif DataMessage.getTime(msg) - startTimeUtc >= SECONDS_PER_DAY:
-                if msg['t1'] == prevMessage['t1']:
-                    for i in range(
-                            get_index(
-                                DataMessage.getTime(prevMessage),
-                                startTimeUtc), MINUTES_PER_DAY):
-                        spectrogramData[:, i] = prevAcquisition
-                else:
-                    for i in range(
-                            get_index(
-                                DataMessage.getTime(prevMessage),
-                                startTimeUtc), MINUTES_PER_DAY):
-                        spectrogramData[:, i] = sensorOffPower
-
-                lastMessage = prevMessage
-                break
-            count = count + 1
+
+        lastMessage = prevMessage
+        # Fill to the end of the day depending on whether the sensor stayed on.
+        nextMessage = msgutils.getNextAcquisition(lastMessage)
+        if nextMessage is not None and nextMessage['t1'] == lastMessage['t1']:
+            fillPower = prevAcquisition
+        else:
+            fillPower = sensorOffPower
+        for i in range(get_index(DataMessage.getTime(lastMessage), startTimeUtc),
+                       MINUTES_PER_DAY):
+            spectrogramData[:, i] = fillPower
 
         # generate the spectrogram as an image.
         if not os.path.exists(spectrogramFilePath + ".png"):
@@ -259,13 +256,16 @@ def generateSingleDaySpectrogramAndOccupancyForSweptFrequency(
                              vmax=maxpower,
                              cmap=cmap)
             util.debugPrint("Generated fig")
-            plt.savefig(spectrogramFilePath + '.png',
-                        bbox_inches='tight',
-                        pad_inches=0,
-                        dpi=100)
+            CACHE_MISSES.inc()
+            with RENDER_TIME.time():
+                plt.savefig(spectrogramFilePath + '.png',
+                            bbox_inches='tight',
+                            pad_inches=0,
+                            dpi=100)
             plt.clf()
             plt.close()
         else:
+            CACHE_HITS.inc()
             util.debugPrint("File exists - not generating image")
 
         util.debugPrint("FileName: " + spectrogramFilePath + ".png")
@@ -367,10 +367,7 @@ def generateSingleAcquisitionSpectrogramAndOccupancyForFFTPower(
     else:
         cutoff = int(threshold)
     startTime = DataMessage.getTime(msg)
-    fs = gridfs.GridFS(DbCollections.getSpectrumDb(), msg[SENSOR_ID] + "_data")
     sensorId = msg[SENSOR_ID]
-    messageBytes = fs.get(ObjectId(msg[DATA_KEY])).read()
-    util.debugPrint("Read " + str(len(messageBytes)))
     spectrogramFile = sessionId + "/" + sensorId + "." + str(
         startTime) + "." + str(leftBound) + "." + str(rightBound) + "." + str(
             cutoff)
@@ -398,11 +395,8 @@ def generateSingleAcquisitionSpectrogramAndOccupancyForFFTPower(
         msg) - leftColumnsToExclude - rightColumnsToExclude
     n = DataMessage.getNumberOfFrequencyBins(msg)
     locationMessage = msgutils.getLocationMessage(msg)
-    lengthToRead = n * DataMessage.getNumberOfMeasurements(msg)
-    # Read the power values
-    power = msgutils.getData(msg)
-    powerVal = np.array(power[n * leftColumnsToExclude:lengthToRead - n *
-                              rightColumnsToExclude])
+    # Read the power values of the measurements within the bounds only.
+    powerVal = msgutils.readDataRange(msg, n * leftColumnsToExclude, n * nM)
     minTime = float(leftColumnsToExclude *
                     miliSecondsPerMeasurement) / float(1000)
     spectrogramData = powerVal.reshape(nM, n)
@@ -431,13 +425,16 @@ def generateSingleAcquisitionSpectrogramAndOccupancyForFFTPower(
             vmax=maxpower,
             cmap=cmap)
         util.debugPrint("Generated fig " + spectrogramFilePath + ".png")
-        plt.savefig(spectrogramFilePath + '.png',
-                    bbox_inches='tight',
-                    pad_inches=0,
-                    dpi=100)
+        CACHE_MISSES.inc()
+        with RENDER_TIME.time():
+            plt.savefig(spectrogramFilePath + '.png',
+                        bbox_inches='tight',
+                        pad_inches=0,
+                        dpi=100)
         plt.clf()
         plt.close()
     else:
+        CACHE_HITS.inc()
         util.debugPrint("File exists -- not regenerating")
 
     # generate the occupancy data for the measurement.
@@ -519,7 +516,7 @@ def generateSingleAcquisitionSpectrogramAndOccupancyForFFTPower(
     # Now put in the occupancy data
     result[STATUS] = OK
     util.debugPrint(
-        "generateSingleAcquisitionSpectrogramAndOccupancyForFFTPower:returning (abbreviated): " + str(result))
+        "generateSingleAcquisitionSpectrogramAndOccupancyForFFTPower:returning (abbreviated): %s", result)
     result["timeArray"] = timeArray
     result["occupancyArray"] = occupancyCount
 
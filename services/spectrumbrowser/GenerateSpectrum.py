@@ -20,7 +20,6 @@
 import matplotlib.pyplot as plt
 import util
 import msgutils
-import numpy as np
 import timezone
 import sys
 import traceback
@@ -101,11 +100,10 @@ def generateSpectrumForFFTPower(msg, milisecOffset, sessionId):
     measurementDuration = int(msg["mPar"]["td"])
     miliSecondsPerMeasurement = float(measurementDuration *
                                       MILISECONDS_PER_SECOND) / float(nM)
-    powerVal = np.array(msgutils.getData(msg))
-    spectrogramData = np.transpose(powerVal.reshape(nM, n))
     col = int(milisecOffset / miliSecondsPerMeasurement)
     util.debugPrint("Col = " + str(col))
-    spectrumData = spectrogramData[:, col]
+    # Only read the measurement we plot.
+    spectrumData = msgutils.readDataRange(msg, col * n, n)
     maxFreq = msg["mPar"]["fStop"]
     minFreq = msg["mPar"]["fStart"]
     nSteps = len(spectrumData)
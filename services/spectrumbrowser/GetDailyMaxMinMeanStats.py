@@ -22,6 +22,7 @@ import msgutils
 import timezone
 import numpy as np
 import DbCollections
+import DayIndex
 import DataMessage
 import SensorDb
 
@@ -42,79 +43,58 @@ from Defines import LAT, LON, ALT
 
 def compute_daily_max_min_mean_median_stats_for_swept_freq(
         cursor, subBandMinFreq, subBandMaxFreq):
-    meanOccupancy = 0
-    minOccupancy = 10000
-    maxOccupancy = -1
     count = cursor.count()
-    occupancy = []
-    n = 0
-    if cursor.count() == 0:
+    if count == 0:
         return None
-    dayBoundaryTimeStamp = None
-    cacheMiss = False
-    recomputeOccupancies = False
-    insertInCache = True
-    cacheVal = None
-    for msg in cursor:
-
-        if dayBoundaryTimeStamp is None:
-            dayBoundaryTimeStamp = msgutils.getDayBoundaryTimeStamp(msg)
-
-        cutoff = DataMessage.getThreshold(msg)
-
-        if subBandMinFreq == DataMessage.getMinFreq(
-                msg) and subBandMaxFreq == DataMessage.getMaxFreq(msg):
-            if not cacheMiss:
-                freqRange = DataMessage.getFreqRange(msg)
-                sensorId = DataMessage.getSensorId(msg)
-                cache = DbCollections.getDailyOccupancyCache(sensorId)
-                cacheVal = cache.find_one({FREQ_RANGE:freqRange,"dayBoundaryTimeStamp":dayBoundaryTimeStamp})
-                if cacheVal is not None:
-                    del cacheVal["_id"]
-                    insertInCache = False
-                    break
-                else:
-                    recomputeOccupancies = True
-                    cacheMiss = True
-                    insertInCache = True
-            occupancy.append(msg["occupancy"])
-        else:
-            insertInCache = False
-            recomputeOccupancies = True
-            # No caching for non-standard cutoff
-            powerArray = msgutils.trimSpectrumToSubBand(msg, subBandMinFreq,
-                                                        subBandMaxFreq)
-            msgOccupancy = float(len(filter(
-                lambda x: x >= cutoff, powerArray))) / float(len(powerArray))
-            occupancy.append(msgOccupancy)
-
-        n = msg["mPar"]["n"]
-
-    if recomputeOccupancies:
-        if len(occupancy) != 0:
-            maxOccupancy = float(np.max(occupancy))
-            minOccupancy = float(np.min(occupancy))
-            meanOccupancy = float(np.mean(occupancy))
-        else:
-            cutoff = -100
-            maxOccupancy = 0
-            minOccupancy = 0
-            meanOccupancy = 0
-
-    if recomputeOccupancies:
-        cacheVal = {"count": count,
-                    "dayBoundaryTimeStamp":dayBoundaryTimeStamp,
-                    "maxOccupancy":maxOccupancy,
-                    "minOccupancy":minOccupancy,
-                    "meanOccupancy":meanOccupancy}
-
-    if insertInCache:
-        cacheVal[FREQ_RANGE] = freqRange
-        cache = DbCollections.getDailyOccupancyCache(sensorId)
-        cache.insert(cacheVal, upsert=False)
-
-    if "_id" in cacheVal:
+    messages = list(cursor)
+    firstMessage = messages[0]
+    dayBoundaryTimeStamp = msgutils.getDayBoundaryTimeStamp(firstMessage)
+    cutoff = DataMessage.getThreshold(messages[-1])
+    freqRange = DataMessage.getFreqRange(firstMessage)
+    sensorId = DataMessage.getSensorId(firstMessage)
+    isFullBand = subBandMinFreq == DataMessage.getMinFreq(firstMessage) and \
+        subBandMaxFreq == DataMessage.getMaxFreq(firstMessage)
+
+    # Cache entries written before sub band caching have no sub band
+    # fields; those are full band entries.
+    cache = DbCollections.getDailyOccupancyCache(sensorId)
+    cacheQuery = {FREQ_RANGE: freqRange,
+                  "dayBoundaryTimeStamp": dayBoundaryTimeStamp}
+    if isFullBand:
+        cacheQuery["subBandMinFreq"] = {"$in": [subBandMinFreq, None]}
+        cacheQuery["subBandMaxFreq"] = {"$in": [subBandMaxFreq, None]}
+    else:
+        cacheQuery["subBandMinFreq"] = subBandMinFreq
+        cacheQuery["subBandMaxFreq"] = subBandMaxFreq
+    cacheVal = cache.find_one(cacheQuery)
+    # A day that is still filling up has a stale count -- recompute it.
+    if cacheVal is not None and cacheVal["count"] == count:
         del cacheVal["_id"]
+        for key in (FREQ_RANGE, "subBandMinFreq", "subBandMaxFreq"):
+            if key in cacheVal:
+                del cacheVal[key]
+        return (cutoff, cacheVal)
+
+    if isFullBand:
+        occupancy = np.array([msg["occupancy"] for msg in messages])
+    else:
+        # Load the whole day at once and compute every occupancy in one pass.
+        dataMatrix = msgutils.getSubBandDataMatrix(messages, subBandMinFreq,
+                                                   subBandMaxFreq)
+        cutoffs = [DataMessage.getThreshold(msg) for msg in messages]
+        occupancy = msgutils.computeOccupancies(dataMatrix, cutoffs)
+
+    cacheVal = {"count": count,
+                "dayBoundaryTimeStamp": dayBoundaryTimeStamp,
+                "maxOccupancy": float(np.max(occupancy)),
+                "minOccupancy": float(np.min(occupancy)),
+                "meanOccupancy": float(np.mean(occupancy))}
+
+    cacheEntry = dict(cacheVal)
+    cacheEntry[FREQ_RANGE] = freqRange
+    cacheEntry["subBandMinFreq"] = subBandMinFreq
+    cacheEntry["subBandMaxFreq"] = subBandMaxFreq
+    cache.update(cacheQuery, cacheEntry, upsert=True)
 
     return (cutoff, cacheVal)
 
@@ -160,14 +140,22 @@ def getDailyMaxMinMeanStats(sensorId, lat, lon, alt, tstart, ndays, sys2detect,
     tZId = locationMessage[TIME_ZONE_KEY]
     tmin = timezone.getDayBoundaryTimeStampFromUtcTimeStamp(tstart, tZId)
     startMessage = DbCollections.getDataMessages(sensorId).find_one()
+    freqRange = msgutils.freqRange(sys2detect, fmin, fmax)
+    tend = tmin + SECONDS_PER_DAY * ndays
+    # Only query the days that have data.
+    daysWithData = set([day[DayIndex.DAY_BOUNDARY] for day in DayIndex.getDays(
+        sensorId, freqRange, tmin, tend, locationMessageId)])
     result = {}
     result[STATUS] = OK
     values = {}
+    cutoff = None
     for day in range(0, ndays):
         tstart = timezone.getDayBoundaryTimeStampFromUtcTimeStamp(tmin + day * SECONDS_PER_DAY, tZId)
+        if tstart not in daysWithData:
+            continue
         tend = tstart + SECONDS_PER_DAY
         queryString = {LOCATION_MESSAGE_ID:locationMessageId, TIME: {'$gte':tstart, '$lte': tend},
-                       FREQ_RANGE:msgutils.freqRange(sys2detect, fmin, fmax)}
+                       FREQ_RANGE:freqRange}
         cur = DbCollections.getDataMessages(sensorId).find(queryString)
         # cur.batch_size(20)
         if startMessage['mType'] == FFT_POWER:
@@ -182,30 +170,17 @@ def getDailyMaxMinMeanStats(sensorId, lat, lon, alt, tstart, ndays, sys2detect,
         values[day * 24] = dailyStat
     # Now compute the next interval after the last one (if one exists)
     tend = tmin + SECONDS_PER_DAY * ndays
-    queryString = {LOCATION_MESSAGE_ID: locationMessageId, TIME: {'$gte':tend},
-                   FREQ_RANGE:msgutils.freqRange(sys2detect, fmin, fmax)}
-    msg = DbCollections.getDataMessages(sensorId).find_one(queryString)
-    if msg is None:
-        result["nextTmin"] = tmin
-    else:
-        nextTmin = timezone.getDayBoundaryTimeStampFromUtcTimeStamp(msg[TIME],
-                                                                    tZId)
-        result["nextTmin"] = nextTmin
+    result["nextTmin"] = DayIndex.getNextDayBoundary(
+        sensorId, freqRange, tend, tmin, locationMessageId, inclusive=True)
     # Now compute the previous interval before this one.
-    prevMessage = msgutils.getPrevAcquisition(startMessage)
-    if prevMessage is not None:
-        newTmin = timezone.getDayBoundaryTimeStampFromUtcTimeStamp(
-            prevMessage[TIME] - SECONDS_PER_DAY * ndays, tZId)
-        queryString = {LOCATION_MESSAGE_ID:locationMessageId, TIME: {'$gte':newTmin},
-                       FREQ_RANGE:msgutils.freqRange(sys2detect, fmin, fmax)}
-        msg = DbCollections.getDataMessages(sensorId).find_one(queryString)
-    else:
-        msg = startMessage
+    newTmin = timezone.getDayBoundaryTimeStampFromUtcTimeStamp(
+        tmin - SECONDS_PER_DAY * ndays, tZId)
+    prevTmin = DayIndex.getNextDayBoundary(sensorId, freqRange, newTmin, tmin,
+                                           locationMessageId, inclusive=True)
     sensor = SensorDb.getSensorObj(sensorId)
     channelCount = sensor.getChannelCount(sys2detect,fmin,fmax)
     result[STATUS] = OK
-    result["prevTmin"] = timezone.getDayBoundaryTimeStampFromUtcTimeStamp(
-        msg[TIME], tZId)
+    result["prevTmin"] = min(prevTmin, tmin)
     result["tmin"] = tmin
     result["maxFreq"] = fmin
     result["minFreq"] = fmax
@@ -17,6 +17,7 @@
 # not limited to the correctness, accuracy, reliability or usefulness of
 # this software.
 
+import sys
 import timezone
 import util
 import pymongo
@@ -27,6 +28,7 @@ from Defines import TIME_ZONE_KEY, SENSOR_ID, SECONDS_PER_DAY, \
     ERROR_MESSAGE, NOK, MEASUREMENT_TYPE, ACTIVE, LOCATION_MESSAGE_ID, \
     LON, LAT, ALT
 import DbCollections
+import DayIndex
 import SensorDb
 import LocationMessage
 
@@ -270,51 +272,46 @@ def getAcquistionCount(sensorId, lat, lon, alt, sys2detect, minfreq, maxfreq,
         return retval
 
     freqRange = msgutils.freqRange(sys2detect, minfreq, maxfreq)
-    query = {SENSOR_ID: sensorId,
-             LOCATION_MESSAGE_ID:str(locationMessage["_id"]),
-             "t": {"$gte": tAcquistionStart},
-             FREQ_RANGE: freqRange}
-    msg = DbCollections.getDataMessages(sensorId).find_one(query)
-    if msg is None:
+    locationMessageId = str(locationMessage["_id"])
+    firstDay = DayIndex.getFirstDayEndingAfter(sensorId, freqRange,
+                                               tAcquistionStart,
+                                               locationMessageId,
+                                               inclusive=True)
+    if firstDay is None:
         retval = {COUNT: 0}
         retval[STATUS] = "OK"
         return retval
 
-    startTime = msgutils.getDayBoundaryTimeStamp(msg)
-
-    if dayCount > 0:
-        endTime = startTime + SECONDS_PER_DAY * dayCount
-        query = {SENSOR_ID: sensorId,
-                 LOCATION_MESSAGE_ID:str(locationMessage["_id"]),
-                 TIME: {"$gte": startTime},
-                 TIME: {"$lte": endTime},
-                 FREQ_RANGE: freqRange}
+    startTime = firstDay[DayIndex.DAY_BOUNDARY]
+    if firstDay[DayIndex.FIRST_TIME] >= tAcquistionStart:
+        tStartReadings = firstDay[DayIndex.FIRST_TIME]
     else:
+        # The start time falls inside the first day.
         query = {SENSOR_ID: sensorId,
-                 LOCATION_MESSAGE_ID:str(locationMessage["_id"]),
-                 TIME: {"$gte": startTime},
+                 LOCATION_MESSAGE_ID: locationMessageId,
+                 TIME: {"$gte": tAcquistionStart},
                  FREQ_RANGE: freqRange}
+        cur = DbCollections.getDataMessages(sensorId).find(query)
+        tStartReadings = cur.sort(TIME, pymongo.ASCENDING).limit(1).next()[TIME]
 
-    cur = DbCollections.getDataMessages(sensorId).find(query)
-    count = cur.count()
-
-    cur.sort(TIME, pymongo.DESCENDING).limit(2)
-    lastMessage = cur.next()
-    endTime = msgutils.getDayBoundaryTimeStamp(lastMessage)
+    if dayCount > 0:
+        endTime = startTime + SECONDS_PER_DAY * dayCount
+    else:
+        endTime = sys.maxint
+    days = DayIndex.getDays(sensorId, freqRange, startTime, endTime,
+                            locationMessageId)
+    count = sum([day[COUNT] for day in days])
+    lastDay = days[-1]
 
     retval = {COUNT: count}
-    retval["tStartReadings"] = msg[TIME]
-    retval["tEndReadings"] = lastMessage[TIME]
+    retval["tStartReadings"] = tStartReadings
+    retval["tEndReadings"] = lastDay[DayIndex.LAST_TIME]
     retval["tStartDayBoundary"] = startTime
-    retval["tEndDayBoundary"] = endTime
-    query = {SENSOR_ID: sensorId,
-             TIME: {"$gte": startTime},
-             FREQ_RANGE: freqRange}
-    cur = DbCollections.getDataMessages(sensorId).find(query)
-    cur.sort(TIME, pymongo.DESCENDING).limit(2)
-    lastMessage = cur.next()
-    endTime = msgutils.getDayBoundaryTimeStamp(lastMessage)
-    retval["tEndReadingsDayBoundary"] = endTime
+    retval["tEndDayBoundary"] = lastDay[DayIndex.DAY_BOUNDARY]
+    # The last day with data for this band at any location.
+    lastDay = DayIndex.getLastDayStartingBefore(sensorId, freqRange,
+                                                sys.maxint)
+    retval["tEndReadingsDayBoundary"] = lastDay[DayIndex.DAY_BOUNDARY]
 
     retval[STATUS] = "OK"
     return retval
@@ -28,6 +28,7 @@ from Defines import SECONDS_PER_HOUR
 from Defines import LOCATION_MESSAGE_ID
 from Defines import LAT, LON, ALT
 import DbCollections
+import DayIndex
 import DataMessage
 import LocationMessage
 import SensorDb
@@ -40,7 +41,7 @@ def compute_stats_for_fft_power(cursor):
     minOccupancy = 10000
     maxOccupancy = -1
     nReadings = cursor.count()
-    util.debugPrint("nreadings = " + str(nReadings))
+    util.debugPrint("nreadings = %d", nReadings)
     if nReadings == 0:
         util.debugPrint("zero count")
         return None
@@ -97,10 +98,7 @@ def getOneDayStats(sensorId, lat, lon, alt, startTime, sys2detect, minFreq, maxF
     res["formattedDate"] = timezone.formatTimeStampLong(
         mintime, locationMessage[TIME_ZONE_KEY])
     acquisitionCount = cur.count()
-    prevMsg = None
     for msg in cur:
-        if prevMsg is None:
-            prevMsg = msgutils.getPrevAcquisition(msg)
         channelCount = msg["mPar"]["n"]
         measurementsPerAcquisition = msg["nM"]
         cutoff = msg["cutoff"]
@@ -111,24 +109,10 @@ def getOneDayStats(sensorId, lat, lon, alt, startTime, sys2detect, minFreq, maxF
                                            "minOccupancy":msg["minOccupancy"],
                                            "meanOccupancy":msg["meanOccupancy"],
                                            "medianOccupancy":msg["medianOccupancy"]}
-    query = {SENSOR_ID: sensorId, "t": {"$gt": maxtime}, FREQ_RANGE: freqRange}
-    msg = DbCollections.getDataMessages(sensorId).find_one(query)
-    if msg is not None:
-        nextDay = timezone.getDayBoundaryTimeStampFromUtcTimeStamp(msg["t"],
-                                                                   tzId)
-    else:
-        nextDay = mintime
-    if prevMsg is not None:
-        prevDayBoundary = timezone.getDayBoundaryTimeStampFromUtcTimeStamp(
-            prevMsg["t"], tzId)
-        query = {SENSOR_ID: sensorId,
-                 "t": {"$gte": prevDayBoundary},
-                 FREQ_RANGE: freqRange}
-        msg = DbCollections.getDataMessages(sensorId).find_one(query)
-        prevDay = timezone.getDayBoundaryTimeStampFromUtcTimeStamp(msg["t"],
-                                                                   tzId)
-    else:
-        prevDay = mintime
+    nextDay = DayIndex.getNextDayBoundary(sensorId, freqRange, maxtime,
+                                          mintime)
+    prevDay = DayIndex.getPrevDayBoundary(sensorId, freqRange, mintime,
+                                          mintime)
     res["nextIntervalStart"] = nextDay
     res["prevIntervalStart"] = prevDay
     res["currentIntervalStart"] = mintime
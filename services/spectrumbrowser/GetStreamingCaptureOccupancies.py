@@ -29,8 +29,11 @@ import sys
 import os
 import traceback
 import Config
+import pymongo
 from json import dumps
 import timezone
+import BinaryStream
+import SpectrumHistory
 import numpy as np
 
 from Defines import SENSOR_ID
@@ -43,10 +46,340 @@ from Defines import OCCUPANCY_FILE_URL
 from Defines import TIME_FILE_URL
 from Defines import POWER_FILE_URL
 from Defines import TIME_ZONE_KEY
+from Defines import MAX_HOLD
+from Defines import MEAN
+from Defines import MIN_MAX
+from Defines import DATA_TYPE
+from Defines import BINARY_INT8
+
+
+class Decimator:
+    """
+    Reduces a time ordered stream of rows (spectrums or occupancies) to at
+    most a target number of time buckets while the rows are being read.
+    Only the running aggregate of the current bucket is kept in memory.
+    """
+
+    def __init__(self, seconds, points, method=MAX_HOLD):
+        self.bucketSeconds = float(seconds) / float(points)
+        self.method = method
+        self.bucketIndex = None
+        self.bucketTime = None
+        self.count = 0
+        self.sum = None
+        self.max = None
+        self.min = None
+
+    def add(self, timeOffset, row):
+        """
+        Add a row at the given time offset. Returns the list of
+        (timeOffset, row) tuples for the bucket this row closed, if any.
+        """
+        index = int(timeOffset / self.bucketSeconds)
+        retval = []
+        if self.bucketIndex is not None and index != self.bucketIndex:
+            retval = self.flush()
+        row = np.array(row, dtype=np.float64)
+        if self.bucketIndex is None:
+            self.bucketIndex = index
+            self.bucketTime = timeOffset
+            self.count = 1
+            self.sum = row.copy()
+            self.max = row.copy()
+            self.min = row.copy()
+        else:
+            self.count = self.count + 1
+            self.sum += row
+            np.maximum(self.max, row, out=self.max)
+            np.minimum(self.min, row, out=self.min)
+        return retval
+
+    def flush(self):
+        """
+        Close the current bucket and return its (timeOffset, row) tuples.
+        MIN_MAX returns the min row followed by the max row.
+        """
+        if self.bucketIndex is None:
+            return []
+        if self.method == MEAN:
+            retval = [(self.bucketTime, self.sum / self.count)]
+        elif self.method == MIN_MAX:
+            retval = [(self.bucketTime, self.min), (self.bucketTime, self.max)]
+        else:
+            retval = [(self.bucketTime, self.max)]
+        self.bucketIndex = None
+        return retval
+
+
+def _formatOccupancy(value):
+    value = float(value)
+    if value.is_integer():
+        return str(int(value))
+    else:
+        return str(util.roundTo2DecimalPlaces(value))
+
+
+def _formatPower(value):
+    return str(np.ndarray.tolist(np.asarray(value)))
+
+
+def _writeRow(dataFile, timeFile, decimator, timeOffset, value, formatValue):
+    """
+    Write a row and its time offset or, when decimating, hand the row to
+    the decimator and write out the buckets it completes.
+    """
+    if decimator is None:
+        rows = [(timeOffset, value)]
+    else:
+        rows = decimator.add(timeOffset, value)
+    for (t, v) in rows:
+        dataFile.write(formatValue(v) + "\n")
+        timeFile.write(str(t) + "\n")
+
+
+def _flushRows(dataFile, timeFile, decimator, formatValue):
+    if decimator is not None:
+        for (t, v) in decimator.flush():
+            dataFile.write(formatValue(v) + "\n")
+            timeFile.write(str(t) + "\n")
+
+
+def _decimationSuffix(points, decimation):
+    if points is None:
+        return ""
+    else:
+        return "." + decimation + "." + str(points)
+
+
+def _captureWindow(startTime, endTime, captureStartTime, captureEndTime,
+                   nM, secondsPerEntry):
+    """
+    Return the (sindex, findex) measurement indices of a capture that fall
+    inside [startTime, endTime].
+    """
+    if startTime <= captureStartTime and endTime >= captureEndTime:
+        sindex = 0
+        findex = nM
+    elif startTime > captureStartTime and endTime < captureEndTime:
+        sindex = int((startTime - captureStartTime) / secondsPerEntry)
+        findex = int(nM - (captureEndTime - endTime) / secondsPerEntry)
+    elif startTime >= captureStartTime:
+        sindex = int((startTime - captureStartTime) / secondsPerEntry)
+        findex = nM
+    else:
+        sindex = 0
+        findex = int(nM - (captureEndTime - endTime) / secondsPerEntry)
+    return sindex, max(sindex, findex)
+
+
+def _captureRows(cur, startTime, endTime, loadRows, captureEndsAtTime=False,
+                 offsetFromFirstCapture=False):
+    """
+    Generate (timeOffsets, rows) per capture in the cursor, restricted to
+    [startTime, endTime]. loadRows(dataMessage, sindex, findex) returns the
+    rows of the capture in that index range.
+    """
+    fs = None
+    timeSinceStart = 0.0
+    first = True
+    for dataMessage in cur:
+        nM = DataMessage.getNumberOfMeasurements(dataMessage)
+        td = DataMessage.getMeasurementDuration(dataMessage)
+        tm = DataMessage.getTimePerMeasurement(dataMessage)
+        if captureEndsAtTime:
+            captureEndTime = dataMessage[TIME]
+            captureStartTime = captureEndTime - nM * tm
+        else:
+            captureStartTime = dataMessage[TIME]
+            captureEndTime = captureStartTime + nM * tm
+        if first and offsetFromFirstCapture:
+            timeSinceStart = dataMessage[TIME] - startTime
+        first = False
+        if fs is None:
+            fs = msgutils.getDataFileSystem(dataMessage)
+        sindex, findex = _captureWindow(startTime, endTime, captureStartTime,
+                                        captureEndTime, nM,
+                                        float(td) / float(nM))
+        timeSinceStart = timeSinceStart + sindex * tm
+        count = findex - sindex
+        if count > 0:
+            timeOffsets = timeSinceStart + np.arange(count) * tm
+            yield timeOffsets, loadRows(dataMessage, sindex, findex, fs)
+        timeSinceStart = timeSinceStart + count * tm
+
+
+def _loadPowerRows(dataMessage, sindex, findex, fs):
+    n = DataMessage.getNumberOfFrequencyBins(dataMessage)
+    return msgutils.readDataRange(dataMessage, sindex * n,
+                                  (findex - sindex) * n, fs).reshape(-1, n)
+
+
+def _loadOccupancyRows(dataMessage, sindex, findex, fs):
+    """
+    Occupancy here is the number of bins at or above the threshold in each
+    measurement, as in msgutils.getOccupancyData.
+    """
+    powers = _loadPowerRows(dataMessage, sindex, findex, fs)
+    cutoff = DataMessage.getThreshold(dataMessage)
+    return np.sum(powers >= cutoff, axis=1).reshape(-1, 1)
+
+
+def _binaryStream(header, captureRows, dtype, decimator):
+    """
+    Generate the binary response for the rows produced by captureRows:
+    the header first and then one chunk of records per capture (or per
+    batch of completed buckets when decimating).
+    """
+    yield BinaryStream.packHeader(header)
+    for (timeOffsets, rows) in captureRows:
+        if decimator is None:
+            yield BinaryStream.packRecords(timeOffsets, rows, dtype)
+            continue
+        completed = []
+        for i in range(0, len(timeOffsets)):
+            completed.extend(decimator.add(timeOffsets[i], rows[i]))
+        if len(completed) != 0:
+            yield BinaryStream.packRecords([t for (t, v) in completed],
+                                           [v for (t, v) in completed],
+                                           dtype)
+    if decimator is not None:
+        completed = decimator.flush()
+        if len(completed) != 0:
+            yield BinaryStream.packRecords([t for (t, v) in completed],
+                                           [v for (t, v) in completed],
+                                           dtype)
+
+
+def _openStream(sensorId, freqRange, startTime, seconds, kind, rowLength,
+                dtype, loadRows, points, decimation, captureEndsAtTime=False,
+                offsetFromFirstCapture=False):
+    dataMessages = DbCollections.getDataMessages(sensorId)
+    endTime = startTime + seconds
+    query = {SENSOR_ID: sensorId,
+             FREQ_RANGE: freqRange,
+             "$and": [{TIME: {"$gte": startTime}}, {TIME: {"$lte": endTime}}]}
+    cur = dataMessages.find(query).sort(TIME, pymongo.ASCENDING)
+    if cur.count() == 0:
+        return {STATUS: "NOK", STATUS_MESSAGE: "No Data Found"}
+    decimator = None
+    if points is not None:
+        decimator = Decimator(seconds, points, decimation)
+        if decimation == MEAN:
+            dtype = np.float32
+    header = {"kind": kind,
+              "dtype": np.dtype(dtype).name,
+              "shape": [-1, rowLength],
+              "timeBase": startTime,
+              "timeDtype": "float32",
+              SENSOR_ID: sensorId,
+              FREQ_RANGE: freqRange,
+              "points": points,
+              "decimation": decimation if points is not None else None}
+    rows = _captureRows(cur, startTime, endTime, loadRows, captureEndsAtTime,
+                        offsetFromFirstCapture)
+    return _binaryStream(header, rows, dtype, decimator)
+
+
+def getOccupanciesStream(sensorId, sys2detect, minFreq, maxFreq, startTime,
+                         seconds, points=None, decimation=MAX_HOLD):
+    """
+    Same selection as getOccupancies but returns a generator of the binary
+    response (see BinaryStream) instead of writing files, or an error dict.
+    """
+    freqRange = msgutils.freqRange(sys2detect, minFreq, maxFreq)
+    return _openStream(sensorId, freqRange, startTime, seconds, "occupancy", 1,
+                       np.int16, _loadOccupancyRows, points, decimation)
+
+
+def getOccupanciesByDateStream(sensorId, sys2detect, minFreq, maxFreq,
+                               startDate, timeOfDay, seconds, points=None,
+                               decimation=MAX_HOLD):
+    freqRange = msgutils.freqRange(sys2detect, minFreq, maxFreq)
+    dataMessage = DbCollections.getDataMessages(sensorId).find_one({})
+    if dataMessage is None:
+        return {STATUS: "NOK", STATUS_MESSAGE: "No Data Found"}
+    locationMessage = msgutils.getLocationMessage(dataMessage)
+    timeString = startDate + " " + timeOfDay
+    startTime = timezone.parseTime(timeString, locationMessage[TIME_ZONE_KEY])
+    return _openStream(sensorId, freqRange, startTime, seconds, "occupancy", 1,
+                       np.int16, _loadOccupancyRows, points, decimation,
+                       captureEndsAtTime=True)
+
+
+def getPowersStream(sensorId, sys2detect, minFreq, maxFreq, startTime,
+                    seconds, points=None, decimation=MAX_HOLD):
+    """
+    Same selection as getPowers but returns a generator of the binary
+    response (see BinaryStream) instead of writing files, or an error dict.
+    """
+    freqRange = msgutils.freqRange(sys2detect, minFreq, maxFreq)
+    dataMessage = DbCollections.getDataMessages(sensorId).find_one(
+        {FREQ_RANGE: freqRange})
+    if dataMessage is None:
+        return {STATUS: "NOK", STATUS_MESSAGE: "No Data Found"}
+    n = DataMessage.getNumberOfFrequencyBins(dataMessage)
+    if dataMessage[DATA_TYPE] == BINARY_INT8:
+        dtype = np.int8
+    else:
+        dtype = np.float32
+    return _openStream(sensorId, freqRange, startTime, seconds, "power", n,
+                       dtype, _loadPowerRows, points, decimation,
+                       offsetFromFirstCapture=True)
+
+
+def _readRecentSpectrums(sensorId, sys2detect, minFreq, maxFreq, seconds):
+    freqRange = msgutils.freqRange(sys2detect, minFreq, maxFreq)
+    history = SpectrumHistory.readHistory(sensorId, freqRange, seconds)
+    if history is None or len(history[0]) == 0:
+        return freqRange, None
+    return freqRange, history
+
+
+def getRecentSpectrums(sensorId, sys2detect, minFreq, maxFreq, seconds):
+    """
+    The live spectrums of the last seconds kept in memory by the streaming
+    server (no database reads). Times are offsets from timeBase.
+    """
+    (freqRange, history) = _readRecentSpectrums(sensorId, sys2detect, minFreq,
+                                                maxFreq, seconds)
+    if history is None:
+        return {STATUS: "NOK", STATUS_MESSAGE: "No Data Found"}
+    (timestamps, powers) = history
+    timeBase = float(timestamps[0])
+    return {STATUS: "OK",
+            "timeBase": timeBase,
+            "time": (timestamps - timeBase).tolist(),
+            "power": powers.tolist()}
+
+
+def getRecentSpectrumsStream(sensorId, sys2detect, minFreq, maxFreq, seconds):
+    """
+    Same as getRecentSpectrums but returns a generator of the binary
+    response (see BinaryStream), or an error dict.
+    """
+    (freqRange, history) = _readRecentSpectrums(sensorId, sys2detect, minFreq,
+                                                maxFreq, seconds)
+    if history is None:
+        return {STATUS: "NOK", STATUS_MESSAGE: "No Data Found"}
+    (timestamps, powers) = history
+    timeBase = float(timestamps[0])
+    header = {"kind": "power",
+              "dtype": np.dtype(np.int8).name,
+              "shape": [-1, powers.shape[1]],
+              "timeBase": timeBase,
+              "timeDtype": "float32",
+              SENSOR_ID: sensorId,
+              FREQ_RANGE: freqRange,
+              "points": None,
+              "decimation": None}
+    chunk = BinaryStream.RECORDS_PER_CHUNK
+    rows = [(timestamps[i:i + chunk] - timeBase, powers[i:i + chunk])
+            for i in range(0, len(timestamps), chunk)]
+    return _binaryStream(header, rows, np.int8, None)
 
 
 def getOccupancies(sensorId, sys2detect, minFreq, maxFreq, startTime, seconds,
-                   sessionId):
+                   sessionId, points=None, decimation=MAX_HOLD):
     freqRange = msgutils.freqRange(sys2detect, minFreq, maxFreq)
     dataMessages = DbCollections.getDataMessages(sensorId)
     dataMessage = dataMessages.find_one({})
@@ -61,7 +394,8 @@ def getOccupancies(sensorId, sys2detect, minFreq, maxFreq, startTime, seconds,
     if cur is None or cur.count() == 0:
         return {STATUS: "NOK", STATUS_MESSAGE: "No Data Found"}
     occupancyFileName = sessionId + "/" + sensorId + ":" + freqRange + ".occupancy." + str(
-        startTime) + "-" + str(seconds) + ".txt"
+        startTime) + "-" + str(seconds) + _decimationSuffix(
+            points, decimation) + ".txt"
     if not os.path.exists(util.getPath(STATIC_GENERATED_FILE_LOCATION) +
                           sessionId):
         os.mkdir(util.getPath(STATIC_GENERATED_FILE_LOCATION) + sessionId)
@@ -70,13 +404,17 @@ def getOccupancies(sensorId, sys2detect, minFreq, maxFreq, startTime, seconds,
         STATIC_GENERATED_FILE_LOCATION) + occupancyFileName
     occupancyFile = open(occupancyFilePath, "w")
     timeFileName = sessionId + "/" + sensorId + ":" + freqRange + ".occupancy.time." + str(
-        startTime) + "-" + str(seconds) + ".txt"
+        startTime) + "-" + str(seconds) + _decimationSuffix(
+            points, decimation) + ".txt"
     if not os.path.exists(util.getPath(STATIC_GENERATED_FILE_LOCATION) +
                           sessionId):
         os.mkdir(util.getPath(STATIC_GENERATED_FILE_LOCATION) + sessionId)
     timeFileUrl = Config.getGeneratedDataPath() + "/" + timeFileName
     timeFilePath = util.getPath(STATIC_GENERATED_FILE_LOCATION) + timeFileName
     timeFile = open(timeFilePath, "w")
+    decimator = None
+    if points is not None:
+        decimator = Decimator(seconds, points, decimation)
     tm = None
     timeSinceStart = 0
     try:
@@ -111,11 +449,10 @@ def getOccupancies(sensorId, sys2detect, minFreq, maxFreq, startTime, seconds,
             timeSinceStart = timeSinceStart + sindex * tm
             print "sindex/findex", sindex, findex
             for i in range(sindex, findex):
-                occupancy = str(int(occupancyData[i]))
-                occupancyFile.write(occupancy + "\n")
-            for i in range(sindex, findex):
-                timeFile.write(str(timeSinceStart) + "\n")
+                _writeRow(occupancyFile, timeFile, decimator, timeSinceStart,
+                          occupancyData[i], _formatOccupancy)
                 timeSinceStart = timeSinceStart + tm
+        _flushRows(occupancyFile, timeFile, decimator, _formatOccupancy)
         occupancyFile.close()
         timeFile.close()
         return {STATUS: "OK",
@@ -133,7 +470,8 @@ def getOccupancies(sensorId, sys2detect, minFreq, maxFreq, startTime, seconds,
 
 
 def getOccupanciesByDate(sensorId, sys2detect, minFreq, maxFreq, startDate,
-                         timeOfDay, seconds, sessionId):
+                         timeOfDay, seconds, sessionId, points=None,
+                         decimation=MAX_HOLD):
 
     freqRange = msgutils.freqRange(sys2detect, minFreq, maxFreq)
     dataMessages = DbCollections.getDataMessages(sensorId)
@@ -152,7 +490,8 @@ def getOccupanciesByDate(sensorId, sys2detect, minFreq, maxFreq, startDate,
     if cur is None or cur.count() == 0:
         return {STATUS: "NOK", STATUS_MESSAGE: "No Data Found"}
     occupancyFileName = sessionId + "/" + sensorId + ":" + freqRange + ".occupancy." + str(
-        startTime) + "-" + str(seconds) + ".txt"
+        startTime) + "-" + str(seconds) + _decimationSuffix(
+            points, decimation) + ".txt"
     if not os.path.exists(util.getPath(STATIC_GENERATED_FILE_LOCATION) +
                           sessionId):
         os.mkdir(util.getPath(STATIC_GENERATED_FILE_LOCATION) + sessionId)
@@ -162,7 +501,8 @@ def getOccupanciesByDate(sensorId, sys2detect, minFreq, maxFreq, startDate,
     occupancyFile = open(occupancyFilePath, "w")
 
     timeFileName = sessionId + "/" + sensorId + ":" + freqRange + ".time." + str(
-        startTime) + "-" + str(seconds) + ".txt"
+        startTime) + "-" + str(seconds) + _decimationSuffix(
+            points, decimation) + ".txt"
     if not os.path.exists(util.getPath(STATIC_GENERATED_FILE_LOCATION) +
                           sessionId):
         os.mkdir(util.getPath(STATIC_GENERATED_FILE_LOCATION) + sessionId)
@@ -170,6 +510,9 @@ def getOccupanciesByDate(sensorId, sys2detect, minFreq, maxFreq, startDate,
     timeFilePath = util.getPath(STATIC_GENERATED_FILE_LOCATION) + timeFileName
     timeFile = open(timeFilePath, "w")
 
+    decimator = None
+    if points is not None:
+        decimator = Decimator(seconds, points, decimation)
     tm = None
     timeSinceStart = 0
     try:
@@ -199,11 +542,10 @@ def getOccupanciesByDate(sensorId, sys2detect, minFreq, maxFreq, startDate,
             timeSinceStart = timeSinceStart + sindex * tm
             print "sindex/findex", sindex, findex
             for i in range(sindex, findex):
-                occupancy = str(int(occupancyData[i]))
-                occupancyFile.write(occupancy + "\n")
-            for i in range(sindex, findex):
-                timeFile.write(str(timeSinceStart) + "\n")
+                _writeRow(occupancyFile, timeFile, decimator, timeSinceStart,
+                          occupancyData[i], _formatOccupancy)
                 timeSinceStart = timeSinceStart + tm
+        _flushRows(occupancyFile, timeFile, decimator, _formatOccupancy)
         occupancyFile.close()
         timeFile.close()
         return {STATUS: "OK",
@@ -220,7 +562,7 @@ def getOccupanciesByDate(sensorId, sys2detect, minFreq, maxFreq, startDate,
 
 
 def getPowers(sensorId, sys2detect, minFreq, maxFreq, startTime, seconds,
-              sessionId):
+              sessionId, points=None, decimation=MAX_HOLD):
     freqRange = msgutils.freqRange(sys2detect, minFreq, maxFreq)
     dataMessages = DbCollections.getDataMessages(sensorId)
     dataMessage = dataMessages.find_one({})
@@ -235,7 +577,8 @@ def getPowers(sensorId, sys2detect, minFreq, maxFreq, startTime, seconds,
     if cur is None or cur.count() == 0:
         return {STATUS: "NOK", STATUS_MESSAGE: "No Data Found"}
     powerFileName = sessionId + "/" + sensorId + ":" + freqRange + ".power." + str(
-        startTime) + "-" + str(seconds) + ".txt"
+        startTime) + "-" + str(seconds) + _decimationSuffix(
+            points, decimation) + ".txt"
     if not os.path.exists(util.getPath(STATIC_GENERATED_FILE_LOCATION) +
                           sessionId):
         os.mkdir(util.getPath(STATIC_GENERATED_FILE_LOCATION) + sessionId)
@@ -245,13 +588,17 @@ def getPowers(sensorId, sys2detect, minFreq, maxFreq, startTime, seconds,
     occupancyFile = open(occupancyFilePath, "w")
 
     timeFileName = sessionId + "/" + sensorId + ":" + freqRange + ".power.time." + str(
-        startTime) + "-" + str(seconds) + ".txt"
+        startTime) + "-" + str(seconds) + _decimationSuffix(
+            points, decimation) + ".txt"
     if not os.path.exists(util.getPath(STATIC_GENERATED_FILE_LOCATION) +
                           sessionId):
         os.mkdir(util.getPath(STATIC_GENERATED_FILE_LOCATION) + sessionId)
     timeFileUrl = Config.getGeneratedDataPath() + "/" + timeFileName
     timeFilePath = util.getPath(STATIC_GENERATED_FILE_LOCATION) + timeFileName
     timeFile = open(timeFilePath, "w")
+    decimator = None
+    if points is not None:
+        decimator = Decimator(seconds, points, decimation)
     tm = None
     timeSinceStart = 0.0
     try:
@@ -287,11 +634,10 @@ def getPowers(sensorId, sys2detect, minFreq, maxFreq, startTime, seconds,
             timeSinceStart = timeSinceStart + sindex * tm
             # print "sindex/findex", sindex,findex
             for i in range(sindex, findex):
-                power = np.ndarray.tolist(powerData[i])
-                occupancyFile.write(str(power) + "\n")
-            for i in range(sindex, findex):
-                timeFile.write(str(timeSinceStart) + "\n")
+                _writeRow(occupancyFile, timeFile, decimator, timeSinceStart,
+                          powerData[i], _formatPower)
                 timeSinceStart = timeSinceStart + tm
+        _flushRows(occupancyFile, timeFile, decimator, _formatPower)
         occupancyFile.close()
         timeFile.close()
         return {STATUS: "OK",
@@ -21,6 +21,7 @@ import Bootstrap
 Bootstrap.setPath()
 from flask import Flask, request, abort, make_response, redirect
 from flask import jsonify
+from flask import Response, stream_with_context
 from flask import render_template
 import random
 import json
@@ -55,6 +56,7 @@ from flask.ext.cors import CORS
 from TestCaseDecorator import testcase
 from NoCacheDecorator import nocache
 import DbCollections
+import IngestRegistry
 from Defines import FFT_POWER
 from Defines import SENSOR_ID
 from Defines import SWEPT_FREQUENCY
@@ -67,14 +69,18 @@ from Defines import STATUS
 from Defines import ONE_HOUR
 
 from Defines import USER
+from Defines import MAX_HOLD
+from Defines import DECIMATION_METHODS
 import DebugFlags
 import SessionLock
+import Metrics
 
 UNIT_TEST_DIR = "./unit-tests"
 
 global launchedFromMain
 
 Log.configureLogging("spectrumbrowser")
+Metrics.setService("spectrumbrowser")
 
 secureSessions = {}
 
@@ -84,6 +90,7 @@ app.static_folder = Bootstrap.getSpectrumBrowserHome() + "/flask/static"
 app.template_folder = Bootstrap.getSpectrumBrowserHome() + "/flask/templates"
 cors = CORS(app)
 sockets = Sockets(app)
+Metrics.instrumentApp(app)
 random.seed()
 
 ###############################################################################
@@ -109,6 +116,45 @@ Config.printConfig()
 def formatError(errorStr):
     return jsonify({"Error": errorStr})
 
+
+def getDecimationArgs():
+    """
+    Get the optional server side decimation URL args (points, decimation).
+    Aborts with 400 if they are malformed.
+    """
+    points = request.args.get("points", None)
+    decimation = request.args.get("decimation", MAX_HOLD)
+    if decimation not in DECIMATION_METHODS:
+        util.debugPrint("Unknown decimation method " + decimation)
+        abort(400)
+    if points is None:
+        return (None, decimation)
+    try:
+        points = int(points)
+    except ValueError:
+        abort(400)
+    if points <= 0:
+        abort(400)
+    return (points, decimation)
+
+
+def wantsBinaryFormat():
+    """
+    True if the client asked for the binary streamed response (format=binary).
+    """
+    return request.args.get("format", "json") == "binary"
+
+
+def binaryStreamResponse(result):
+    """
+    Stream the generator returned by a *Stream query as a chunked
+    application/octet-stream response, or return the error document.
+    """
+    if isinstance(result, dict):
+        return jsonify(result)
+    return Response(stream_with_context(result),
+                    mimetype="application/octet-stream")
+
 ###############################################################################
 
 
@@ -2013,15 +2059,20 @@ def getOccupancies(sensorId, sys2detect, minFreq, maxFreq, startTime, seconds,
         - seconds: Interval
         - sessionId: Browser session ID.
 
-    URL Parameters:
+    URL Parameters (optional):
 
-        - None.
+        - points: reduce the result to at most this many time buckets on the server.
+        - decimation: how a bucket is reduced when points is given: MAX_HOLD (default),
+          MEAN or MIN_MAX (two rows per bucket, min followed by max).
+        - format: json (default) or binary. binary streams the result directly in the
+          response (see services/common/BinaryStream.py) instead of generating files.
 
    HTTP Return Codes:
 
         200 - OK if successful.
                 Returns a document containing a URLs to the generated occupancies and a time array
                 indicating the time offset from the query start time.
+                With format=binary, returns the application/octet-stream records.
         403 - authentication failure.
 
 
@@ -2040,9 +2091,17 @@ def getOccupancies(sensorId, sys2detect, minFreq, maxFreq, startTime, seconds,
                 abort(500)
             if not authentication.checkSessionId(sessionId, USER):
                 abort(403)
+            (points, decimation) = getDecimationArgs()
+            if wantsBinaryFormat():
+                return binaryStreamResponse(
+                    GetStreamingCaptureOccupancies.getOccupanciesStream(
+                        sensorId, sys2detect, int(minFreq), int(maxFreq),
+                        int(startTime), int(seconds), points=points,
+                        decimation=decimation))
             return jsonify(GetStreamingCaptureOccupancies.getOccupancies(
                 sensorId, sys2detect, int(minFreq), int(maxFreq), int(
-                    startTime), int(seconds), sessionId))
+                    startTime), int(seconds), sessionId, points=points,
+                decimation=decimation))
         except:
             print "Unexpected error:", sys.exc_info()[0]
             print sys.exc_info()
@@ -2073,6 +2132,15 @@ def getSpectrums(sensorId, sys2detect, minFreq, maxFreq, startTime, seconds,
         - seconds: Duration
         - sessionId: login session Id
 
+    URL Args (optional):
+
+        - points: reduce the result to at most this many spectrums on the server.
+        - decimation: how the spectrums in a bucket are combined when points is given:
+          MAX_HOLD (default), MEAN or MIN_MAX (two rows per bucket, min followed by max).
+        - format: json (default) or binary. binary streams int8 (float32 for non int8
+          data or MEAN decimation) spectrums in the response body instead of generating
+          files (see services/common/BinaryStream.py).
+
 
     Example:
 
@@ -2118,9 +2186,17 @@ def getSpectrums(sensorId, sys2detect, minFreq, maxFreq, startTime, seconds,
                 abort(500)
             if not authentication.checkSessionId(sessionId, USER):
                 abort(403)
+            (points, decimation) = getDecimationArgs()
+            if wantsBinaryFormat():
+                return binaryStreamResponse(
+                    GetStreamingCaptureOccupancies.getPowersStream(
+                        sensorId, sys2detect, int(minFreq), int(maxFreq),
+                        int(startTime), int(seconds), points=points,
+                        decimation=decimation))
             return jsonify(GetStreamingCaptureOccupancies.getPowers(
                 sensorId, sys2detect, int(minFreq), int(maxFreq), int(
-                    startTime), int(seconds), sessionId))
+                    startTime), int(seconds), sessionId, points=points,
+                decimation=decimation))
         except:
             print "Unexpected error:", sys.exc_info()[0]
             print sys.exc_info()
@@ -2132,6 +2208,69 @@ def getSpectrums(sensorId, sys2detect, minFreq, maxFreq, startTime, seconds,
                               startTime, seconds, sessionId)
 
 
+@app.route(
+    "/spectrumbrowser/getRecentSpectrums/<sensorId>/<sys2detect>/<minFreq>/<maxFreq>/<seconds>/<sessionId>",
+    methods=["POST", "GET"])
+def getRecentSpectrums(sensorId, sys2detect, minFreq, maxFreq, seconds,
+                       sessionId):
+    """
+    get the live spectrums of the last few seconds of a streaming sensor band.
+    These are kept in memory by the streaming server (up to five minutes) so this
+    can be used to back fill a waterfall display without reading the database.
+
+    URL Parameters:
+
+        - sensorId: Sensor ID
+        - sys2detect: system to detect.
+        - minFreq: min band band frequency
+        - maxFreq: max band frequency
+        - seconds: how far back to go from the latest spectrum.
+        - sessionId: login session Id
+
+    URL Args (optional):
+
+        - format: json (default) or binary. binary streams int8 spectrums in the
+          response body (see services/common/BinaryStream.py).
+
+    HTTP Return Codes:
+
+        200 - OK if successful.
+                Returns a document with timeBase (UTC seconds of the first spectrum),
+                a time array of offsets from timeBase and a power array with one
+                spectrum per row, or status NOK if the sensor band is not streaming.
+                With format=binary, returns the application/octet-stream records.
+        403 - authentication failure.
+
+    """
+
+    @testcase
+    def getRecentSpectrumsWorker(sensorId, sys2detect, minFreq, maxFreq,
+                                 seconds, sessionId):
+        try:
+            if not Config.isConfigured():
+                util.debugPrint("Please configure system")
+                abort(500)
+            if not authentication.checkSessionId(sessionId, USER):
+                abort(403)
+            if wantsBinaryFormat():
+                return binaryStreamResponse(
+                    GetStreamingCaptureOccupancies.getRecentSpectrumsStream(
+                        sensorId, sys2detect, int(minFreq), int(maxFreq),
+                        float(seconds)))
+            return jsonify(GetStreamingCaptureOccupancies.getRecentSpectrums(
+                sensorId, sys2detect, int(minFreq), int(maxFreq),
+                float(seconds)))
+        except:
+            print "Unexpected error:", sys.exc_info()[0]
+            print sys.exc_info()
+            util.logStackTrace(sys.exc_info())
+            traceback.print_exc()
+            raise
+
+    return getRecentSpectrumsWorker(sensorId, sys2detect, minFreq, maxFreq,
+                                    seconds, sessionId)
+
+
 @app.route(
     "/spectrumdb/getOccupanciesByDate/<sensorId>/<sys2detect>/<minFreq>/<maxFreq>/<startDate>/<timeOfDay>/<seconds>/<sessionId>",
     methods=["POST", "GET"])
@@ -2151,24 +2290,41 @@ def getOccupanciesByDate(sensorId, sys2detect, minFreq, maxFreq, startDate,
         - seconds: period for which data is needed.
         - sessionId: browser session ID.
 
+    URL Args (optional):
+
+        - points: reduce the result to at most this many time buckets on the server.
+        - decimation: MAX_HOLD (default), MEAN or MIN_MAX.
+        - format: json (default) or binary (see getOccupancies).
+
 
     """
 
     @testcase
     def getOccupanciesByDateWorker(sensorId, sys2detect, minFreq, maxFreq,
-                                   startDate, timeOfDay, sessionId):
+                                   startDate, timeOfDay, seconds, sessionId):
         try:
             if not Config.isConfigured():
                 util.debugPrint("Please configure system")
                 abort(500)
             if not authentication.checkSessionId(sessionId, USER):
                 abort(403)
+            try:
+                seconds = int(seconds)
+            except ValueError:
+                abort(400)
             if seconds > ONE_HOUR * 24:
                 util.debugPrint("Interval is too long")
                 abort(400)
+            (points, decimation) = getDecimationArgs()
+            if wantsBinaryFormat():
+                return binaryStreamResponse(
+                    GetStreamingCaptureOccupancies.getOccupanciesByDateStream(
+                        sensorId, sys2detect, int(minFreq), int(maxFreq),
+                        startDate, timeOfDay, seconds, points=points,
+                        decimation=decimation))
             return jsonify(GetStreamingCaptureOccupancies.getOccupanciesByDate(
                 sensorId, sys2detect, minFreq, maxFreq, startDate, timeOfDay,
-                seconds, sessionId))
+                seconds, sessionId, points=points, decimation=decimation))
 
         except:
             print "Unexpected error:", sys.exc_info()[0]
@@ -2272,6 +2428,12 @@ def getMonitoringPort(sensorId):
                 retval[PORT] = -1
             else:
                 retval[PORT] = OCCUPANCY_ALERT_PORT
+                # Alerts come from the node that owns the sensor.
+                node = IngestRegistry.getNodeForSensor(sensorId)
+                if node is not None:
+                    retval[PORT] = node["alertPort"]
+                    if node["host"] is not None:
+                        retval["host"] = node["host"]
             return jsonify(retval)
         except:
             util.logStackTrace(sys.exc_info())
@@ -2280,6 +2442,55 @@ def getMonitoringPort(sensorId):
 
     return getMonitoringPortWorker(sensorId)
 
+
+@app.route("/spectrumbrowser/getStreamingNode/<sensorId>/<sessionId>", methods=["POST", "GET"])
+@nocache
+def getStreamingNode(sensorId, sessionId):
+    """
+    Get the ingest node that streams a sensor, for viewers to connect to.
+
+    URL Path:
+
+        - sensorId: the sensor ID.
+        - sessionId: The session ID for the login session.
+
+    HTTP Return Codes:
+
+        - 200 OK if invocation successful. A JSON document containing the
+          nodeId and the webUrl of the node is returned (both null when
+          no ingest node is registered; webUrl is null when the node is
+          served by this web server).
+        - 403 if the session is not valid.
+        - 404 if sensor is not found.
+        - 500 if server is not configured.
+
+    """
+
+    @testcase
+    def getStreamingNodeWorker(sensorId, sessionId):
+        try:
+            if not Config.isConfigured():
+                util.debugPrint("Please configure system")
+                abort(500)
+            if not authentication.checkSessionId(sessionId, USER):
+                abort(403)
+            if SensorDb.getSensorObj(sensorId) is None:
+                abort(404)
+            retval = {IngestRegistry.NODE_ID: None, "webUrl": None}
+            node = IngestRegistry.getNodeForSensor(sensorId)
+            if node is not None:
+                retval[IngestRegistry.NODE_ID] = node[IngestRegistry.NODE_ID]
+                retval["webUrl"] = node["webUrl"]
+            return jsonify(retval)
+        except:
+            print "Unexpected error:", sys.exc_info()[0]
+            print sys.exc_info()
+            traceback.print_exc()
+            util.logStackTrace(sys.exc_info())
+            raise
+
+    return getStreamingNodeWorker(sensorId, sessionId)
+
 #==========================================================================
 
 
@@ -2398,6 +2609,8 @@ if __name__ == '__main__':
     app.config['CORS_HEADERS'] = 'Content-Type'
     # app.run('0.0.0.0',port=8000,debug="True")
     app.debug = True
+    # Under gunicorn the master starts it (see gunicorn.conf).
+    Metrics.startMetricsServer()
     server = pywsgi.WSGIServer(('localhost', 8000),
                                app,
                                handler_class=WebSocketHandler)
@@ -27,17 +27,31 @@ sys.path.append(sbHome + "/services/common")
 
 import util
 import traceback
-import populate_db
+import IngestSpool
+import Metrics
+import json
+import authentication
+from pymongo.errors import PyMongoError
+from Defines import SENSOR_ID
+from Defines import SENSOR_KEY
 import argparse
 from gevent import pywsgi
 import Log
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, abort
+from multiprocessing import Process
 import pwd
 import os
 import logging
 ##########################################################################################
 
 app = Flask(__name__, static_url_path="")
+Metrics.setService("spectrumdb")
+Metrics.instrumentApp(app)
+
+UPLOADS = Metrics.counter("uploads_total",
+                          "Messages uploaded and spooled.")
+UPLOAD_BYTES = Metrics.counter("upload_bytes_total",
+                               "Bytes of the uploaded messages.")
 
 
 @app.route("/spectrumdb/upload", methods=["POST"])
@@ -60,13 +74,29 @@ def upload():
 
     Return Codes:
 
-    - 200 OK if the data was successfully put into the MSOD database.
+    - 200 OK if the data was accepted. It is written to the local ingest
+      spool and inserted into the MSOD database by the spool drainer.
     - 403 Forbidden if the sensor key is not recognized.
 
     """
     try:
         msg = request.data
-        populate_db.put_message(request.data)
+        index = msg.index("{")
+        headerLength = int(msg[0:index - 1].rstrip())
+        jsonData = json.loads(msg[index:index + headerLength])
+        if not IngestSpool.isValidSensorId(jsonData[SENSOR_ID]):
+            abort(400)
+        try:
+            if not authentication.authenticateSensor(jsonData[SENSOR_ID],
+                                                     jsonData[SENSOR_KEY]):
+                abort(403)
+        except PyMongoError:
+            # The database is down: spool it, the drainer authenticates
+            # the sensor again when it replays the message.
+            util.errorPrint("upload: database unavailable, spooling")
+        IngestSpool.spoolMessage(msg)
+        UPLOADS.inc()
+        UPLOAD_BYTES.inc(len(msg))
         return jsonify({"status": "OK"})
     except:
         util.logStackTrace(sys.exc_info())
@@ -120,12 +150,18 @@ if __name__ == '__main__':
         context.pidfile = daemon.pidfile.TimeoutPIDLockFile(args.pidfile)
         with context:
             Log.configureLogging("spectrumdb")
+            drainer = Process(target=IngestSpool.runDrainer)
+            drainer.start()
+            Metrics.startMetricsServer()
             app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
             server = pywsgi.WSGIServer(('localhost', 8003), app)
             server.serve_forever()
     else:
         with util.pidfile(args.pidfile):
             Log.configureLogging("spectrumdb")
+            drainer = Process(target=IngestSpool.runDrainer)
+            drainer.start()
+            Metrics.startMetricsServer()
             app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
             server = pywsgi.WSGIServer(('localhost', 8003), app)
             server.serve_forever()
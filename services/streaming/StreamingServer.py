@@ -30,7 +30,15 @@ import Config
 import util
 import argparse
 import socket
-import DataStreamSharedState
+import StreamingFanout
+import SpectrumHistory
+import OccupancyFanout
+import StreamRecorder
+import IngestSpool
+import SensorControl
+import IngestRegistry
+import StreamCompression
+import Metrics
 from DataStreamSharedState import MemCache
 import os
 import traceback
@@ -43,10 +51,10 @@ import authentication
 import json
 import time
 from Queue import Queue
-import populate_db
 import numpy as np
 import ssl
 import errno
+import select
 from Defines import SYS
 from Defines import LOC
 from Defines import DATA
@@ -55,6 +63,7 @@ from Defines import SENSOR_ID
 from Defines import SENSOR_KEY
 from Defines import SPECTRUMS_PER_FRAME
 from Defines import STREAMING_FILTER
+from Defines import STREAM_COMPRESSION
 from Defines import SYS_TO_DETECT
 from Defines import DISABLED
 from Defines import ADMIN
@@ -63,6 +72,8 @@ from Defines import STATUS
 from Defines import OK
 from Defines import NOK
 from Defines import ERROR_MESSAGE
+from Defines import SENSOR_CONTROL_PORT
+from Defines import OCCUPANCY_ALERT_PORT
 import SensorDb
 import DataMessage
 import CaptureDb
@@ -84,6 +95,7 @@ POSTING = 3
 app = Flask(__name__, static_url_path="")
 app.static_folder = sbHome + "/flask/static"
 app.template_folder = sbHome + "/flask/templates"
+Metrics.instrumentApp(app)
 gwtSymbolMap = {}
 
 lastDataMessage = {}
@@ -93,13 +105,24 @@ lastDataMessageOriginalTimeStamp = {}
 childPids = []
 bbuf = None
 mySensorId = None
-global sensorCommandDispatcherPid
-sensorCommandDispatcherPid = None
+mainPid = None
 
 memCache = None
 
 checkForDataRate = True
 
+# How often (seconds) the live spectrum publisher statistics are saved.
+PUBLISHER_STATISTICS_INTERVAL = 10
+
+SENSOR_CONNECTIONS = Metrics.gauge("sensor_connections",
+                                   "Sensors streaming to this node.")
+MESSAGES = Metrics.counter("messages_total",
+                           "Data, system and location messages received.")
+SPECTRUMS = Metrics.counter("spectrums_total",
+                            "Spectrums received from the sensors.")
+CAPTURES = Metrics.counter("captures_total",
+                           "Captures spooled for the database.")
+
 
 class MyByteBuffer:
     def __init__(self, ws):
@@ -140,6 +163,12 @@ class MyByteBuffer:
         val = self.read(1)
         return val
 
+    def readBytes(self, count):
+        val = ""
+        while len(val) < count:
+            val = val + self.read(count - len(val))
+        return val
+
     def close(self):
         self.buf.close()
 
@@ -193,12 +222,42 @@ class BBuf():
     def __init__(self, conn):
         self.conn = conn
         self.buf = BytesIO()
+        self.commandChannel = None
+
+    def setCommandChannel(self, commandChannel):
+        """
+        Commands routed to the sensor are written to it while waiting for
+        its data.
+        """
+        self.commandChannel = commandChannel
+
+    def send(self, command):
+        self.conn.sendall(command)
+
+    def waitForData(self):
+        channel = self.commandChannel
+        while True:
+            # Data already decrypted by an ssl socket does not show in select.
+            if hasattr(self.conn, "pending") and self.conn.pending() > 0:
+                return
+            if channel.checkConnection():
+                readers = [self.conn, channel]
+            else:
+                readers = [self.conn]
+            readable = select.select(readers, [], [],
+                                     SensorControl.CHANNEL_RECONNECT_INTERVAL)[0]
+            if channel in readable:
+                channel.dispatch(self.send)
+            if self.conn in readable:
+                return
 
     def read(self):
         try:
             val = self.buf.read(1)
             if val == "" or val is None:
-                data = self.conn.recv(64)
+                if self.commandChannel is not None:
+                    self.waitForData()
+                data = self.conn.recv(4096)
                 # max queue size - put this in config
                 self.buf = BytesIO(data)
                 val = self.buf.read(1)
@@ -235,38 +294,34 @@ class BBuf():
         else:
             raise Exception("Read null value - client disconnected.")
 
+    def readBytes(self, count):
+        val = self.buf.read(count)
+        while len(val) < count:
+            if self.commandChannel is not None:
+                self.waitForData()
+            data = self.conn.recv(max(4096, count - len(val)))
+            if data == "":
+                raise Exception("Read null value - client disconnected.")
+            self.buf = BytesIO(data)
+            val = val + self.buf.read(count - len(val))
+        return val
+
 
 def sendCommandToSensor(sensorId, command):
-    DataStreamSharedState.sendCommandToSensor(sensorId, command)
+    return SensorControl.sendCommandToSensor(sensorId, command)
 
 
-def runSensorCommandDispatchWorker(conn, sensorId):
-    soc = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    global memCache
-    memCache = MemCache()
-    port = memCache.getSensorArmPort(sensorId)
-    memCache.setStreamingCommandDispatcherPid(sensorId)
-    soc.bind(("localhost", port))
-    util.debugPrint("runSensorCommandDispatchWorker: port = " + str(port) + " pid " + str(os.getpid()))
-    try:
-        while True:
-            command, addr = soc.recvfrom(1024)
-            if command is None or command == "":
-                break
-            util.debugPrint("runSensorArmWorker: got a message " + str(
-                command))
-            conn.send(command.encode())
-            commandJson = json.loads(command)
-            if commandJson['command'] == 'retune' or commandJson[
-                    'command'] == 'exit':
-                break
-    finally:
-        util.debugPrint("runSensorCommandDispatchWorker: closing socket")
-        soc.close()
-        memCache.removeStreamingCommandDispatcherPid(sensorId)
-        time.sleep(1)
-        conn.close()
-        os._exit(0)
+def commandResponse(result):
+    """
+    The response of a sensorcontrol request from the outcome of the
+    command (see SensorControl.sendCommandToSensor).
+    """
+    if result["status"] in (SensorControl.DELIVERED, SensorControl.QUEUED):
+        return jsonify({STATUS: OK, "command": result})
+    else:
+        return jsonify({STATUS: NOK,
+                        ERROR_MESSAGE: "Command " + result["status"],
+                        "command": result})
 
 
 def workerProc(conn):
@@ -290,17 +345,17 @@ def dataStream(ws):
     readFromInput(bbuf, True)
 
 
-def signal_handler2(signo, frame):
-    if sensorCommandDispatcherPid is not None:
-        print "signal_handler2 "
-        os.kill(sensorCommandDispatcherPid, signal.SIGKILL)
-
-
 def readFromInput(bbuf, conn):
     util.debugPrint("DataStreaming:readFromInput")
-    soc = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sensorCommandDispatcherPid = None
+    commandChannel = None
     memCache = MemCache()
+    publisher = None
+    history = None
+    occupancyPublisher = None
+    recorder = None
+    recordingChecked = False
+    spool = None
+    connected = False
     try:
         while True:
             lengthString = ""
@@ -321,6 +376,19 @@ def readFromInput(bbuf, conn):
                 jsonStringBytes += str(bbuf.readChar())
 
             jsonData = json.loads(jsonStringBytes)
+            MESSAGES.inc()
+
+            # Compressed framing of the spectrums that follow a data message.
+            # Other sensors send the standard "Compression": "None". The
+            # message that is recorded and stored describes the decoded
+            # values.
+            compression = jsonData.get(STREAM_COMPRESSION)
+            if isinstance(compression, dict):
+                jsonData[STREAM_COMPRESSION] = "None"
+                jsonStringBytes = json.dumps(jsonData)
+                headerLength = len(jsonStringBytes)
+            else:
+                compression = None
 
             if not any(k in jsonData for k in (TYPE, SENSOR_ID, SENSOR_KEY)):
                 err = "Sensor Data Stream: Missing a required field"
@@ -340,10 +408,13 @@ def readFromInput(bbuf, conn):
 
             sensorKey = jsonData[SENSOR_KEY]
             if not authentication.authenticateSensor(sensorId, sensorKey):
-                util.debugPrint("jsonData " + json.dumps(jsonData,indent=4))
+                util.debugPrint(lambda: "jsonData " + json.dumps(jsonData, indent=4))
                 util.errorPrint("Sensor authentication failed: " + sensorId + " sensorKey " + sensorKey)
                 raise Exception("Authentication failure")
                 return
+            if not connected:
+                connected = True
+                SENSOR_CONNECTIONS.inc()
 
             if memCache.getStreamingServerPid(sensorId) == -1:
                 memCache.setStreamingServerPid(sensorId)
@@ -359,14 +430,7 @@ def readFromInput(bbuf, conn):
                     util.logStackTrace(sys.exc_info())
                     util.debugPrint("Problem killing process " + str(memCache.getStreamingServerPid(sensorId)))
 
-                if memCache.getStreamingCommandDispatcherPid(sensorId) != -1:
-                    try:
-                        os.kill(memCache.getStreamingCommandDispatcherPid(sensorId), signal.SIGKILL)
-                    except:
-                        memCache.removeStreamingCommandDispatcherPid(sensorId)
-                        util.debugPrint("Process not found. Proceeding ")
-
-            util.debugPrint("DataStreaming: Message = " + dumps(
+            util.debugPrint(lambda: "DataStreaming: Message = " + dumps(
                 jsonData, sort_keys=True, indent=4))
 
             sensorObj = SensorDb.getSensorObj(sensorId)
@@ -375,18 +439,36 @@ def readFromInput(bbuf, conn):
                 raise Exception("Streaming is not enabled")
                 return
 
+            # Record the raw stream if the admin turned recording on.
+            if not recordingChecked:
+                recordingChecked = True
+                settings = memCache.getStreamRecording(sensorId)
+                if settings is not None:
+                    recorder = StreamRecorder.StreamRecorder(
+                        sensorId, settings["fileSizeMB"], settings["maxFiles"])
+            if recorder is not None:
+                recorder.writeHeader(jsonData[TYPE], jsonStringBytes)
+
+            # Messages go to the database through the local spool so a slow
+            # or unavailable database does not hold up the stream.
+            if spool is None:
+                spool = IngestSpool.SpoolWriter(sensorId)
+
+            # Take over the commands for this sensor.
+            if commandChannel is None and isinstance(bbuf, BBuf):
+                commandChannel = SensorControl.CommandChannel(sensorId)
+                bbuf.setCommandChannel(commandChannel)
+                # This node owns the sensor now.
+                try:
+                    IngestRegistry.claimSensor(sensorId)
+                except:
+                    util.logStackTrace(sys.exc_info())
+
             # the last time a data message was inserted
             if jsonData[TYPE] == DATA:
-                util.debugPrint("pubsubPort: " + str(memCache.getPubSubPort(
-                    sensorId)))
                 if "Sys2Detect" not in jsonData:
                     jsonData[SYS_TO_DETECT] = "LTE"
                 DataMessage.init(jsonData)
-                t = Process(target=runSensorCommandDispatchWorker,
-                            args=(conn, sensorId))
-                t.start()
-                sensorCommandDispatcherPid = t.pid
-                childPids.append(sensorCommandDispatcherPid)
                 cutoff = DataMessage.getThreshold(jsonData)
                 n = DataMessage.getNumberOfFrequencyBins(jsonData)
                 sensorId = DataMessage.getSensorId(jsonData)
@@ -407,8 +489,8 @@ def readFromInput(bbuf, conn):
                 # Check if the time per measurement reported by the sensor
                 # matches that in the sensordb
                 timePerMeasurement = sensorObj.getStreamingSecondsPerFrame()
-                util.debugPrint("StreamingServer: timePerMeasurement " + str(
-                    timePerMeasurement))
+                util.debugPrint("StreamingServer: timePerMeasurement %s",
+                                timePerMeasurement)
                 if timePerMeasurement != DataMessage.getTimePerMeasurement(
                         jsonData):
                     err = "TimePerMeasurement mismatch "
@@ -424,18 +506,21 @@ def readFromInput(bbuf, conn):
                 # The number of measurements per capture
                 measurementsPerCapture = int(streamingSamplingIntervalSeconds /
                                              timePerMeasurement)
-                util.debugPrint("StreamingServer: measurementsPerCapture " +
-                                str(measurementsPerCapture))
+                util.debugPrint("StreamingServer: measurementsPerCapture %d",
+                                measurementsPerCapture)
 
                 # The number of power value samples per capture.
                 samplesPerCapture = int((streamingSamplingIntervalSeconds /
                                          timePerMeasurement) * n)
 
                 # The number of spectrums per frame sent to the browser.
+                # Each viewer can ask for fewer frames, in which case the
+                # spectrums are combined with the streaming filter and this
+                # is replaced in the copy of the message sent to the viewer.
                 spectrumsPerFrame = 1
                 jsonData[SPECTRUMS_PER_FRAME] = spectrumsPerFrame
 
-                # The streaming filter of the sensor (MAX_HOLD or AVG)
+                # The streaming filter of the sensor (MAX_HOLD or MEAN)
                 jsonData[STREAMING_FILTER] = sensorObj.getStreamingFilter()
 
                 # The band name sys2detect:minfreq:maxfreq string for the
@@ -446,13 +531,26 @@ def readFromInput(bbuf, conn):
                 # into the db
                 memCache.setLastDataMessage(sensorId, bandName,
                                             json.dumps(jsonData))
+                if publisher is not None:
+                    publisher.close()
+                publisher = StreamingFanout.FramePublisher(
+                    sensorId, bandName, memCache,
+                    sensorObj.getStreamingFilter())
+                publisherStatisticsTime = 0
+                # Occupancy changes go to the occupancy alert brokers.
+                if occupancyPublisher is None:
+                    occupancyPublisher = OccupancyFanout.OccupancyPublisher(
+                        sensorId)
+                # The last few minutes of spectrums, for back filling viewers.
+                if history is not None:
+                    history.close()
+                history = SpectrumHistory.SpectrumHistoryWriter(
+                    sensorId, bandName, n, timePerMeasurement)
                 # captureBufferCounter is a pointer into the capture buffer.
                 captureBufferCounter = 0
                 powerArrayCounter = 0
                 timingCounter = 0
 
-                # initialize the "prev occupancy array"
-                prevOccupancyArray = [-1 for i in range(0, n)]
                 occupancyArray = [0 for i in range(0, n)]
                 occupancyTimer = time.time()
                 if sensorId not in lastDataMessage:
@@ -470,19 +568,29 @@ def readFromInput(bbuf, conn):
                     raise Exception("Streaming is disabled")
                 enb = sensorObj.isStreamingCaptureEnabled()
                 isStreamingCaptureEnabled = enb
-                util.debugPrint("isStreamingCaptureEnabled : " + str(enb) + " samplesPerCapture " + str(samplesPerCapture))
+                util.debugPrint("StreamingServer: capture settings",
+                                isStreamingCaptureEnabled=enb,
+                                samplesPerCapture=samplesPerCapture)
                 if isStreamingCaptureEnabled:
                     sensorData = [0 for i in range(0, samplesPerCapture)]
 
+                # Where the power values come from.
+                if compression is not None:
+                    samples = StreamCompression.BlockReader(
+                        bbuf, n, StreamCompression.checkCompression(compression))
+                else:
+                    samples = bbuf
+
                 while True:
-                    data = bbuf.readByte()
+                    data = samples.readByte()
                     if isStreamingCaptureEnabled:
                         sensorData[captureBufferCounter] = data
                     powerVal[powerArrayCounter] = data
                     now = time.time()
                     if isStreamingCaptureEnabled and captureBufferCounter + 1 == samplesPerCapture:
                         # Buffer is full so push the data into mongod.
-                        util.debugPrint("Inserting Data message")
+                        util.debugPrintEvery(60, "Inserting Data message",
+                                             sensorId=sensorId)
                         captureBufferCounter = 0
                         # Time offset since the last data message was received.
                         timeOffset = time.time() - lastDataMessageReceivedAt[sensorId]
@@ -492,13 +600,13 @@ def readFromInput(bbuf, conn):
                         lastDataMessage[sensorId]["mPar"]["td"] = int(now - occupancyTimer)
                         lastDataMessage[sensorId]["mPar"]["tm"] = timePerMeasurement
                         headerStr = json.dumps(lastDataMessage[sensorId], indent=4)
-                        util.debugPrint("StreamingServer: headerStr " + headerStr)
+                        util.debugPrintEvery(60, "StreamingServer: headerStr %s",
+                                             headerStr)
                         headerLength = len(headerStr)
                         if isStreamingCaptureEnabled:
-                            # Start the db operation in a seperate process
-                            p = Process(target=populate_db.put_data, args=(headerStr, headerLength),
-                                        kwargs={"filedesc":None, "powers":sensorData})
-                            p.start()
+                            # The spool drainer inserts it into the db.
+                            spool.append(headerStr, headerLength, powers=sensorData)
+                            CAPTURES.inc()
                         lastDataMessageInsertedAt[sensorId] = time.time()
                         occupancyTimer = time.time()
                     else:
@@ -511,23 +619,24 @@ def readFromInput(bbuf, conn):
 
                     # print "occupancyArray", occupancyArray
                     if (powerArrayCounter + 1) == n:
-                        # Get the occupancy subscription counter.
-                        if memCache.getSubscriptionCount(sensorId) != 0:
-                            if not np.array_equal(occupancyArray,
-                                                  prevOccupancyArray):
-                                port = memCache.getPubSubPort(sensorId)
-                                soc.sendto(
-                                    json.dumps({sensorId: occupancyArray}),
-                                    ("localhost", port))
-                            prevOccupancyArray = np.array(occupancyArray)
-
-                        # sending data as CSV values to the browser
-                        listenerCount = memCache.getStreamingListenerCount(
-                            sensorId)
-                        if listenerCount > 0:
-                            sensordata = str(powerVal)[1:-1].replace(" ", "")
-                            memCache.setSensorData(sensorId, bandName,
-                                                   sensordata)
+                        # Send occupancy changes if a broker is running.
+                        occupancyPublisher.publish(occupancyArray, now)
+
+                        spectrum = np.array(powerVal, dtype=np.int8)
+                        SPECTRUMS.inc()
+                        history.append(now, spectrum)
+                        if recorder is not None:
+                            recorder.writeSpectrum(now, spectrum)
+                        # Push the spectrum to the web server workers that
+                        # have viewers for this band.
+                        publisher.publish(spectrum, now)
+                        if now - publisherStatisticsTime > PUBLISHER_STATISTICS_INTERVAL:
+                            memCache.setPublisherStatistics(
+                                sensorId, bandName, publisher.getStatistics())
+                            if compression is not None:
+                                memCache.setCompressionStatistics(
+                                    sensorId, samples.getStatistics())
+                            publisherStatisticsTime = now
                         # Record the occupancy for the measurements.
                         # Allow for 10% jitter.
                         if timingCounter == 1000 and checkForDataRate:
@@ -538,10 +647,6 @@ def readFromInput(bbuf, conn):
                                 raise Exception("Data coming in too fast - sensor configuration problem.")
                             else:
                                 startTime = now
-                        lastdataseen = now
-                        if listenerCount > 0:
-                            memCache.setLastDataSeenTimeStamp(
-                                sensorId, bandName, lastdataseen)
                         powerArrayCounter = 0
                     else:
                         powerArrayCounter = powerArrayCounter + 1
@@ -549,27 +654,39 @@ def readFromInput(bbuf, conn):
             elif jsonData[TYPE] == SYS:
                 util.debugPrint(
                     "DataStreaming: Got a System message -- adding to the database")
-                populate_db.put_data(jsonStringBytes, headerLength)
+                spool.append(jsonStringBytes, headerLength)
             elif jsonData[TYPE] == LOC:
                 util.debugPrint(
                     "DataStreaming: Got a Location Message -- adding to the database")
-                populate_db.put_data(jsonStringBytes, headerLength)
+                spool.append(jsonStringBytes, headerLength)
     finally:
         util.debugPrint("Closing sockets for sensorId " + sensorId)
         memCache.removeStreamingServerPid(sensorId)
-        port = memCache.getSensorArmPort(sensorId)
-        sendCommandToSensor(sensorId, json.dumps({"sensorId": sensorId,
-                                                  "command": "exit"}))
-        memCache.releaseSensorArmPort(sensorId)
+        if commandChannel is not None:
+            commandChannel.close()
+            try:
+                IngestRegistry.releaseSensor(sensorId)
+            except:
+                util.logStackTrace(sys.exc_info())
+            try:
+                bbuf.send(json.dumps({"sensorId": sensorId,
+                                      "command": "exit"}))
+            except:
+                util.debugPrint("Could not send exit to " + sensorId)
         bbuf.close()
-        time.sleep(1)
-        soc.close()
-        # kill the command dispatcher for good measure.
-        try:
-            if sensorCommandDispatcherPid is not None:
-                os.kill(sensorCommandDispatcherPid, signal.SIGKILL)
-        except:
-            util.debugPrint("Process not found. " + str(sensorCommandDispatcherPid))
+        if publisher is not None:
+            publisher.close()
+        if history is not None:
+            history.close()
+        if occupancyPublisher is not None:
+            occupancyPublisher.close()
+        if recorder is not None:
+            recorder.close()
+        if spool is not None:
+            spool.close()
+        if connected:
+            SENSOR_CONNECTIONS.dec()
+        Metrics.flush()
 
 
 def signal_handler(signo, frame):
@@ -577,7 +694,6 @@ def signal_handler(signo, frame):
     global mySensorId
     if mySensorId is not None:
         memCache.removeStreamingServerPid(mySensorId)
-        memCache.releaseSensorArmPort(mySensorId)
 
     for pid in childPids:
         try:
@@ -587,6 +703,11 @@ def signal_handler(signo, frame):
             print str(pid), "Not Found"
     if bbuf is not None:
         bbuf.close()
+    if os.getpid() == mainPid:
+        try:
+            IngestRegistry.unregisterNode()
+        except:
+            print "Could not unregister node"
 
 
 def handleSIGCHLD(signo, frame):
@@ -600,11 +721,25 @@ def handleSIGCHLD(signo, frame):
         index = index + 1
 
 
-def startStreamingServer(port):
+def getConnectedSensors():
+    """
+    The sensors connected to this node (for the registry heartbeat).
+    """
+    try:
+        status = SensorControl.getControlStatus()
+    except (socket.error, ValueError, KeyError):
+        return []
+    return [sensorId for sensorId in status if status[sensorId]["connected"]]
+
+
+def startStreamingServer(port, node):
     """
-    Start the streaming server and accept connections.
+    Start the streaming server and accept connections. node is the record
+    of this ingest node for the registry (see IngestRegistry).
     """
     global memCache
+    global mainPid
+    mainPid = os.getpid()
     if memCache is None:
         memCache = MemCache()
     soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -630,6 +765,27 @@ def startStreamingServer(port):
             util.debugPrint("DataStreaming: Bind failed - retry")
     if portAssigned:
         global occupancyQueue
+        # Replays the ingest spool into the database.
+        t = Process(target=IngestSpool.runDrainer)
+        t.start()
+        childPids.append(t.pid)
+        # Routes commands to the connected sensors.
+        controlKey = binascii.hexlify(os.urandom(16))
+        t = Process(target=SensorControl.runRouter,
+                    args=(node["controlPort"], controlKey))
+        t.start()
+        childPids.append(t.pid)
+        # Advertises this node to the other ones.
+        node["streamingPort"] = socketServerPort
+        node["controlKey"] = controlKey
+        t = Process(target=IngestRegistry.runHeartbeat,
+                    args=(node, getConnectedSensors))
+        t.start()
+        childPids.append(t.pid)
+        # Serves the metrics of the node on localhost.
+        t = Metrics.startMetricsServer()
+        if t is not None:
+            childPids.append(t.pid)
         socketServer = startSocketServer(soc, socketServerPort)
         socketServer.start()
     else:
@@ -637,6 +793,29 @@ def startStreamingServer(port):
             "DataStreaming: Streaming disabled on worker - no port found.")
 
 
+@app.route("/sensorcontrol/getStreamingCapabilities", methods=["GET"])
+def getStreamingCapabilities():
+    """
+    The compressed framing versions and codecs the streaming server accepts
+    (see services/common/StreamCompression.py). A sensor picks one and
+    declares it in the Compression field of its data message.
+
+    HTTP Return Codes:
+
+        - 200 OK: {"status": "OK", "compression": {"versions": {"1": [...]}}}
+
+    """
+    try:
+        return jsonify({STATUS: OK,
+                        "compression": StreamCompression.getCapabilities()})
+    except:
+        print "Unexpected error:", sys.exc_info()[0]
+        print sys.exc_info()
+        traceback.print_exc()
+        util.logStackTrace(sys.exc_info())
+        raise
+
+
 @app.route("/sensorcontrol/armSensor/<sensorId>", methods=["POST"])
 def armSensor(sensorId):
     """
@@ -681,9 +860,8 @@ def armSensor(sensorId):
             abort(404)
         if not sensorConfig.isStreamingEnabled():
             abort(400)
-        sendCommandToSensor(sensorId, json.dumps({"sensorId": sensorId,
-                                                  "command": "arm"}))
-        return jsonify({STATUS: OK})
+        return commandResponse(sendCommandToSensor(
+            sensorId, json.dumps({"sensorId": sensorId, "command": "arm"})))
     except:
         print "Unexpected error:", sys.exc_info()[0]
         print sys.exc_info()
@@ -736,9 +914,8 @@ def disarmSensor(sensorId):
             abort(404)
         if not sensorConfig.isStreamingEnabled():
             abort(400)
-        sendCommandToSensor(sensorId, json.dumps({"sensorId": sensorId,
-                                                  "command": "disarm"}))
-        return jsonify({STATUS: OK})
+        return commandResponse(sendCommandToSensor(
+            sensorId, json.dumps({"sensorId": sensorId, "command": "disarm"})))
     except:
         print "Unexpected error:", sys.exc_info()[0]
         print sys.exc_info()
@@ -799,9 +976,11 @@ def retuneSensor(sensorId, bandName):
             abort(400)
         band = SensorDb.getBand(sensorId, bandName)
         retval = SensorDb.activateBand(sensorId, bandName)
-        sendCommandToSensor(sensorId, json.dumps({"sensorId": sensorId,
-                                                  "command": "retune",
-                                                  "bandName": band}))
+        result = sendCommandToSensor(sensorId, json.dumps(
+            {"sensorId": sensorId,
+             "command": "retune",
+             "bandName": band}))
+        retval["command"] = result
         return jsonify(retval)
     except:
         print "Unexpected error:", sys.exc_info()[0]
@@ -858,9 +1037,8 @@ def disconnectSensor(sensorId):
             abort(404)
         if not sensorConfig.isStreamingEnabled():
             abort(400)
-        sendCommandToSensor(sensorId, json.dumps({"sensorId": sensorId,
-                                                  "command": "exit"}))
-        return jsonify({STATUS: OK})
+        return commandResponse(sendCommandToSensor(
+            sensorId, json.dumps({"sensorId": sensorId, "command": "exit"})))
     except:
         print "Unexpected error:", sys.exc_info()[0]
         print sys.exc_info()
@@ -890,8 +1068,8 @@ def runForensics(sensorId, algorithm, timestamp, sessionId):
                    "timestamp": int(timestamp),
                    "algorithm": algorithm,
                    "command": "analyze"}
-        sendCommandToSensor(sensorId, json.dumps(command))
-        return jsonify({STATUS: OK})
+        return commandResponse(sendCommandToSensor(sensorId,
+                                                   json.dumps(command)))
     except:
         print "Unexpected error:", sys.exc_info()[0]
         print sys.exc_info()
@@ -1045,9 +1223,9 @@ def postForensics(sensorId):
         raise
 
 
-def startWsgiServer():
+def startWsgiServer(wsgiPort):
     util.debugPrint("Starting WSGI server")
-    server = pywsgi.WSGIServer(('localhost', 8004), app)
+    server = pywsgi.WSGIServer(('localhost', wsgiPort), app)
     server.serve_forever()
 
 
@@ -1067,10 +1245,32 @@ if __name__ == '__main__':
                         default="spectrumbrowser")
     parser.add_argument("--port", help="Streaming Server Port", default="9000")
     parser.add_argument("--daemon", help="daemon flag", default="True")
+    parser.add_argument("--nodeId",
+                        help="Ingest node ID (default host name)",
+                        default=socket.gethostname())
+    parser.add_argument("--host",
+                        help="Host name of this node for the other hosts",
+                        default=None)
+    parser.add_argument("--controlPort",
+                        help="Sensor control port",
+                        default=str(SENSOR_CONTROL_PORT))
+    parser.add_argument("--alertPort",
+                        help="Occupancy alert port",
+                        default=str(OCCUPANCY_ALERT_PORT))
+    parser.add_argument("--webUrl",
+                        help="URL of the web server of this node",
+                        default=None)
+    parser.add_argument("--wsgiPort", help="WSGI Server Port", default="8004")
 
     args = parser.parse_args()
     isDaemon = args.daemon == "True"
     port = int(args.port)
+    IngestRegistry.setLocalNodeId(args.nodeId)
+    Metrics.setService("streaming")
+    node = {"host": args.host,
+            "controlPort": int(args.controlPort),
+            "alertPort": int(args.alertPort),
+            "webUrl": args.webUrl}
     logger = logging.getLogger()
     logger.setLevel(logging.DEBUG)
     fh = logging.FileHandler(args.logfile)
@@ -1078,7 +1278,7 @@ if __name__ == '__main__':
 
     util.debugPrint(">>>>> Starting Streaming Server <<<<< ")
 
-    t = Process(target=startWsgiServer)
+    t = Process(target=startWsgiServer, args=(int(args.wsgiPort), ))
     t.start()
 
     if isDaemon:
@@ -1108,7 +1308,7 @@ if __name__ == '__main__':
         context.pidfile = daemon.pidfile.TimeoutPIDLockFile(args.pidfile)
         with context:
             print "Starting streaming server"
-            startStreamingServer(port)
+            startStreamingServer(port, node)
     else:
         with util.pidfile(args.pidfile):
-            startStreamingServer(port)
+            startStreamingServer(port, node)
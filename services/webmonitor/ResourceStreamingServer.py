@@ -40,12 +40,21 @@ import netifaces
 import Log
 import time
 import MemCacheKeys
+import Metrics
 import logging
 import pwd
 import os
 
 memCache = None
 
+CPU = Metrics.gauge("cpu_percent", "CPU usage of the host.")
+VIRTUAL_MEMORY = Metrics.gauge("virtual_memory_percent",
+                               "Virtual memory usage of the host.")
+NET_SENT = Metrics.gauge("net_sent_bytes_per_second",
+                         "Bytes sent on the monitored interface.")
+NET_RECV = Metrics.gauge("net_recv_bytes_per_second",
+                         "Bytes received on the monitored interface.")
+
 
 def readResourceUsage():
     util.debugPrint("ResourceStreaming:dataFromStreamingServer_PID")
@@ -143,6 +152,10 @@ def readResourceUsage():
                         MemCacheKeys.RESOURCEKEYS_NET_SENT, netSentValue)
                     memCache.setResourceData(
                         MemCacheKeys.RESOURCEKEYS_NET_RECV, netRecvValue)
+                    CPU.set(cpuValue)
+                    VIRTUAL_MEMORY.set(vmemValue)
+                    NET_SENT.set(netSentValue)
+                    NET_RECV.set(netRecvValue)
 
                     break
 
@@ -161,6 +174,8 @@ def startStreamingServer():
     global memCache
     if memCache is None:
         memCache = MemCache()
+    Metrics.setService("monitoring")
+    Metrics.startMetricsServer()
 
     readResourceUsage()
 
@@ -0,0 +1,433 @@
+#! /usr/local/bin/python2.7
+# -*- coding: utf-8 -*-
+#
+#This software was developed by employees of the National Institute of
+#Standards and Technology (NIST), and others.
+#This software has been contributed to the public domain.
+#Pursuant to title 15 Untied States Code Section 105, works of NIST
+#employees are not subject to copyright protection in the United States
+#and are considered to be in the public domain.
+#As a result, a formal license is not needed to use this software.
+#
+#This software is provided "AS IS."
+#NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+#OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+#AND DATA ACCURACY.  NIST does not warrant or make any representations
+#regarding the use of the software or the results thereof, including but
+#not limited to the correctness, accuracy, reliability or usefulness of
+#this software.
+'''
+Sensor stream load generator.
+
+Simulates sensors streaming to the StreamingServer with the real sensor
+protocol: the location, system and data messages (each as its length and
+the JSON) followed by int8 power values, n per spectrum, at the rate set
+in the sensor configuration (streamingSecondsPerFrame). The spectrums come
+from a recorded .dat file or are synthesized with a given number of bins.
+With -compression the spectrums are sent in compressed blocks of
+-blockSpectrums (see services/common/StreamCompression.py).
+
+Every simulated sensor needs a configured sensor with streaming enabled;
+-create adds them (copies of a sensor configuration file with SensorIDs
+<prefix>0 .. <prefix>M-1) through the admin API and -purge removes them.
+
+Sensors are greenlets spread over -processes processes. Prints one JSON
+document with the per sensor results when done:
+
+    python SensorLoadGenerator.py -url https://localhost:8443 -create \
+        -template E6R16W5XS.config.json -prefix LOAD -sensors 20 \
+        -rate 10 -bins 1024 -duration 60 -purge
+'''
+import argparse
+import copy
+import json
+import sys
+import time
+import traceback
+from multiprocessing import Process, Queue
+import urlparse
+import numpy as np
+import requests
+import gevent
+from gevent import socket
+from gevent import ssl
+
+# Spectrums sent in one write at most when a sensor is behind schedule.
+MAX_SPECTRUMS_PER_WRITE = 100
+
+# Distinct synthetic spectrums generated per sensor (then repeated).
+SYNTHETIC_SPECTRUMS = 1000
+
+LOCATION_MESSAGE = {"Ver": "1.0.12", "Type": "Loc", "Mobility": "Stationary",
+                    "Lat": 39.134375, "Lon": -77.215337, "Alt": 143.5,
+                    "TimeZone": "America/New_York"}
+
+SYSTEM_MESSAGE = {"Ver": "1.0.12", "Type": "Sys", "Cal": "N/A",
+                  "Antenna": {"Model": "Unknown (whip)", "fLow": "NaN",
+                              "fHigh": "NaN", "gAnt": 2.0, "bwH": 360.0,
+                              "bwV": "NaN", "Pol": "VL", "XSD": "NaN",
+                              "VSWR": "NaN", "lCable": 0.5, "phi": 0.0,
+                              "theta": "N/A"},
+                  "Preselector": {"fLowPassBPF": "NaN", "fHighPassBPF": "NaN",
+                                  "fLowStopBPF": "NaN", "fHighStopBPF": "NaN",
+                                  "fnLNA": "NaN", "gLNA": "NaN",
+                                  "pMaxLNA": "NaN", "enrND": "NaN"},
+                  "COTSsensor": {"Model": "Load generator", "fMin": 4.0e8,
+                                 "fMax": 4.4e9, "fn": 5.0, "pMax": -10.0}}
+
+DATA_MESSAGE = {"Ver": "1.0.12", "Type": "Data", "Sys2Detect": "LTE",
+                "mType": "FFT-Power", "DataType": "Binary - int8",
+                "ByteOrder": "N/A", "Compression": "None", "Processed": "False",
+                "nM": 1800000, "Ta": 3600.0, "OL": "NaN", "wnI": -77.0,
+                "Comment": "Load generator",
+                "mPar": {"td": 1800.0, "Det": "Average", "Atten": 38.0}}
+
+
+def readRecording(fileName):
+    """
+    Returns the three messages of a recorded sensor stream and its power
+    values as a (count x n) int8 array.
+    """
+    headers = []
+    with open(fileName, "rb") as f:
+        for i in range(0, 3):
+            lengthString = ""
+            while True:
+                c = f.read(1)
+                if c == "\r":
+                    break
+                lengthString = lengthString + c
+            headers.append(json.loads(f.read(int(lengthString))))
+        data = np.frombuffer(f.read(), dtype=np.int8)
+    n = [int(h["mPar"]["n"]) for h in headers if h["Type"] == "Data"][0]
+    count = len(data) // n
+    return headers, data[:count * n].reshape((count, n))
+
+
+def syntheticSpectrums(n, count=SYNTHETIC_SPECTRUMS, seed=0):
+    """
+    Noise with a few bursts of signal, as int8 dBm.
+    """
+    rng = np.random.RandomState(seed)
+    spectrums = rng.normal(-110, 3, (count, n))
+    for i in range(0, count):
+        for burst in range(0, rng.randint(0, 4)):
+            start = rng.randint(0, n)
+            spectrums[i, start:start + rng.randint(1, max(2, n // 8))] = \
+                rng.normal(-60, 5)
+    return np.clip(spectrums, -128, 127).astype(np.int8)
+
+
+def getSensorConfig(serverUrl, sensorId):
+    r = requests.post(serverUrl + "/sensordb/getSensorConfig/" + sensorId,
+                      verify=False)
+    retval = r.json()
+    if retval["status"] != "OK":
+        raise Exception(sensorId + ": " + str(retval))
+    return retval["sensorConfig"]
+
+
+def getStreamingAddress(serverUrl, sensorId):
+    """
+    The host and port of the ingest node the sensor should stream to.
+    """
+    r = requests.post(serverUrl + "/sensordata/getStreamingPort/" + sensorId,
+                      verify=False)
+    retval = r.json()
+    host = retval.get("host", urlparse.urlsplit(serverUrl).hostname)
+    return (host, int(retval["port"]))
+
+
+def getActiveBand(sensorConfig):
+    for band in sensorConfig["thresholds"].values():
+        if band["active"]:
+            return band
+    raise Exception("No active band for " + sensorConfig["SensorID"])
+
+
+def makeHeaders(sensorId, sensorKey, sensorConfig, n, recorded=None):
+    """
+    The location, system and data messages for a simulated sensor, taken
+    from a recording (recorded) or the templates above.
+    """
+    if recorded is None:
+        headers = [copy.deepcopy(LOCATION_MESSAGE),
+                   copy.deepcopy(SYSTEM_MESSAGE), copy.deepcopy(DATA_MESSAGE)]
+    else:
+        headers = copy.deepcopy(recorded)
+    band = getActiveBand(sensorConfig)
+    now = int(time.time())
+    for header in headers:
+        header["SensorID"] = sensorId
+        header["SensorKey"] = sensorKey
+        header["t"] = now
+        if header["Type"] == "Data":
+            header["t1"] = now
+            header["Sys2Detect"] = band["systemToDetect"]
+            header["mPar"]["n"] = n
+            header["mPar"]["fStart"] = band["minFreqHz"]
+            header["mPar"]["fStop"] = band["maxFreqHz"]
+            header["mPar"]["tm"] = float(sensorConfig["streaming"][
+                "streamingSecondsPerFrame"])
+    return headers
+
+
+class SimulatedSensor:
+    def __init__(self, serverUrl, sensorId, sensorKey, spectrums,
+                 recorded=None, compression=None, blockSpectrums=1):
+        self.serverUrl = serverUrl
+        self.sensorId = sensorId
+        self.sensorKey = sensorKey
+        self.spectrums = spectrums
+        self.recorded = recorded
+        self.compression = compression
+        self.blockSpectrums = blockSpectrums
+        self.sent = 0
+        self.bytesSent = 0
+        self.maxBehind = 0
+        self.error = None
+
+    def connect(self):
+        parsedUrl = urlparse.urlsplit(self.serverUrl)
+        sock = socket.create_connection(
+            getStreamingAddress(self.serverUrl, self.sensorId))
+        if parsedUrl.scheme == "https":
+            sock = ssl.wrap_socket(sock)
+        return sock
+
+    def run(self, duration):
+        sock = None
+        try:
+            sensorConfig = getSensorConfig(self.serverUrl, self.sensorId)
+            interval = float(sensorConfig["streaming"][
+                "streamingSecondsPerFrame"])
+            (count, n) = self.spectrums.shape
+            sock = self.connect()
+            for header in makeHeaders(self.sensorId, self.sensorKey,
+                                      sensorConfig, n, self.recorded):
+                if header["Type"] == "Data" and self.compression is not None:
+                    header["Compression"] = {
+                        "ver": StreamCompression.COMPRESSION_VERSION,
+                        "codec": self.compression}
+                toSend = json.dumps(header)
+                sock.sendall(str(len(toSend)) + "\n" + toSend)
+            startTime = time.time()
+            while time.time() - startTime < duration:
+                due = int((time.time() - startTime) / interval) + 1
+                self.maxBehind = max(self.maxBehind, due - self.sent - 1)
+                batch = min(due - self.sent,
+                            max(MAX_SPECTRUMS_PER_WRITE, self.blockSpectrums))
+                # Whole blocks only.
+                batch = batch - batch % self.blockSpectrums
+                if batch > 0:
+                    indexes = np.arange(self.sent, self.sent + batch) % count
+                    if self.compression is None:
+                        data = self.spectrums[indexes].tostring()
+                    else:
+                        data = "".join(
+                            [StreamCompression.encodeBlock(
+                                self.compression,
+                                self.spectrums[indexes[i:i + self.blockSpectrums]])
+                             for i in range(0, batch, self.blockSpectrums)])
+                    sock.sendall(data)
+                    self.sent = self.sent + batch
+                    self.bytesSent = self.bytesSent + len(data)
+                nextDue = self.sent + self.blockSpectrums - 1
+                gevent.sleep(max(0, startTime + nextDue * interval -
+                                 time.time()))
+        except Exception as e:
+            traceback.print_exc()
+            self.error = str(e)
+        finally:
+            if sock is not None:
+                sock.close()
+
+    def getResult(self):
+        return {"sensorId": self.sensorId,
+                "spectrums": self.sent,
+                "bytes": self.bytesSent,
+                "maxSpectrumsBehind": self.maxBehind,
+                "error": self.error}
+
+
+def runSensors(serverUrl, sensorIds, sensorKey, dataFile, bins, duration,
+               results, compression=None, blockSpectrums=1):
+    gevent.reinit()
+    if compression is not None:
+        # The codecs are those of the server.
+        global StreamCompression
+        import BootstrapPythonPath
+        BootstrapPythonPath.setPath()
+        import StreamCompression
+    recorded = None
+    if dataFile is not None:
+        (recorded, spectrums) = readRecording(dataFile)
+    sensors = []
+    for sensorId in sensorIds:
+        if dataFile is None:
+            spectrums = syntheticSpectrums(bins, seed=hash(sensorId) % 65536)
+        sensors.append(SimulatedSensor(serverUrl, sensorId, sensorKey,
+                                       spectrums, recorded, compression,
+                                       blockSpectrums))
+    gevent.joinall([gevent.spawn(sensor.run, duration) for sensor in sensors])
+    for sensor in sensors:
+        results.put(sensor.getResult())
+
+
+def startLoad(serverUrl, sensorIds, duration, dataFile=None, bins=1024,
+              sensorKey="NaN", processes=4, compression=None,
+              blockSpectrums=1):
+    """
+    Start streaming from the sensors in the background. Returns a function
+    that waits for the end of the run and returns the per sensor results.
+    """
+    results = Queue()
+    workers = []
+    for p in range(0, processes):
+        mine = sensorIds[p::processes]
+        if len(mine) == 0:
+            continue
+        worker = Process(target=runSensors,
+                         args=(serverUrl, mine, sensorKey, dataFile, bins,
+                               duration, results, compression,
+                               blockSpectrums))
+        worker.start()
+        workers.append(worker)
+
+    def wait():
+        retval = [results.get() for sensorId in sensorIds]
+        for worker in workers:
+            worker.join()
+        return retval
+
+    return wait
+
+
+def adminLogin(serverUrl, emailAddress, password):
+    params = {"emailAddress": emailAddress,
+              "password": password,
+              "privilege": "admin"}
+    r = requests.post(serverUrl + "/admin/authenticate",
+                      data=json.dumps(params),
+                      verify=False)
+    return r.json()["sessionId"]
+
+
+def adminLogout(serverUrl, sessionId):
+    requests.post(serverUrl + "/admin/logOut/" + sessionId, verify=False)
+
+
+def createSensors(serverUrl, sessionId, templateFile, sensorIds,
+                  secondsPerSpectrum=None, capture=False):
+    """
+    Add copies of the sensor configuration in templateFile with the given
+    sensor IDs (streaming enabled, optionally at another rate and with
+    streaming capture).
+    """
+    template = json.load(open(templateFile))
+    for sensorId in sensorIds:
+        sensorConfig = copy.deepcopy(template)
+        sensorConfig["SensorID"] = sensorId
+        sensorConfig["isStreamingEnabled"] = True
+        sensorConfig["streaming"]["enableStreamingCapture"] = capture
+        if secondsPerSpectrum is not None:
+            sensorConfig["streaming"]["streamingSecondsPerFrame"] = \
+                secondsPerSpectrum
+        r = requests.post(serverUrl + "/admin/addSensor/" + sessionId,
+                          data=json.dumps(sensorConfig),
+                          verify=False)
+        if r.status_code != 200:
+            raise Exception("addSensor failed for " + sensorId)
+
+
+def purgeSensors(serverUrl, sessionId, sensorIds):
+    for sensorId in sensorIds:
+        requests.post(serverUrl + "/admin/purgeSensor/" + sensorId + "/" +
+                      sessionId,
+                      verify=False)
+
+
+def addArguments(parser):
+    parser.add_argument("-url", help="Server base URL",
+                        default="https://localhost:8443")
+    parser.add_argument("-sensorIds",
+                        help="Comma separated IDs of configured sensors")
+    parser.add_argument("-prefix", help="Sensor ID prefix", default="LOAD")
+    parser.add_argument("-sensors", help="Number of sensors", type=int,
+                        default=1)
+    parser.add_argument("-sensorKey", help="Sensor key", default="NaN")
+    parser.add_argument("-data", help="Recorded .dat file (else synthetic)")
+    parser.add_argument("-bins", help="Synthetic bins per spectrum",
+                        type=int, default=1024)
+    parser.add_argument("-rate", help="Spectrums per second of created sensors",
+                        type=float)
+    parser.add_argument("-duration", help="Seconds to stream", type=float,
+                        default=60.0)
+    parser.add_argument("-processes", help="Generator processes", type=int,
+                        default=4)
+    parser.add_argument("-compression",
+                        help="Send compressed blocks (zlib or delta-zlib)")
+    parser.add_argument("-blockSpectrums", help="Spectrums per compressed block",
+                        type=int, default=1)
+    parser.add_argument("-create", help="Create the sensors",
+                        dest="create", action="store_true")
+    parser.add_argument("-purge", help="Purge the sensors afterwards",
+                        dest="purge", action="store_true")
+    parser.add_argument("-capture", help="Enable streaming capture",
+                        dest="capture", action="store_true")
+    parser.add_argument("-template", help="Sensor configuration to copy",
+                        default="E6R16W5XS.config.json")
+    parser.add_argument("-adminEmail", help="Admin email address",
+                        default="admin@nist.gov")
+    parser.add_argument("-adminPassword", help="Admin password",
+                        default="Administrator12!")
+    parser.set_defaults(create=False, purge=False, capture=False)
+
+
+def getSensorIds(args):
+    if args.sensorIds is not None:
+        return args.sensorIds.split(",")
+    return [args.prefix + str(i) for i in range(0, args.sensors)]
+
+
+def setUpSensors(args, sensorIds):
+    """
+    Create the sensors if asked to. Returns the admin session (or None).
+    """
+    if not args.create and not args.purge:
+        return None
+    sessionId = adminLogin(args.url, args.adminEmail, args.adminPassword)
+    if args.create:
+        secondsPerSpectrum = None
+        if args.rate is not None:
+            secondsPerSpectrum = 1.0 / args.rate
+        createSensors(args.url, sessionId, args.template, sensorIds,
+                      secondsPerSpectrum, args.capture)
+    return sessionId
+
+
+def tearDownSensors(args, sessionId, sensorIds):
+    if sessionId is None:
+        return
+    if args.purge:
+        purgeSensors(args.url, sessionId, sensorIds)
+    adminLogout(args.url, sessionId)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process command line args")
+    addArguments(parser)
+    args = parser.parse_args()
+    sensorIds = getSensorIds(args)
+    sessionId = setUpSensors(args, sensorIds)
+    try:
+        wait = startLoad(args.url, sensorIds, args.duration, args.data,
+                         args.bins, args.sensorKey, args.processes,
+                         args.compression, args.blockSpectrums)
+        print json.dumps({"sensors": wait()}, indent=4)
+    except:
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        tearDownSensors(args, sessionId, sensorIds)
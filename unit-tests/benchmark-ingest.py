@@ -0,0 +1,245 @@
+#! /usr/local/bin/python2.7
+# -*- coding: utf-8 -*-
+#
+#This software was developed by employees of the National Institute of
+#Standards and Technology (NIST), and others.
+#This software has been contributed to the public domain.
+#Pursuant to title 15 Untied States Code Section 105, works of NIST
+#employees are not subject to copyright protection in the United States
+#and are considered to be in the public domain.
+#As a result, a formal license is not needed to use this software.
+#
+#This software is provided "AS IS."
+#NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+#OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+#AND DATA ACCURACY.  NIST does not warrant or make any representations
+#regarding the use of the software or the results thereof, including but
+#not limited to the correctness, accuracy, reliability or usefulness of
+#this software.
+'''
+Ingest (StreamingServer) throughput benchmark.
+
+Drives the streaming server with SensorLoadGenerator for each of the
+-sensorCounts and, from the server host, samples the streaming server
+process of every sensor while it runs:
+
+    - samplesPerSecond: power values ingested per second by the server,
+      from the count of spectrums in its recent history (SpectrumHistory).
+    - cpuPerSensor / rssPerSensorMB: CPU (% of one core) and resident
+      memory of the streaming server processes, from /proc.
+    - captureInsertLag: seconds between the time stamp of a streaming
+      capture and it becoming visible in mongod (needs -capture, one
+      second resolution).
+    - bytesPerSpectrum, compressionRatio, decodeMicrosPerSpectrum: bytes
+      on the wire and, with -compression, the ratio and decode cost
+      reported by the server.
+
+Must run on the server host. Writes one JSON document per run (one per
+line) to -out:
+
+    python benchmark-ingest.py -create -purge -capture -rate 10 -bins 1024 \
+        -sensors 50 -sensorCounts 1,10,50 -duration 60
+'''
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+import numpy as np
+import BootstrapPythonPath
+BootstrapPythonPath.setPath()
+import SensorLoadGenerator
+import SpectrumHistory
+import DbCollections
+import msgutils
+import pymongo
+from DataStreamSharedState import MemCache
+from Defines import TIME
+
+# Seconds between samples of the server.
+SAMPLE_INTERVAL = 1.0
+
+# Seconds to wait for the server to close the connections of a run.
+SETTLE_SECONDS = 5
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def getCpuSeconds(pid):
+    try:
+        with open("/proc/" + str(pid) + "/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except IOError:
+        return None
+    # utime and stime are fields 14 and 15 of stat (12 and 13 here).
+    return (int(fields[11]) + int(fields[12])) / float(CLOCK_TICKS)
+
+
+def getRssMB(pid):
+    try:
+        with open("/proc/" + str(pid) + "/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    return None
+
+
+def getLastCaptureTime(sensorId):
+    cur = DbCollections.getDataMessages(sensorId).find().sort(
+        TIME, pymongo.DESCENDING).limit(1)
+    for dataMessage in cur:
+        return dataMessage[TIME]
+    return None
+
+
+class SensorSampler:
+    """
+    Samples the server side of one simulated sensor.
+    """
+
+    def __init__(self, url, sensorId, memCache):
+        self.sensorId = sensorId
+        self.memCache = memCache
+        band = SensorLoadGenerator.getActiveBand(
+            SensorLoadGenerator.getSensorConfig(url, sensorId))
+        self.bandName = msgutils.freqRange(band["systemToDetect"],
+                                           band["minFreqHz"],
+                                           band["maxFreqHz"])
+        self.lastCaptureTime = getLastCaptureTime(sensorId)
+        self.captureLags = []
+        self.compression = None
+        self.rss = []
+        self.start = None
+        self.end = None
+
+    def sample(self):
+        now = time.time()
+        pid = self.memCache.getStreamingServerPid(self.sensorId)
+        count = SpectrumHistory.getHistoryCount(self.sensorId, self.bandName)
+        cpu = getCpuSeconds(pid) if pid != -1 else None
+        if count is not None and cpu is not None:
+            if self.start is None:
+                self.start = (now, count, cpu)
+            self.end = (now, count, cpu)
+            rss = getRssMB(pid)
+            if rss is not None:
+                self.rss.append(rss)
+        compression = self.memCache.getCompressionStatistics(self.sensorId)
+        if compression is not None:
+            self.compression = compression
+        captureTime = getLastCaptureTime(self.sensorId)
+        if captureTime is not None and captureTime != self.lastCaptureTime:
+            self.captureLags.append(now - captureTime)
+            self.lastCaptureTime = captureTime
+
+    def getResult(self):
+        if self.start is None or self.end[0] == self.start[0]:
+            return None
+        elapsed = self.end[0] - self.start[0]
+        return {"spectrumsPerSecond": (self.end[1] - self.start[1]) / elapsed,
+                "cpu": 100.0 * (self.end[2] - self.start[2]) / elapsed,
+                "rssMB": max(self.rss)}
+
+
+def percentiles(values):
+    if len(values) == 0:
+        return None
+    values = np.array(values)
+    return {"p50": np.percentile(values, 50),
+            "p99": np.percentile(values, 99),
+            "max": values.max()}
+
+
+def runBenchmark(args, sensorIds, memCache):
+    samplers = [SensorSampler(args.url, sensorId, memCache)
+                for sensorId in sensorIds]
+    wait = SensorLoadGenerator.startLoad(args.url, sensorIds, args.duration,
+                                         args.data, args.bins, args.sensorKey,
+                                         args.processes, args.compression,
+                                         args.blockSpectrums)
+    # Leave time to connect before sampling.
+    time.sleep(args.warmup)
+    endTime = time.time() + args.duration - args.warmup
+    while time.time() < endTime:
+        for sampler in samplers:
+            sampler.sample()
+        time.sleep(SAMPLE_INTERVAL)
+    generated = wait()
+    time.sleep(SETTLE_SECONDS)
+
+    results = [sampler.getResult() for sampler in samplers]
+    measured = [r for r in results if r is not None]
+    captureLags = []
+    for sampler in samplers:
+        captureLags.extend(sampler.captureLags)
+    if args.data is not None:
+        n = SensorLoadGenerator.readRecording(args.data)[1].shape[1]
+    else:
+        n = args.bins
+    spectrumsPerSecond = sum([r["spectrumsPerSecond"] for r in measured])
+    spectrumsSent = sum([g["spectrums"] for g in generated])
+    compression = [sampler.compression for sampler in samplers
+                   if sampler.compression is not None]
+    retval = {"sensors": len(sensorIds),
+              "measuredSensors": len(measured),
+              "bins": n,
+              "duration": args.duration,
+              "spectrumsSent": spectrumsSent,
+              "bytesPerSpectrum": sum([g["bytes"] for g in generated]) /
+              float(max(spectrumsSent, 1)),
+              "compression": args.compression,
+              "generatorErrors": len([g for g in generated
+                                      if g["error"] is not None]),
+              "maxSpectrumsBehind": max([g["maxSpectrumsBehind"]
+                                         for g in generated]),
+              "spectrumsPerSecond": spectrumsPerSecond,
+              "samplesPerSecond": spectrumsPerSecond * n,
+              "captureInsertLag": percentiles(captureLags)}
+    if len(compression) != 0:
+        retval["compressionRatio"] = np.mean(
+            [c["ratio"] for c in compression if c["ratio"] is not None])
+        retval["decodeMicrosPerSpectrum"] = np.mean(
+            [c["decodeMicrosPerSpectrum"] for c in compression
+             if c["decodeMicrosPerSpectrum"] is not None])
+    if len(measured) != 0:
+        retval["cpuPerSensor"] = np.mean([r["cpu"] for r in measured])
+        retval["rssPerSensorMB"] = np.mean([r["rssMB"] for r in measured])
+        retval["rssTotalMB"] = sum([r["rssMB"] for r in measured])
+    return retval
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process command line args")
+    SensorLoadGenerator.addArguments(parser)
+    parser.add_argument("-sensorCounts",
+                        help="Comma separated sensor counts (at most -sensors)")
+    parser.add_argument("-warmup", help="Seconds before sampling", type=float,
+                        default=5.0)
+    parser.add_argument("-out", help="Results file (JSON lines)",
+                        default="ingest-benchmark.json")
+    args = parser.parse_args()
+    sensorIds = SensorLoadGenerator.getSensorIds(args)
+    if args.sensorCounts is None:
+        sensorCounts = [len(sensorIds)]
+    else:
+        sensorCounts = [int(s) for s in args.sensorCounts.split(",")]
+    sessionId = SensorLoadGenerator.setUpSensors(args, sensorIds)
+    memCache = MemCache()
+    try:
+        with open(args.out, "a") as out:
+            for sensorCount in sensorCounts:
+                result = runBenchmark(args, sensorIds[0:sensorCount],
+                                      memCache)
+                result["time"] = time.time()
+                print json.dumps(result)
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+    except:
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        SensorLoadGenerator.tearDownSensors(args, sessionId, sensorIds)
@@ -0,0 +1,2 @@
+echo "Ingest throughput benchmark - run on the server host. Results are appended to ingest-benchmark.json"
+python benchmark-ingest.py -url https://localhost:8443 -create -purge -capture -template E6R16W5XS.config.json -prefix LOAD -sensors 20 -sensorCounts 1,5,20 -rate 10 -bins 1024 -duration 60
@@ -0,0 +1,274 @@
+#! /usr/local/bin/python2.7
+# -*- coding: utf-8 -*-
+#
+#This software was developed by employees of the National Institute of
+#Standards and Technology (NIST), and others.
+#This software has been contributed to the public domain.
+#Pursuant to title 15 Untied States Code Section 105, works of NIST
+#employees are not subject to copyright protection in the United States
+#and are considered to be in the public domain.
+#As a result, a formal license is not needed to use this software.
+#
+#This software is provided "AS IS."
+#NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+#OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+#AND DATA ACCURACY.  NIST does not warrant or make any representations
+#regarding the use of the software or the results thereof, including but
+#not limited to the correctness, accuracy, reliability or usefulness of
+#this software.
+'''
+Occupancy alert latency and throughput benchmark.
+
+Starts local occupancy alert brokers (OccupancyAlert.runBroker) and sensor
+replay processes that read a recorded sensor stream, threshold it and
+publish the occupancy changes with OccupancyPublisher exactly as the
+streaming server does, then attaches subscribers speaking protocol
+version 2 and measures the latency of every alert (receive time minus the
+source timestamp).
+
+Nothing here needs memcache, mongod or a configured web server: the
+streaming server is replaced by the replay processes, which only differ
+from it in not authenticating the sensor or writing captures.
+
+Runs every combination of the -sensors and -subscribers lists and writes
+one JSON document per run (one per line) to -out:
+
+    python benchmark-occupancy-alert.py -sensors 1,10 -subscribers 10,100,1000
+'''
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+import gevent
+from gevent import socket
+from multiprocessing import Process, Queue
+import numpy as np
+import BootstrapPythonPath
+BootstrapPythonPath.setPath()
+sys.path.append(BootstrapPythonPath.getSbHome() + "/services/occupancy")
+import OccupancyFanout
+import OccupancyAlert
+
+# Seconds allowed for the subscribers to connect before measuring.
+WARMUP_SECONDS = 2
+
+# Seconds after the sensors stop for the last alerts to arrive.
+DRAIN_SECONDS = 2
+
+
+def readRecording(fileName):
+    """
+    Read a recorded sensor stream (the location, system and data messages
+    as <length>\\r<json> followed by the int8 power values). Returns
+    (n, spectrums) with spectrums a (count x n) int8 array.
+    """
+    with open(fileName, "rb") as f:
+        n = None
+        for i in range(0, 3):
+            lengthString = ""
+            while True:
+                c = f.read(1)
+                if c == "\r":
+                    break
+                lengthString = lengthString + c
+            header = json.loads(f.read(int(lengthString)))
+            if header["Type"] == "Data":
+                n = int(header["mPar"]["n"])
+        data = np.frombuffer(f.read(), dtype=np.int8)
+    count = len(data) // n
+    return n, data[:count * n].reshape((count, n))
+
+
+def replaySensor(sensorId, fileName, rate, threshold, duration, results):
+    """
+    Publish the occupancy of the recorded spectrums at rate spectrums per
+    second for duration seconds, looping over the recording.
+    """
+    (n, spectrums) = readRecording(fileName)
+    publisher = OccupancyFanout.OccupancyPublisher(sensorId)
+    startTime = time.time()
+    count = 0
+    try:
+        while True:
+            now = time.time()
+            if now - startTime > duration:
+                break
+            occupancy = spectrums[count % len(spectrums)] > threshold
+            publisher.publish(occupancy, now)
+            count = count + 1
+            delay = startTime + count / rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+    finally:
+        results.put({"sensorId": sensorId,
+                     "spectrums": count,
+                     "published": publisher.published,
+                     "dropped": publisher.dropped})
+        publisher.close()
+
+
+def runSubscribers(port, sensorIds, measureFrom, stopAt, results):
+    """
+    Open one protocol version 2 subscription per entry of sensorIds and
+    record the latency of the alerts sent after measureFrom.
+    """
+    gevent.reinit()
+    latencies = []
+    errors = []
+
+    def subscribe(sensorId):
+        sock = socket.create_connection(("127.0.0.1", port))
+        try:
+            sock.sendall(OccupancyFanout.packSubscription(sensorId))
+            decoder = OccupancyFanout.AlertDecoder()
+            while True:
+                (seq, timestamp, occupancy) = decoder.read(sock)
+                if timestamp >= measureFrom:
+                    latencies.append(time.time() - timestamp)
+        except Exception as e:
+            errors.append(str(e))
+        finally:
+            sock.close()
+
+    greenlets = [gevent.spawn(subscribe, sensorId) for sensorId in sensorIds]
+    gevent.sleep(max(0, stopAt - time.time()))
+    gevent.killall(greenlets, block=False)
+    results.put({"latencies": latencies, "errors": len(errors)})
+
+
+def runBroker(listener):
+    gevent.reinit()
+    OccupancyAlert.runBroker(listener, False)
+
+
+def runBenchmark(args, sensorCount, subscriberCount):
+    sensorIds = ["BENCH" + str(i) for i in range(0, sensorCount)]
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", args.port))
+    listener.listen(OccupancyAlert.LISTEN_BACKLOG)
+    brokers = [Process(target=runBroker, args=(listener, ))
+               for i in range(0, args.brokers)]
+    for broker in brokers:
+        broker.start()
+    listener.close()
+
+    measureFrom = time.time() + WARMUP_SECONDS
+    stopAt = measureFrom + args.duration + DRAIN_SECONDS
+    subscriberResults = Queue()
+    subscribers = []
+    for p in range(0, args.processes):
+        mine = [sensorIds[i % sensorCount]
+                for i in range(p, subscriberCount, args.processes)]
+        if len(mine) == 0:
+            continue
+        subscriber = Process(target=runSubscribers,
+                             args=(args.port, mine, measureFrom, stopAt,
+                                   subscriberResults))
+        subscriber.start()
+        subscribers.append(subscriber)
+
+    time.sleep(max(0, measureFrom - time.time()))
+    sensorResults = Queue()
+    sensors = [Process(target=replaySensor,
+                       args=(sensorId, args.data, args.rate, args.threshold,
+                             args.duration, sensorResults))
+               for sensorId in sensorIds]
+    for sensor in sensors:
+        sensor.start()
+
+    latencies = []
+    errors = 0
+    for subscriber in subscribers:
+        result = subscriberResults.get()
+        latencies.extend(result["latencies"])
+        errors = errors + result["errors"]
+    sent = [sensorResults.get() for sensor in sensors]
+    for p in sensors + subscribers:
+        p.join()
+    for broker in brokers:
+        broker.terminate()
+        broker.join()
+        try:
+            os.unlink(OccupancyFanout.getBrokerSocketPath(broker.pid))
+        except OSError:
+            pass
+
+    latencies = np.array(latencies)
+    result = {"sensors": sensorCount,
+              "subscribers": subscriberCount,
+              "brokers": args.brokers,
+              "rate": args.rate,
+              "duration": args.duration,
+              "spectrums": sum([s["spectrums"] for s in sent]),
+              "published": sum([s["published"] for s in sent]),
+              "publishDropped": sum([s["dropped"] for s in sent]),
+              "alerts": len(latencies),
+              "alertsPerSecond": len(latencies) / float(args.duration),
+              "subscriberErrors": errors}
+    if len(latencies) != 0:
+        result["latency"] = {
+            "p50": np.percentile(latencies, 50),
+            "p99": np.percentile(latencies, 99),
+            "p999": np.percentile(latencies, 99.9),
+            "max": latencies.max()
+        }
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process command line args")
+    parser.add_argument("-data",
+                        help="Recorded sensor stream",
+                        default="LTE_UL_bc17_ts1012_stream_peak1s.dat")
+    parser.add_argument("-sensors",
+                        help="Comma separated sensor counts",
+                        default="1")
+    parser.add_argument("-subscribers",
+                        help="Comma separated subscriber counts",
+                        default="1,10,100")
+    parser.add_argument("-rate",
+                        help="Spectrums per second per sensor",
+                        type=float,
+                        default=100.0)
+    parser.add_argument("-threshold",
+                        help="Occupancy threshold (dBm)",
+                        type=int,
+                        default=-77)
+    parser.add_argument("-duration",
+                        help="Seconds measured per run",
+                        type=float,
+                        default=10.0)
+    parser.add_argument("-brokers",
+                        help="Broker processes",
+                        type=int,
+                        default=1)
+    parser.add_argument("-processes",
+                        help="Subscriber processes",
+                        type=int,
+                        default=4)
+    parser.add_argument("-port",
+                        help="Broker port (not the one of a running system)",
+                        type=int,
+                        default=19001)
+    parser.add_argument("-out",
+                        help="Results file (JSON lines)",
+                        default="occupancy-alert-benchmark.json")
+    args = parser.parse_args()
+    try:
+        with open(args.out, "a") as out:
+            for sensorCount in [int(s) for s in args.sensors.split(",")]:
+                for subscriberCount in [int(s) for s in
+                                        args.subscribers.split(",")]:
+                    result = runBenchmark(args, sensorCount,
+                                          subscriberCount)
+                    result["time"] = time.time()
+                    print json.dumps(result)
+                    out.write(json.dumps(result) + "\n")
+                    out.flush()
+    except:
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,2 @@
+echo "Occupancy alert latency / throughput benchmark. Results are appended to occupancy-alert-benchmark.json"
+python benchmark-occupancy-alert.py -data LTE_UL_bc17_ts1012_stream_peak1s.dat -sensors 1,10 -subscribers 10,100,1000 -duration 10
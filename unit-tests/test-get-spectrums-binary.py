@@ -0,0 +1,107 @@
+#! /usr/local/bin/python2.7
+# -*- coding: utf-8 -*-
+#
+# This software was developed by employees of the National Institute of
+# Standards and Technology (NIST), and others.
+# This software has been contributed to the public domain.
+# Pursuant to title 15 Untied States Code Section 105, works of NIST
+# employees are not subject to copyright protection in the United States
+# and are considered to be in the public domain.
+# As a result, a formal license is not needed to use this software.
+#
+# This software is provided "AS IS."
+# NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+# OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+# AND DATA ACCURACY.  NIST does not warrant or make any representations
+# regarding the use of the software or the results thereof, including but
+# not limited to the correctness, accuracy, reliability or usefulness of
+
+import unittest
+import requests
+import argparse
+import sys
+import os
+import BootstrapPythonPath
+BootstrapPythonPath.setPath()
+import BinaryStream
+
+
+class TestGetSpectrumsBinary(unittest.TestCase):
+    def setUp(self):
+        global host
+        global webPort
+        self.url = "https://" + str(host) + ":" + str(webPort)
+        r = requests.post(
+            self.url + "/spectrumbrowser/isAuthenticationRequired",
+            verify=False)
+        json = r.json()
+        if json["AuthenticationRequired"]:
+            print(
+                "please disable authentication on the server and configure sensor for streaming"
+            )
+            sys.exit()
+        self.sessionToken = json["SessionToken"]
+
+    def getBinary(self, api):
+        global sensorId
+        global freqRange
+        global startTime
+        global seconds
+        url = self.url + "/spectrumbrowser/" + api + "/" + sensorId + "/" + \
+            freqRange.replace(":", "/") + "/" + str(startTime) + "/" + \
+            str(seconds) + "/" + self.sessionToken + "?format=binary"
+        r = requests.post(url, verify=False, stream=True)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.headers["content-type"], "application/octet-stream")
+        return BinaryStream.readBinaryStream(r.raw)
+
+    def test_get_spectrums_binary(self):
+        header, times, rows = self.getBinary("getSpectrums")
+        print header, rows.shape
+        self.assertEqual(header["kind"], "power")
+        self.assertTrue(rows.shape[0] > 0)
+        self.assertEqual(rows.shape[0], len(times))
+        self.assertEqual(rows.shape[1], header["shape"][1])
+
+    def test_get_occupancies_binary(self):
+        header, times, rows = self.getBinary("getOccupancies")
+        print header, rows.shape
+        self.assertEqual(header["kind"], "occupancy")
+        self.assertTrue(rows.shape[0] > 0)
+        self.assertTrue((rows >= 0).all())
+        self.assertTrue((times[1:] >= times[:-1]).all())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process command line args")
+    parser.add_argument("-host", help="Server host.")
+    parser.add_argument("-port", help="Server port.")
+    parser.add_argument("-sensorId", help="Sensor ID")
+    parser.add_argument("-freqRange",
+                        help="sys2detect:minFreq:maxFreq e.g. LTE:703970000:714050000")
+    parser.add_argument("-startTime", help="Start time (absolute UTC)")
+    parser.add_argument("-seconds", help="Interval", default="100")
+    args = parser.parse_args()
+    global host
+    global webPort
+    global sensorId
+    global freqRange
+    global startTime
+    global seconds
+    host = args.host
+    if host is None:
+        host = os.environ.get("MSOD_WEB_HOST")
+    webPort = args.port
+    if webPort is None:
+        webPort = "443"
+    sensorId = args.sensorId
+    freqRange = args.freqRange
+    startTime = args.startTime
+    seconds = args.seconds
+
+    if host is None or sensorId is None or freqRange is None or startTime is None:
+        print "Require host, sensorId, freqRange and startTime"
+        sys.exit()
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestGetSpectrumsBinary)
+    unittest.TextTestRunner(verbosity=2).run(suite)
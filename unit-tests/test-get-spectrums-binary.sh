@@ -0,0 +1 @@
+python test-get-spectrums-binary.py -sensorId E6R16W5XS -freqRange LTE:703970000:714050000 -startTime 1433875348 -seconds 100 -host $MSOD_WEB_HOST -port 443
@@ -0,0 +1,121 @@
+#! /usr/local/bin/python2.7
+# -*- coding: utf-8 -*-
+#
+# This software was developed by employees of the National Institute of
+# Standards and Technology (NIST), and others.
+# This software has been contributed to the public domain.
+# Pursuant to title 15 Untied States Code Section 105, works of NIST
+# employees are not subject to copyright protection in the United States
+# and are considered to be in the public domain.
+# As a result, a formal license is not needed to use this software.
+#
+# This software is provided "AS IS."
+# NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+# OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+# AND DATA ACCURACY.  NIST does not warrant or make any representations
+# regarding the use of the software or the results thereof, including but
+# not limited to the correctness, accuracy, reliability or usefulness of
+# this software.
+
+# Run on the server host: the metrics endpoints only listen on localhost.
+import unittest
+import json
+import requests
+import argparse
+import os
+import time
+import BootstrapPythonPath
+BootstrapPythonPath.setPath()
+import Metrics
+
+
+def parseMetrics(text):
+    """
+    The samples of a metrics page: name (with labels) -> value.
+    """
+    samples = {}
+    for line in text.splitlines():
+        if line == "" or line.startswith("#"):
+            continue
+        (name, value) = line.rsplit(" ", 1)
+        samples[name] = float(value)
+    return samples
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        params = {}
+        params["emailAddress"] = "admin@nist.gov"
+        params["password"] = "Administrator12!"
+        params["privilege"] = "admin"
+        r = requests.post(
+            "https://" + host + ":" + webPort + "/admin/authenticate",
+            data=json.dumps(params),
+            verify=False)
+        resp = r.json()
+        self.token = resp["sessionId"]
+
+    def testLocalEndpoints(self):
+        for service in ["spectrumbrowser", "admin"]:
+            url = "http://localhost:" + str(Metrics.METRICS_PORTS[service]) + \
+                "/metrics"
+            r = requests.get(url)
+            print url, r.status_code
+            self.assertTrue(r.status_code == 200)
+            samples = parseMetrics(r.text)
+            # The login of setUp went through the admin service.
+            if service == "admin":
+                self.assertTrue(samples["admin_http_requests_total"] > 0)
+                self.assertTrue(
+                    'admin_http_request_seconds_bucket{le="+Inf"}' in samples)
+
+    def testCountersIncrease(self):
+        url = "http://localhost:" + str(Metrics.METRICS_PORTS["admin"]) + \
+            "/metrics"
+        before = parseMetrics(requests.get(url).text)
+        for i in range(0, 10):
+            requests.post("https://" + host + ":" + webPort +
+                          "/admin/getMetrics/" + self.token,
+                          verify=False)
+        # Counts are flushed to memcache every FLUSH_INTERVAL.
+        time.sleep(Metrics.FLUSH_INTERVAL * 2)
+        after = parseMetrics(requests.get(url).text)
+        self.assertTrue(after["admin_http_requests_total"] >=
+                        before["admin_http_requests_total"] + 10)
+
+    def testGetMetrics(self):
+        r = requests.post("https://" + host + ":" + webPort +
+                          "/admin/getMetrics/" + self.token,
+                          verify=False)
+        self.assertTrue(r.status_code == 200)
+        resp = r.json()
+        print json.dumps(resp, indent=4)
+        self.assertTrue(resp["status"] == "OK")
+        self.assertTrue("admin" in resp["services"])
+        requestCount = resp["services"]["admin"]["http_requests_total"]
+        self.assertTrue(requestCount["type"] == "counter")
+
+    def tearDown(self):
+        r = requests.post(
+            "https://" + host + ":" + webPort + "/admin/logOut/" + self.token,
+            verify=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process command line args")
+    parser.add_argument("-host", help="Server host.")
+    parser.add_argument("-port", help="Server port.")
+    args = parser.parse_args()
+    global host
+    global webPort
+    host = args.host
+    if host is None:
+        host = os.environ.get("MSOD_WEB_HOST")
+    if host is None:
+        host = "localhost"
+    webPort = args.port
+    if webPort is None:
+        webPort = "8443"
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestMetrics)
+    unittest.TextTestRunner(verbosity=2).run(suite)
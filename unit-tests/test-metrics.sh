@@ -0,0 +1,2 @@
+echo "Metrics test - run on the server host (the metrics endpoints listen on localhost)."
+python test-metrics.py -host localhost -port 8443
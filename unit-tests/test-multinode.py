@@ -0,0 +1,160 @@
+#! /usr/local/bin/python2.7
+# -*- coding: utf-8 -*-
+#
+#This software was developed by employees of the National Institute of
+#Standards and Technology (NIST), and others.
+#This software has been contributed to the public domain.
+#Pursuant to title 15 Untied States Code Section 105, works of NIST
+#employees are not subject to copyright protection in the United States
+#and are considered to be in the public domain.
+#As a result, a formal license is not needed to use this software.
+#
+#This software is provided "AS IS."
+#NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+#OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+#AND DATA ACCURACY.  NIST does not warrant or make any representations
+#regarding the use of the software or the results thereof, including but
+#not limited to the correctness, accuracy, reliability or usefulness of
+#this software.
+'''
+Multi node ingest test, on one host.
+
+Starts a second streaming server (ingest node) next to the one of the
+installation, streams from the simulated sensors of SensorLoadGenerator
+and checks that:
+
+    - the sensors are spread across both nodes (IngestRegistry owners).
+    - when the second node dies (killed with its processes), its sensors
+      are released after IngestRegistry.NODE_TIMEOUT and are sent to the
+      remaining node when they connect again.
+
+Must run on the server host:
+
+    python test-multinode.py -create -purge -sensors 6 -rate 10
+'''
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+import traceback
+import BootstrapPythonPath
+BootstrapPythonPath.setPath()
+import SensorLoadGenerator
+import IngestRegistry
+
+# Seconds to wait for the second node to register.
+START_TIMEOUT = 30
+
+
+def startNode(args):
+    streamingServer = os.path.join(BootstrapPythonPath.getSbHome(),
+                                   "services", "streaming",
+                                   "StreamingServer.py")
+    command = ["python", streamingServer, "--daemon", "False",
+               "--nodeId", args.nodeId,
+               "--port", str(args.port),
+               "--controlPort", str(args.controlPort),
+               "--wsgiPort", str(args.wsgiPort),
+               "--pidfile", "/tmp/" + args.nodeId + ".pid",
+               "--logfile", "/tmp/" + args.nodeId + ".log"]
+    # Own process group, to kill the node with all its processes.
+    node = subprocess.Popen(command, preexec_fn=os.setsid)
+    endTime = time.time() + START_TIMEOUT
+    while time.time() < endTime:
+        if args.nodeId in [n[IngestRegistry.NODE_ID]
+                           for n in IngestRegistry.getLiveNodes()]:
+            return node
+        time.sleep(1)
+    os.killpg(node.pid, signal.SIGKILL)
+    raise Exception("Node " + args.nodeId + " did not register")
+
+
+def getSensorNodes(sensorIds):
+    owners = IngestRegistry.getOwners()
+    return dict((sensorId, owners.get(sensorId)) for sensorId in sensorIds)
+
+
+def check(condition, message):
+    print ("PASS " if condition else "FAIL ") + message
+    return condition
+
+
+def runTest(args, sensorIds):
+    passed = True
+    node = startNode(args)
+    try:
+        nodeIds = [n[IngestRegistry.NODE_ID]
+                   for n in IngestRegistry.getLiveNodes()]
+        passed = check(len(nodeIds) >= 2,
+                       "live nodes " + str(nodeIds)) and passed
+        wait = SensorLoadGenerator.startLoad(args.url, sensorIds,
+                                             args.duration,
+                                             bins=args.bins,
+                                             sensorKey=args.sensorKey,
+                                             processes=args.processes)
+        time.sleep(args.duration / 2)
+        owners = getSensorNodes(sensorIds)
+        print "owners ", owners
+        passed = check(None not in owners.values(),
+                       "all sensors owned") and passed
+        passed = check(len(set(owners.values())) >= 2,
+                       "sensors spread across nodes") and passed
+        moved = [sensorId for sensorId in sensorIds
+                 if owners[sensorId] == args.nodeId]
+        os.killpg(node.pid, signal.SIGKILL)
+        node.wait()
+        node = None
+        wait()
+    finally:
+        if node is not None:
+            os.killpg(node.pid, signal.SIGKILL)
+            node.wait()
+
+    # The heartbeat of the remaining nodes releases the dead one.
+    time.sleep(IngestRegistry.NODE_TIMEOUT +
+               2 * IngestRegistry.HEARTBEAT_INTERVAL)
+    owners = getSensorNodes(moved)
+    passed = check(args.nodeId not in owners.values(),
+                   "sensors of the dead node released") and passed
+    wait = SensorLoadGenerator.startLoad(args.url, moved, args.duration,
+                                         bins=args.bins,
+                                         sensorKey=args.sensorKey,
+                                         processes=args.processes)
+    time.sleep(args.duration / 2)
+    owners = getSensorNodes(moved)
+    print "owners ", owners
+    passed = check(None not in owners.values() and
+                   args.nodeId not in owners.values(),
+                   "sensors moved to the remaining node") and passed
+    results = wait()
+    passed = check(len([r for r in results if r["error"] is not None]) == 0,
+                   "sensors streamed after the move") and passed
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process command line args")
+    SensorLoadGenerator.addArguments(parser)
+    parser.add_argument("-nodeId", help="ID of the second node",
+                        default="testnode2")
+    parser.add_argument("-port", help="Streaming port of the second node",
+                        type=int, default=9100)
+    parser.add_argument("-controlPort",
+                        help="Control port of the second node",
+                        type=int, default=9150)
+    parser.add_argument("-wsgiPort", help="WSGI port of the second node",
+                        type=int, default=8104)
+    args = parser.parse_args()
+    sensorIds = SensorLoadGenerator.getSensorIds(args)
+    sessionId = SensorLoadGenerator.setUpSensors(args, sensorIds)
+    try:
+        passed = runTest(args, sensorIds)
+    except:
+        traceback.print_exc()
+        passed = False
+    finally:
+        SensorLoadGenerator.tearDownSensors(args, sessionId, sensorIds)
+    sys.exit(0 if passed else 1)
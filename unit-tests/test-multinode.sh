@@ -0,0 +1,2 @@
+echo "Multi node ingest test - run on the server host. Starts a second streaming server (testnode2) on port 9100."
+python test-multinode.py -url https://localhost:8443 -create -purge -template E6R16W5XS.config.json -prefix NODE -sensors 6 -rate 10 -bins 1024 -duration 30
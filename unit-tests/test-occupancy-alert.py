@@ -38,12 +38,13 @@ import json as js
 from bson.json_util import dumps
 import BootstrapPythonPath
 BootstrapPythonPath.setPath()
+import OccupancyFanout
 
 global msodConfig
 msodConfig = None
 
 
-def registerForAlert(serverUrl, sensorId, quiet):
+def registerForAlert(serverUrl, sensorId, quiet, protocol=1):
 
     try:
         parsedUrl = urlparse.urlsplit(serverUrl)
@@ -62,21 +63,36 @@ def registerForAlert(serverUrl, sensorId, quiet):
         else:
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             sock.connect((parsedUrl.hostname(), port))
-        request = {"SensorID": sensorId}
-        req = dumps(request)
-        sock.send(req)
+        if protocol == 2:
+            sock.send(OccupancyFanout.packSubscription(sensorId))
+            decoder = OccupancyFanout.AlertDecoder()
+        else:
+            request = {"SensorID": sensorId}
+            req = dumps(request)
+            sock.send(req)
         startTime = time.time()
         alertCounter = 0
+        latencySum = 0.0
         try:
             while True:
                 try:
-                    occupancy = sock.recv()
-                    if occupancy is None or len(occupancy) == 0:
-                        break
-                    a = bitarray(endian="big")
-                    a.frombytes(occupancy)
-                    if not quiet:
-                        print a
+                    if protocol == 2:
+                        try:
+                            (seq, timestamp, occupancy) = decoder.read(sock)
+                        except EOFError:
+                            break
+                        latency = time.time() - timestamp
+                        latencySum = latencySum + latency
+                        if not quiet:
+                            print seq, latency, occupancy
+                    else:
+                        occupancy = sock.recv()
+                        if occupancy is None or len(occupancy) == 0:
+                            break
+                        a = bitarray(endian="big")
+                        a.frombytes(occupancy)
+                        if not quiet:
+                            print a
                     alertCounter = alertCounter + 1
                 except KeyboardInterrupt:
                     break
@@ -104,6 +120,8 @@ def registerForAlert(serverUrl, sensorId, quiet):
             estimatedStorage = alertCounter * 7
             print "Elapsed time ", elapsedTime, " Seconds; ", " alertCounter = ", \
                      alertCounter, " Storage: Data ", estimatedStorage, " bytes"
+            if protocol == 2 and alertCounter != 0:
+                print "Mean alert latency ", latencySum / alertCounter, " Seconds"
     except:
         traceback.print_exc()
         raise
@@ -200,6 +218,9 @@ if __name__ == "__main__":
         parser.add_argument('-rc', help='receiver count')
         parser.add_argument('-host', help='host')
         parser.add_argument('-port', help='port')
+        parser.add_argument('-protocol',
+                            help='occupancy alert protocol version (1 or 2)',
+                            default="1")
         parser.set_defaults(quiet=False)
         parser.set_defaults(secure=True)
         parser.set_defaults(rc=1)
@@ -227,7 +248,7 @@ if __name__ == "__main__":
 
         for i in range(0, rc):
             t = Process(target=registerForAlert,
-                        args=(url, sensorId, quietFlag))
+                        args=(url, sensorId, quietFlag, int(args.protocol)))
             t.start()
         if sendData:
             sendStream(url, sensorId, dataFile)
@@ -0,0 +1,125 @@
+#! /usr/local/bin/python2.7
+# -*- coding: utf-8 -*-
+#
+#This software was developed by employees of the National Institute of
+#Standards and Technology (NIST), and others.
+#This software has been contributed to the public domain.
+#Pursuant to title 15 Untied States Code Section 105, works of NIST
+#employees are not subject to copyright protection in the United States
+#and are considered to be in the public domain.
+#As a result, a formal license is not needed to use this software.
+#
+#This software is provided "AS IS."
+#NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+#OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+#AND DATA ACCURACY.  NIST does not warrant or make any representations
+#regarding the use of the software or the results thereof, including but
+#not limited to the correctness, accuracy, reliability or usefulness of
+#this software.
+
+# Records a sensor stream with StreamRecorder (no server needed) and checks
+# that every recorded file replays with SensorLoadGenerator.readRecording.
+import unittest
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+import BootstrapPythonPath
+BootstrapPythonPath.setPath()
+import StreamRecorder
+import SensorLoadGenerator
+
+SENSOR_ID = "RECORDERTEST"
+
+N = 56
+
+
+def makeHeaders(fStart):
+    headers = SensorLoadGenerator.makeHeaders(
+        SENSOR_ID, "NaN",
+        {"SensorID": SENSOR_ID,
+         "streaming": {"streamingSecondsPerFrame": 0.1},
+         "thresholds": {"LTE": {"active": True, "systemToDetect": "LTE",
+                                "minFreqHz": fStart,
+                                "maxFreqHz": fStart + 10080000}}}, N)
+    return [(h["Type"], json.dumps(h)) for h in headers]
+
+
+class TestStreamRecorder(unittest.TestCase):
+    def setUp(self):
+        self.recordingDir = StreamRecorder.RECORDING_DIR
+        StreamRecorder.RECORDING_DIR = tempfile.mkdtemp()
+        self.recorder = StreamRecorder.StreamRecorder(SENSOR_ID, 1, 16)
+        self.rng = np.random.RandomState(0)
+
+    def record(self, count):
+        spectrums = self.rng.randint(-128, 128, (count, N)).astype(np.int8)
+        for i in range(0, count):
+            self.recorder.writeSpectrum(i * 0.1, spectrums[i])
+        return spectrums
+
+    def replay(self):
+        self.recorder.close()
+        retval = []
+        for recording in StreamRecorder.listRecordings(SENSOR_ID):
+            retval.append(SensorLoadGenerator.readRecording(os.path.join(
+                StreamRecorder.getRecordingDir(SENSOR_ID),
+                recording["file"])))
+        return retval
+
+    def getData(self, headers):
+        return [h for h in headers if h["Type"] == "Data"][0]
+
+    def testHeadersBeforeSpectrums(self):
+        for (headerType, header) in makeHeaders(703970000):
+            self.recorder.writeHeader(headerType, header)
+        # Sent again before any spectrum: replaces the first one.
+        (headerType, header) = makeHeaders(733960000)[2]
+        self.recorder.writeHeader(headerType, header)
+        spectrums = self.record(10)
+        recordings = self.replay()
+        self.assertTrue(len(recordings) == 1)
+        (headers, replayed) = recordings[0]
+        self.assertTrue(
+            self.getData(headers)["mPar"]["fStart"] == 733960000)
+        self.assertTrue(np.array_equal(replayed, spectrums))
+
+    def testHeaderChangeMidStream(self):
+        for (headerType, header) in makeHeaders(703970000):
+            self.recorder.writeHeader(headerType, header)
+        first = self.record(10)
+        (headerType, header) = makeHeaders(733960000)[2]
+        self.recorder.writeHeader(headerType, header)
+        second = self.record(20)
+        recordings = self.replay()
+        self.assertTrue(len(recordings) == 2)
+        (headers, replayed) = recordings[0]
+        self.assertTrue(
+            self.getData(headers)["mPar"]["fStart"] == 703970000)
+        self.assertTrue(np.array_equal(replayed, first))
+        (headers, replayed) = recordings[1]
+        self.assertTrue(len(headers) == 3)
+        self.assertTrue(
+            self.getData(headers)["mPar"]["fStart"] == 733960000)
+        self.assertTrue(np.array_equal(replayed, second))
+
+    def testRotation(self):
+        for (headerType, header) in makeHeaders(703970000):
+            self.recorder.writeHeader(headerType, header)
+        spectrums = self.record(2 * 1024 * 1024 // N)
+        recordings = self.replay()
+        self.assertTrue(len(recordings) >= 2)
+        replayed = np.concatenate([r[1] for r in recordings])
+        self.assertTrue(np.array_equal(replayed, spectrums))
+
+    def tearDown(self):
+        self.recorder.close()
+        shutil.rmtree(StreamRecorder.RECORDING_DIR)
+        StreamRecorder.RECORDING_DIR = self.recordingDir
+
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestStreamRecorder)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,116 @@
+#! /usr/local/bin/python2.7
+# -*- coding: utf-8 -*-
+#
+#This software was developed by employees of the National Institute of
+#Standards and Technology (NIST), and others.
+#This software has been contributed to the public domain.
+#Pursuant to title 15 Untied States Code Section 105, works of NIST
+#employees are not subject to copyright protection in the United States
+#and are considered to be in the public domain.
+#As a result, a formal license is not needed to use this software.
+#
+#This software is provided "AS IS."
+#NIST MAKES NO WARRANTY OF ANY KIND, EXPRESS, IMPLIED
+#OR STATUTORY, INCLUDING, WITHOUT LIMITATION, THE IMPLIED WARRANTY OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, NON-INFRINGEMENT
+#AND DATA ACCURACY.  NIST does not warrant or make any representations
+#regarding the use of the software or the results thereof, including but
+#not limited to the correctness, accuracy, reliability or usefulness of
+#this software.
+
+# Run on the server host: reads the spectrum history and the recordings.
+# Replays a recorded sensor stream (its data message has the standard
+# "Compression": "None") through the streaming server and checks that the
+# spectrums are ingested and the message is recorded as sent.
+import unittest
+import argparse
+import os
+import time
+import requests
+import json
+import numpy as np
+import BootstrapPythonPath
+BootstrapPythonPath.setPath()
+import SensorLoadGenerator
+import SpectrumHistory
+import StreamRecorder
+import msgutils
+
+SENSOR_ID = "DATREPLAY0"
+
+# Seconds to stream.
+DURATION = 10
+
+
+class TestStreamingDatReplay(unittest.TestCase):
+    def setUp(self):
+        self.sessionId = SensorLoadGenerator.adminLogin(
+            url, "admin@nist.gov", "Administrator12!")
+        SensorLoadGenerator.createSensors(url, self.sessionId,
+                                          "E6R16W5XS.config.json",
+                                          [SENSOR_ID], 0.1)
+        r = requests.post(url + "/admin/setStreamRecording/" + SENSOR_ID +
+                          "/" + self.sessionId,
+                          data=json.dumps({"enabled": True}),
+                          verify=False)
+        self.assertTrue(r.status_code == 200)
+
+    def testReplay(self):
+        (recorded, spectrums) = SensorLoadGenerator.readRecording(dataFile)
+        data = [h for h in recorded if h["Type"] == "Data"][0]
+        self.assertTrue(data["Compression"] == "None")
+        sensor = SensorLoadGenerator.SimulatedSensor(url, SENSOR_ID, "NaN",
+                                                     spectrums, recorded)
+        sensor.run(DURATION)
+        print json.dumps(sensor.getResult(), indent=4)
+        # The server did not drop the connection.
+        self.assertTrue(sensor.error is None)
+        self.assertTrue(sensor.sent > 0)
+        time.sleep(1)
+
+        band = SensorLoadGenerator.getActiveBand(
+            SensorLoadGenerator.getSensorConfig(url, SENSOR_ID))
+        bandName = msgutils.freqRange(band["systemToDetect"],
+                                      band["minFreqHz"], band["maxFreqHz"])
+        (timestamps, powers) = SpectrumHistory.readHistory(SENSOR_ID,
+                                                           bandName)
+        total = SpectrumHistory.getHistoryCount(SENSOR_ID, bandName)
+        print "spectrums ingested ", total
+        self.assertTrue(len(powers) > 0)
+        # The newest spectrums of the history are those last ingested.
+        expected = spectrums[np.arange(total - len(powers), total) %
+                             len(spectrums)]
+        self.assertTrue(np.array_equal(powers, expected))
+
+        recordings = StreamRecorder.listRecordings(SENSOR_ID)
+        self.assertTrue(len(recordings) > 0)
+        (headers, replayed) = SensorLoadGenerator.readRecording(
+            os.path.join(StreamRecorder.getRecordingDir(SENSOR_ID),
+                         recordings[0]["file"]))
+        data = [h for h in headers if h["Type"] == "Data"][0]
+        self.assertTrue(data["Compression"] == "None")
+        self.assertTrue(len(replayed) > 0)
+
+    def tearDown(self):
+        requests.post(url + "/admin/setStreamRecording/" + SENSOR_ID + "/" +
+                      self.sessionId,
+                      data=json.dumps({"enabled": False}),
+                      verify=False)
+        SensorLoadGenerator.purgeSensors(url, self.sessionId, [SENSOR_ID])
+        SensorLoadGenerator.adminLogout(url, self.sessionId)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process command line args")
+    parser.add_argument("-url", help="Server base URL",
+                        default="https://localhost:8443")
+    parser.add_argument("-data", help="Recorded .dat file",
+                        default="LTE_UL_bc17_ts1012_stream_peak1s.dat")
+    args = parser.parse_args()
+    global url
+    global dataFile
+    url = args.url
+    dataFile = args.data
+    suite = unittest.TestLoader().loadTestsFromTestCase(
+        TestStreamingDatReplay)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,2 @@
+echo "Replays LTE_UL_bc17_ts1012_stream_peak1s.dat through the streaming server - run on the server host."
+python test-streaming-dat-replay.py -url https://localhost:8443 -data LTE_UL_bc17_ts1012_stream_peak1s.dat
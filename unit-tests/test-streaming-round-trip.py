@@ -30,6 +30,9 @@ import os
 from bson.json_util import loads, dumps
 import numpy as np
 from collections import deque
+import BootstrapPythonPath
+BootstrapPythonPath.setPath()
+import StreamingFanout
 
 secure = True
 
@@ -39,6 +42,8 @@ DATA_MESSAGE_SEEN = 4
 
 errorFlag = False
 
+frameFormat = StreamingFanout.CSV_FORMAT
+
 
 class ReceiverThread(threading.Thread):
     def __init__(self, sensorId, SessionToken, freqRange, runLength, semaphore,
@@ -50,7 +55,10 @@ class ReceiverThread(threading.Thread):
         else:
             self.ws = create_connection("ws://127.0.0.1:8000/sensordata")
         token = SessionToken + ":" + sensorId + ":" + freqRange
+        if frameFormat != StreamingFanout.CSV_FORMAT:
+            token = token + ":" + frameFormat
         self.ws.send(token)
+        self.decoder = StreamingFanout.ViewerFrameDecoder()
         self.state = STATUS_MESSAGE_NOT_SEEN
         self.delta = []
         self.interArrivalTime = []
@@ -89,6 +97,9 @@ class ReceiverThread(threading.Thread):
             else:
                 self.count = self.count + 1
                 recvTime = time.time()
+                if frameFormat != StreamingFanout.CSV_FORMAT:
+                    # Decoding checks the frame (and delta chain) is intact.
+                    self.decoder.decode(data)
                 if self.timingQueue is None:
                     # no timing queue means we are just a load generation client
                     if self.count >= self.runLength:
@@ -179,10 +190,14 @@ if __name__ == "__main__":
     parser.add_argument("-nConsumers",
                         help="Number of simulated web browser clients")
     parser.add_argument("-baseUrl", help="Access URL for spectrumbrowser")
+    parser.add_argument("-format",
+                        help="Websocket frame format: csv, binary or binary-delta",
+                        default=StreamingFanout.CSV_FORMAT)
 
     args = parser.parse_args()
     filename = args.data
     sensorId = args.sensorId
+    frameFormat = args.format
     url = args.baseUrl
     if url is None:
         url = "http://localhost:8000"